@@ -0,0 +1,84 @@
+# app/aio_db.py
+import asyncio
+import contextvars
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import Request
+from .metrics import connect_factory, suspended
+from .pragmas import apply_pragmas
+
+DB_WORKERS = int(os.getenv("DMP_DB_WORKERS", "4"))
+
+class AsyncSQLite:
+    """
+    Async access to one SQLite file through a small dedicated executor.
+
+    Every worker thread keeps one long-lived connection, so a request awaits
+    a future instead of holding a threadpool slot, and never pays connection
+    setup. Open it in the app's lifespan handler and inject it with Depends.
+    """
+
+    def __init__(self, db_path, workers=DB_WORKERS):
+        self.db_path = db_path
+        self.workers = workers
+        self._executor = None
+        self._local = threading.local()
+        self._conns = []
+        self._conns_lock = threading.Lock()
+
+    async def open(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sqlite")
+        return self
+
+    async def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._conns_lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns.clear()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, factory=connect_factory())
+            conn.row_factory = sqlite3.Row
+            with suspended():  # setup, not the SQL of the request that opens the connection
+                apply_pragmas(conn)
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def _call(self, fn, args):
+        return fn(self._conn(), *args)
+
+    async def run(self, fn, *args):
+        """Run fn(conn, *args) on a worker thread's connection and await the result."""
+        loop = asyncio.get_running_loop()
+        # carry the caller's contextvars into the worker (run_in_executor does not)
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, ctx.run, self._call, fn, args)
+
+    async def fetchall(self, sql, params=()):
+        return await self.run(lambda conn: [dict(r) for r in conn.execute(sql, params)])
+
+    async def fetchone(self, sql, params=()):
+        def one(conn):
+            row = conn.execute(sql, params).fetchone()
+            return dict(row) if row is not None else None
+        return await self.run(one)
+
+    async def execute(self, sql, params=()):
+        """Execute one write statement and commit it."""
+        def write(conn):
+            with conn:
+                return conn.execute(sql, params).rowcount
+        return await self.run(write)
+
+def get_async_db(request: Request) -> AsyncSQLite:
+    """FastAPI dependency: the AsyncSQLite opened by the app's lifespan."""
+    return request.app.state.db
@@ -1,22 +1,125 @@
 # app/db.py
 import os
+import queue
 import sqlite3
-from flask import g
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from flask import g, has_request_context, request
+from .metrics import connect_factory, suspended
+from .pragmas import PRAGMAS, WRITE_PRAGMAS, apply_pragmas
 
-def _connect():
-    db_path = os.getenv("DB_PATH", "dmp.db")
-    conn = sqlite3.connect(db_path)
+# Idle connections kept per pool (per process, per mode)
+POOL_SIZE = int(os.getenv("DMP_DB_POOL_SIZE", "8"))
+
+def _db_path():
+    return os.getenv("DB_PATH", "dmp.db")
+
+def _connect(db_path=None, readonly=False):
+    db_path = db_path or _db_path()
+    if readonly:
+        uri = Path(db_path).absolute().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, factory=connect_factory())
+    else:
+        conn = sqlite3.connect(db_path, check_same_thread=False, factory=connect_factory())
     conn.row_factory = sqlite3.Row  # rows behave like dicts
+    with suspended():  # setup, not the SQL of the request that happens to open the connection
+        apply_pragmas(conn, PRAGMAS if readonly else {**PRAGMAS, **WRITE_PRAGMAS})
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
     return conn
 
-def get_db():
-    """Get a per-request SQLite connection (cached on flask.g)."""
+class ConnectionPool:
+    """
+    Per-process pool of tuned connections to one database file.
+
+    Read-only and read-write connections are kept in separate LIFO stacks
+    (most recently used first, so their page caches stay warm). Bulk writes
+    go through the single shared writer, serialized by a lock.
+    """
+
+    def __init__(self, db_path, size=POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._idle = {True: queue.LifoQueue(), False: queue.LifoQueue()}
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+    def acquire(self, readonly=True):
+        try:
+            return self._idle[readonly].get_nowait()
+        except queue.Empty:
+            return _connect(self.db_path, readonly=readonly)
+
+    def release(self, conn, readonly=True):
+        if conn.in_transaction:
+            conn.rollback()
+        idle = self._idle[readonly]
+        if idle.qsize() < self.size:
+            idle.put(conn)
+        else:
+            conn.close()
+
+    @contextmanager
+    def writer(self):
+        """Exclusive access to the pool's single writer connection."""
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = _connect(self.db_path, readonly=False)
+            try:
+                yield self._writer
+            except Exception:
+                if self._writer.in_transaction:
+                    self._writer.rollback()
+                raise
+
+    def close(self):
+        for idle in self._idle.values():
+            while True:
+                try:
+                    idle.get_nowait().close()
+                except queue.Empty:
+                    break
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_path=None):
+    db_path = db_path or _db_path()
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(db_path, ConnectionPool(db_path))
+    return pool
+
+def get_db(readonly=None):
+    """
+    Get a pooled SQLite connection for this request (cached on flask.g).
+
+    GET/HEAD requests get a read-only connection unless readonly=False.
+    """
     if "db" not in g:
-        g.db = _connect()
+        if readonly is None:
+            readonly = has_request_context() and request.method in ("GET", "HEAD")
+        pool = get_pool()
+        g.db = pool.acquire(readonly)
+        g.db_lease = (pool, readonly)
     return g.db
 
+@contextmanager
+def get_writer():
+    """The process-wide writer connection, for imports and other bulk writes."""
+    with get_pool().writer() as conn:
+        yield conn
+
 def close_db(e=None):
-    """Close the connection at the end of the request/app context."""
+    """Return the connection to its pool at the end of the request/app context."""
     db = g.pop("db", None)
+    lease = g.pop("db_lease", None)
     if db is not None:
-        db.close()
+        pool, readonly = lease
+        pool.release(db, readonly)
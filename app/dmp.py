@@ -1,65 +1,31 @@
 # app/dmp.py
-import os, json
-import xml.etree.ElementTree as ET
-from .db import get_db  # <- we only call this inside functions
+import os, json, sqlite3, uuid
+from xml.sax.saxutils import escape as _xml_escape
+from .cache import LRUCache
+from .db import get_db, get_writer  # <- we only call these inside functions
+from .lookups import lookups
+from .metrics import phase
+from .queries import (DMP_APPOINTMENTS, DMP_APPOINTMENTS_MANY, DMP_EVENTS, DMP_EVENTS_MANY, DMP_JSON, DMP_JSON_MANY,
+                      DMP_MEDICATIONS, DMP_MEDICATIONS_MANY, DMP_PATIENT, DMP_PATIENTS_MANY, PATIENT_GUID_PAGE)
+from .serialize import dumps
+from .validation import dmp_errors
+
+# Per-patient passport cache; entries are keyed by PatientGuid and tagged with
+# the patient's patient_versions counter (bumped by triggers, see load_to_sqlite.py)
+DMP_CACHE_SIZE = int(os.getenv("DMP_CACHE_SIZE", "1024"))
+dmp_cache = LRUCache(DMP_CACHE_SIZE)
+
+# Passport assembly engine: "python" (one query per table, rows built into
+# dicts here) or "sql" (SQLite builds the JSON text itself in one statement;
+# see app/queries.py). Both produce the same passport, byte for byte.
+DMP_ENGINE = os.getenv("DMP_ENGINE", "python")
 
 def _fetch(conn, sql, params=()):
     c = conn.execute(sql, params)
     cols = [d[0] for d in c.description]
     return [dict(zip(cols, r)) for r in c.fetchall()]
 
-def build_dmp(conn, patient_guid: str):
-    # --- patient ---
-    rows = _fetch(conn, """
-        SELECT PatientGuid, Forenames, Surname, Sex, PostCode, DateOfBirth
-        FROM patients
-        WHERE PatientGuid = ?
-    """, (patient_guid,))
-    if not rows:
-        return None
-    p = rows[0]
-
-    # --- medications ---  (alias your schema columns to exporter keys)
-    meds = _fetch(conn, """
-        SELECT
-            MedicationGuid,
-            Term,
-            Dosage,
-            COALESCE(EffectiveDateTime, IssuedDate, '') AS StartDate,
-            COALESCE(DrugStatus, Status, 1)            AS Status,
-            PrescriptionType
-        FROM medications
-        WHERE PatientGuid = ?
-        ORDER BY StartDate DESC
-    """, (patient_guid,))
-
-    # --- appointments ---
-    appts = _fetch(conn, """
-        SELECT
-            AppointmentGuid,
-            StartDateTime,
-            EndDateTime,
-            CurrentStatus AS Status,
-            SessionLocation AS Location
-        FROM appointments
-        WHERE PatientGuid = ?
-        ORDER BY StartDateTime DESC
-    """, (patient_guid,))
-
-    # --- events ---
-    events = _fetch(conn, """
-        SELECT
-            EventGuid,
-            EventType,
-            Term,
-            ReadCode,
-            SnomedCTCode,
-            EffectiveDateTime
-        FROM events
-        WHERE PatientGuid = ?
-        ORDER BY EffectiveDateTime DESC
-    """, (patient_guid,))
-
+def _assemble(p, meds, appts, events):
     # Split allergies/immunisations (EventType 11, 13)
     allergies      = [e for e in events if e.get("EventType") == 11]
     immunisations  = [e for e in events if e.get("EventType") == 13]
@@ -78,61 +44,416 @@ def build_dmp(conn, patient_guid: str):
         "Immunisations": immunisations,
     }
 
-def export_dmp_json(patient_guid: str, save: bool = False, outdir: str = "data/exports"):
-    conn = get_db()
-    dmp = build_dmp(conn, patient_guid)
-    if not dmp:
+def build_dmp_json(conn, patient_guid: str):
+    """The passport as compact JSON text, assembled by SQLite; None if unknown."""
+    row = conn.execute(DMP_JSON, (patient_guid,)).fetchone()
+    return row[1] if row else None
+
+def build_dmp_json_many(conn, patient_guids):
+    """{PatientGuid: passport JSON text} in input order, from one statement; unknown GUIDs are omitted."""
+    guids = list(dict.fromkeys(patient_guids))
+    if not guids:
+        return {}
+    found = {r[0]: r[1] for r in conn.execute(DMP_JSON_MANY, (json.dumps(guids),))}
+    return {g: found[g] for g in guids if g in found}
+
+# Request timing (app/metrics.py): passport assembly is booked to "build",
+# code labels to "decode" and JSON/XML encoding to "serialize"; the SQL inside
+# each is counted separately. Generators never yield inside a phase, so time
+# spent by the consumer of a stream is not booked to it.
+def _decode(dmp):
+    with phase("decode"):
+        return lookups.decode_dmp(dmp)
+
+def _decode_many(dmps):
+    with phase("decode"):
+        return {g: lookups.decode_dmp(d) for g, d in dmps.items()}
+
+@phase("build")
+def build_dmp(conn, patient_guid: str, decode: bool = False):
+    """
+    The patient's passport as a dict, None if unknown. decode=True adds a
+    <field>Label next to every coded field (from the in-memory lookups).
+    """
+    if DMP_ENGINE == "sql":
+        text = build_dmp_json(conn, patient_guid)
+        if text is None:
+            return None
+        dmp = json.loads(text)
+        return _decode(dmp) if decode else dmp
+
+    # --- patient ---
+    rows = _fetch(conn, DMP_PATIENT, (patient_guid,))
+    if not rows:
+        return None
+    p = rows[0]
+
+    meds = _fetch(conn, DMP_MEDICATIONS, (patient_guid,))
+    appts = _fetch(conn, DMP_APPOINTMENTS, (patient_guid,))
+    events = _fetch(conn, DMP_EVENTS, (patient_guid,))
+
+    dmp = _assemble(p, meds, appts, events)
+    return _decode(dmp) if decode else dmp
+
+def _group_by_patient(conn, sql, guids_json):
+    """Run one set-based query and bucket its rows per PatientGuid."""
+    c = conn.execute(sql, (guids_json,))
+    cols = [d[0] for d in c.description][1:]
+    out = {}
+    for r in c.fetchall():
+        out.setdefault(r[0], []).append(dict(zip(cols, r[1:])))
+    return out
+
+@phase("build")
+def build_dmp_many(conn, patient_guids, decode: bool = False):
+    """
+    Build passports for many patients with one query per table.
+
+    The GUID set is passed as a single JSON array parameter and expanded
+    with json_each(), so there is no host-parameter limit on its size.
+    Returns {PatientGuid: dmp} in input order; unknown GUIDs are omitted.
+    decode=True adds code labels, as in build_dmp.
+    """
+    if DMP_ENGINE == "sql":
+        dmps = {g: json.loads(text) for g, text in build_dmp_json_many(conn, patient_guids).items()}
+        return _decode_many(dmps) if decode else dmps
+
+    guids = list(dict.fromkeys(patient_guids))  # de-dupe, keep order
+    if not guids:
+        return {}
+    guids_json = json.dumps(guids)
+
+    patients = {p["PatientGuid"]: p for p in _fetch(conn, DMP_PATIENTS_MANY, (guids_json,))}
+    if not patients:
+        return {}
+
+    meds = _group_by_patient(conn, DMP_MEDICATIONS_MANY, guids_json)
+    appts = _group_by_patient(conn, DMP_APPOINTMENTS_MANY, guids_json)
+    events = _group_by_patient(conn, DMP_EVENTS_MANY, guids_json)
+
+    dmps = {
+        g: _assemble(patients[g], meds.get(g, []), appts.get(g, []), events.get(g, []))
+        for g in guids if g in patients
+    }
+    return _decode_many(dmps) if decode else dmps
+
+def _guid_pages(conn, page_size):
+    """PatientGuids in order, page_size at a time (keyset: PatientGuid > last seen)."""
+    last = ""
+    while True:
+        guids = [r[0] for r in conn.execute(PATIENT_GUID_PAGE, (last, page_size))]
+        if not guids:
+            return
+        yield guids
+        last = guids[-1]
+
+def iter_dmps(conn, page_size: int = 500, decode: bool = False):
+    """
+    Yield every passport in the database, PatientGuid order.
+
+    Patients are walked with keyset pagination (PatientGuid > last seen) and
+    each page is built with build_dmp_many, so memory stays bounded by
+    page_size regardless of population size.
+    """
+    for guids in _guid_pages(conn, page_size):
+        yield from build_dmp_many(conn, guids, decode=decode).values()
+
+def iter_dmp_ndjson(conn, page_size: int = 500, decode: bool = False):
+    """Stream all passports as NDJSON: one compact JSON document per line."""
+    if DMP_ENGINE == "sql" and not decode:
+        # SQLite's text is already the compact encoding: no parse/re-serialize
+        for guids in _guid_pages(conn, page_size):
+            texts = build_dmp_json_many(conn, guids)
+            with phase("serialize"):
+                chunk = b"".join(text.encode("utf-8") + b"\n" for text in texts.values())
+            yield chunk
+        return
+    for dmp in iter_dmps(conn, page_size, decode=decode):
+        with phase("serialize"):
+            line = dumps(dmp) + b"\n"
+        yield line
+
+def passport_version(conn, patient_guid: str):
+    """
+    Return the patient's change counter, or None when the database has no
+    patient_versions table (older dmp.db) and passports must not be cached.
+    """
+    try:
+        row = conn.execute(
+            "SELECT Version FROM patient_versions WHERE PatientGuid = ?", (patient_guid,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else 0
+
+# version= default of the export functions: read patient_versions here
+_UNREAD = object()
+
+def _cached_passport(conn, patient_guid: str, version=_UNREAD):
+    """
+    Return the cache entry ({"version", "dmp" and/or "json", lazily "json_pretty"/"xml"})
+    for the patient's version, rebuilding it when stale. None if unknown.
+    Pass the version the caller already read (e.g. for its ETag) to skip
+    reading it again and to tag the body with that same version.
+    """
+    if version is _UNREAD:
+        version = passport_version(conn, patient_guid)
+    if version is not None:
+        entry = dmp_cache.get(patient_guid)
+        if entry is not None and entry["version"] == version:
+            return entry
+    if DMP_ENGINE == "sql":
+        text = build_dmp_json(conn, patient_guid)
+        if text is None:
+            return None
+        entry = {"version": version, "json": text.encode("utf-8")}
+    else:
+        dmp = build_dmp(conn, patient_guid)
+        if not dmp:
+            return None
+        entry = {"version": version, "dmp": dmp}
+    if version is not None:
+        dmp_cache.put(patient_guid, entry)
+    return entry
+
+def _entry_dmp(entry):
+    """The entry's passport as a dict (parsed from its JSON when the sql engine built it)."""
+    dmp = entry.get("dmp")
+    if dmp is None:
+        dmp = entry["dmp"] = json.loads(entry["json"])
+    return dmp
+
+def export_dmp_json(patient_guid: str, save: bool = False, outdir: str = "data/exports", pretty: bool = False,
+                    decode: bool = False, version=_UNREAD):
+    """
+    The passport as JSON bytes (compact unless pretty=True) and the saved path, if any.
+    decode=True adds code labels; those bodies are not cached (labels follow the lookup files).
+    version: the patient's passport_version() if the caller already has it.
+    """
+    entry = _cached_passport(get_db(), patient_guid, version)
+    if not entry:
         return None, "not_found"
-    text = json.dumps(dmp, ensure_ascii=False, indent=2, default=str)
+    if decode:
+        dmp = _decode(_entry_dmp(entry))
+        with phase("serialize"):
+            body = dumps(dmp, pretty=pretty)
+    else:
+        key = "json_pretty" if pretty else "json"
+        body = entry.get(key)
+        if body is None:
+            with phase("serialize"):
+                body = entry[key] = dumps(_entry_dmp(entry), pretty=pretty)
     path = None
     if save:
         os.makedirs(outdir, exist_ok=True)
         path = os.path.join(outdir, f"{patient_guid}.json")
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(text)
-    return text, path
+        with open(path, "wb") as f:
+            f.write(body)
+    return body, path
+
+XML_DECLARATION = "<?xml version='1.0' encoding='utf-8'?>\n"
+
+def iter_xml(tag: str, data):
+    """
+    Incrementally render data as XML, yielding string chunks.
 
-def _dict_to_xml(tag: str, data):
-    elem = ET.Element(tag)
+    Dicts become child elements per key, lists become repeated <item>
+    elements and scalars become text; empty values render as <tag />.
+    """
     if isinstance(data, dict):
+        if not data:
+            yield f"<{tag} />"
+            return
+        yield f"<{tag}>"
         for k, v in data.items():
-            child = _dict_to_xml(k, v)
-            elem.append(child)
+            yield from iter_xml(k, v)
+        yield f"</{tag}>"
     elif isinstance(data, list):
+        if not data:
+            yield f"<{tag} />"
+            return
+        yield f"<{tag}>"
         for item in data:
-            child = _dict_to_xml("item", item)
-            elem.append(child)
+            yield from iter_xml("item", item)
+        yield f"</{tag}>"
     else:
         # scalar
-        elem.text = "" if data is None else str(data)
-    return elem
+        text = "" if data is None else str(data)
+        yield f"<{tag}>{_xml_escape(text)}</{tag}>" if text else f"<{tag} />"
+
+def dmp_to_xml(dmp: dict) -> str:
+    """Render one passport as a standalone XML document."""
+    with phase("serialize"):
+        return XML_DECLARATION + "".join(iter_xml("DigitalMedicalPassport", dmp))
+
+def iter_dmp_xml(conn, page_size: int = 500, decode: bool = False):
+    """Stream all passports as one XML document, one chunk per passport."""
+    yield XML_DECLARATION + "<DigitalMedicalPassports>"
+    for dmp in iter_dmps(conn, page_size, decode=decode):
+        with phase("serialize"):
+            chunk = "".join(iter_xml("DigitalMedicalPassport", dmp))
+        yield chunk
+    yield "</DigitalMedicalPassports>"
 
-def export_dmp_xml(patient_guid: str, save: bool = False, outdir: str = "data/exports"):
-    text, _ = export_dmp_json(patient_guid, save=False)
-    if text is None:
+def export_dmp_xml(patient_guid: str, save: bool = False, outdir: str = "data/exports", decode: bool = False,
+                   version=_UNREAD):
+    """The passport as XML text and the saved path, if any; decode and version as for export_dmp_json."""
+    entry = _cached_passport(get_db(), patient_guid, version)
+    if not entry:
         return None, "not_found"
-    obj = json.loads(text)
-    root = _dict_to_xml("DigitalMedicalPassport", obj)
-    xml_bytes = ET.tostring(root, encoding="utf-8", xml_declaration=True)
+    if decode:
+        text = dmp_to_xml(_decode(_entry_dmp(entry)))
+    else:
+        text = entry.get("xml")
+        if text is None:
+            text = entry["xml"] = dmp_to_xml(_entry_dmp(entry))
     path = None
     if save:
         os.makedirs(outdir, exist_ok=True)
         path = os.path.join(outdir, f"{patient_guid}.xml")
         with open(path, "wb") as f:
-            f.write(xml_bytes)
-    return xml_bytes.decode("utf-8"), path
+            f.write(text.encode("utf-8"))
+    return text, path
+
+# --- import (passport -> tables) ---
+# Passports follow schemas/dmp_v1.json; rows are upserted by GUID so
+# re-importing the same passport is idempotent.
+IMPORT_COMMIT_SIZE = int(os.getenv("DMP_IMPORT_COMMIT_SIZE", "500"))
+# Child rows without a GUID in the passport get a stable uuid5 from their content
+IMPORT_NAMESPACE = uuid.UUID("8f0d6f3c-55a4-4a5e-9d0b-3f1f6f2b7c10")
+DRUG_STATUS_CODES = {"current": 1, "past": 2, "never": 3}
+# NOT NULL codes the passport does not carry (only used for new rows)
+DEFAULT_PATIENT_TYPE = 4        # Regular
+DEFAULT_PATIENT_STATUS = 1      # Patient has presented
+DEFAULT_PRESCRIPTION_TYPE = 1   # Acute
+UNKNOWN_APPOINTMENT_STATUS = 11
+
+def _child_guid(patient_guid, kind, *parts):
+    return str(uuid.uuid5(IMPORT_NAMESPACE, "|".join([patient_guid, kind, *("" if p is None else str(p) for p in parts)])))
+
+def _upsert_sql(table, columns, update=None):
+    update = columns[1:] if update is None else update
+    return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT({columns[0]}) DO UPDATE SET " + ", ".join(f"{c} = excluded.{c}" for c in update))
+
+IMPORT_COLUMNS = {
+    "patients":     ["PatientGuid", "Forenames", "Surname", "DateOfBirth", "Sex", "PostCode",
+                     "PatientType", "PatientStatus"],
+    "medications":  ["MedicationGuid", "PatientGuid", "Term", "Dosage", "PrescriptionType",
+                     "DrugStatus", "EffectiveDateTime"],
+    "appointments": ["AppointmentGuid", "PatientGuid", "StartDateTime", "EndDateTime",
+                     "CurrentStatus", "SessionLocation"],
+    "events":       ["EventGuid", "PatientGuid", "EventType", "Term", "ReadCode",
+                     "SnomedCTCode", "EffectiveDateTime"],
+}
+IMPORT_SQL = {t: _upsert_sql(t, cols) for t, cols in IMPORT_COLUMNS.items()}
+# Optional passport fields: a passport without one keeps the stored value (new
+# patients get the insert default). Each patient row ends with one "given"
+# flag per field. PatientType/PatientStatus are never carried, so never updated.
+PATIENT_OPTIONAL = ("Sex", "PostCode")
+IMPORT_SQL["patients"] = (_upsert_sql("patients", IMPORT_COLUMNS["patients"], ["Forenames", "Surname", "DateOfBirth"])
+                          + "".join(f", {c} = CASE WHEN ? THEN excluded.{c} ELSE {c} END" for c in PATIENT_OPTIONAL))
+
+def passport_rows(doc: dict):
+    """Map one (schema-valid) passport to {table: [row tuples]}."""
+    pg = doc["PatientGuid"]
+    parts = doc["Name"].split()
+    forenames, surname = " ".join(parts[:-1]), (parts[-1] if parts else "")
+    rows = {"patients": [(pg, forenames, surname, doc["DOB"], doc.get("Sex", "U"), doc.get("PostCode"),
+                          DEFAULT_PATIENT_TYPE, DEFAULT_PATIENT_STATUS, *(c in doc for c in PATIENT_OPTIONAL))]}
+
+    rows["medications"] = [
+        (_child_guid(pg, "med", m.get("medicationCode"), m["term"], m.get("startDate")),
+         pg, m["term"], m.get("dosage"), m.get("prescriptionType", DEFAULT_PRESCRIPTION_TYPE),
+         DRUG_STATUS_CODES[m["status"]], m.get("startDate", ""))
+        for m in doc.get("Medications", [])
+    ]
+    rows["appointments"] = [
+        (a.get("AppointmentGuid") or _child_guid(pg, "appt", a["startDateTime"], a.get("location")),
+         pg, a["startDateTime"], a.get("endDateTime", a["startDateTime"]),
+         a.get("status", UNKNOWN_APPOINTMENT_STATUS), a.get("location"))
+        for a in doc.get("Appointments", [])
+    ]
+    events = doc.get("Events", [])
+    rows["events"] = [
+        (e.get("EventGuid") or _child_guid(pg, "evt", e["eventType"], e["term"], e["effectiveDateTime"]),
+         pg, e["eventType"], e["term"], e.get("readCode", ""), e.get("snomedCTCode", ""),
+         e["effectiveDateTime"])
+        for e in events
+    ]
+    # Allergies not already present as EventType 11 events become allergy events
+    known = {e["term"].lower() for e in events if e["eventType"] == 11}
+    for a in doc.get("Allergies", []):
+        if a["term"].lower() in known:
+            continue
+        code, system = a.get("code", ""), a.get("codeSystem")
+        rows["events"].append(
+            (_child_guid(pg, "allergy", a["term"], a.get("assertedDate")), pg, 11, a["term"],
+             code if system == "READ" else "", code if system == "SNOMED" else "",
+             a.get("assertedDate", ""))
+        )
+    return rows
+
+class ParseError:
+    """Placeholder for an input record that was not valid JSON (e.g. a bad NDJSON line)."""
+
+    def __init__(self, message):
+        self.message = message
+
+def import_dmps(conn, docs, commit_size: int = IMPORT_COMMIT_SIZE):
+    """
+    Validate and upsert passports; returns one status dict per input record.
+
+    Records are committed in batches of commit_size. Each passport runs in
+    its own savepoint, so a failing record is rolled back on its own and
+    reported without losing the rest of the batch.
+    """
+    results = []
+    pending = 0
+    for i, doc in enumerate(docs):
+        if isinstance(doc, ParseError):
+            results.append({"index": i, "status": "invalid", "errors": [doc.message]})
+            continue
+        if not isinstance(doc, dict):
+            results.append({"index": i, "status": "invalid", "errors": ["<root>: expected a JSON object"]})
+            continue
+        errors = dmp_errors(doc)
+        if errors:
+            results.append({"index": i, "status": "invalid", "patientGuid": doc.get("PatientGuid"),
+                            "errors": errors})
+            continue
+
+        if not conn.in_transaction:
+            conn.execute("BEGIN")
+        conn.execute("SAVEPOINT passport")
+        try:
+            for table, rows in passport_rows(doc).items():
+                if rows:
+                    conn.executemany(IMPORT_SQL[table], rows)
+        except sqlite3.Error as ex:
+            conn.execute("ROLLBACK TO passport")
+            conn.execute("RELEASE passport")
+            results.append({"index": i, "status": "error", "patientGuid": doc["PatientGuid"],
+                            "errors": [f"{type(ex).__name__}: {ex}"]})
+            continue
+        conn.execute("RELEASE passport")
+        results.append({"index": i, "status": "imported", "patientGuid": doc["PatientGuid"]})
+        pending += 1
+        if pending >= commit_size:
+            conn.commit()
+            pending = 0
+    if conn.in_transaction:
+        conn.commit()
+    return results
 
 def import_dmp_json(payload: dict):
     """
-    MVP: validate via JSON Schema (if available) and return PatientGuid.
+    Validate one passport and merge it into the database.
+    Returns (ok, result): result has patientGuid, or error/errors on failure.
     """
-    # Optional schema validation
-    try:
-        from .validation import validate_dmp_json as _validate
-        _validate(payload)
-    except Exception as e:
-        # Let routes decide to 400 on this error
-        raise
-
-    # (No DB merge yet in MVP)
-    return {"patientGuid": payload.get("PatientGuid")}
+    with get_writer() as conn:
+        res = import_dmps(conn, [payload])[0]
+    if res["status"] != "imported":
+        return False, {"error": "import failed" if res["status"] == "error" else "invalid passport",
+                       "errors": res["errors"]}
+    return True, {"patientGuid": res["patientGuid"]}
@@ -0,0 +1,140 @@
+# app/lookups.py
+"""
+Code -> label dictionaries from the data/lookups CSVs (sex, drug_status,
+appointment_status, event_type, ...).
+
+Read by load_to_sqlite.py into the lookups table, and held in memory by the
+API so coded columns can be decoded with a dict lookup instead of a join per
+row. No Flask imports, so the loader can use it too.
+"""
+import csv
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from types import MappingProxyType
+
+LOOKUP_DIR = os.getenv("DMP_LOOKUP_DIR", os.path.join("data", "lookups"))
+# Seconds between checks of the CSVs' mtimes (0: stat on every access)
+LOOKUP_CHECK_INTERVAL = float(os.getenv("DMP_LOOKUP_CHECK_INTERVAL", "2"))
+
+# file stem -> domain, for files that are another name for the same lookup
+# (appt_status.csv is the full list of appointment_status codes)
+LOOKUP_ALIASES = {"appt_status": "appointment_status"}
+
+# Coded fields per record kind: field -> domain. Keys are the API column names
+# and the passport keys (which alias some columns, e.g. Status).
+PATIENT_CODES = {"Sex": "sex", "PatientType": "patient_type", "PatientStatus": "patient_status"}
+APPOINTMENT_CODES = {"CurrentStatus": "appointment_status", "Status": "appointment_status"}
+MEDICATION_CODES = {"DrugStatus": "drug_status", "Status": "drug_status",
+                    "PrescriptionType": "prescription_type"}
+EVENT_CODES = {"EventType": "event_type"}
+
+def _code(text):
+    """Integer codes become ints, so they match the INTEGER columns' values."""
+    text = text.strip()
+    return int(text) if text.isdigit() else text
+
+def iter_lookup_rows(lookup_dir=LOOKUP_DIR):
+    """
+    Yield (domain, code, label) from every <domain>.csv in lookup_dir.
+
+    Files are two columns, code then label, under any header (id/code,
+    label/value); BOMs and stray whitespace around codes are ignored.
+    Subdirectories (e.g. lookups_mvp) are not read.
+    """
+    for path in sorted(Path(lookup_dir).glob("*.csv")):
+        domain = LOOKUP_ALIASES.get(path.stem, path.stem)
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.reader(f)
+            next(reader, None)  # header
+            for row in reader:
+                if len(row) >= 2 and row[0].strip():
+                    yield domain, _code(row[0]), row[1].strip()
+
+def read_lookups(lookup_dir=LOOKUP_DIR):
+    """{domain: {code: label}} as read-only mappings; the first label read for a code wins."""
+    out = {}
+    for domain, code, label in iter_lookup_rows(lookup_dir):
+        out.setdefault(domain, {}).setdefault(code, label)
+    return MappingProxyType({d: MappingProxyType(codes) for d, codes in out.items()})
+
+class Lookups:
+    """
+    The lookup dictionaries, reloaded when the CSVs change.
+
+    Readers get an immutable snapshot (a mapping of mappings), swapped as a
+    whole on reload, so no lock is needed to read one. The directory is
+    stat'ed at most every check_interval seconds; a changed file list, mtime
+    or size triggers a reload. version is a digest of the loaded labels, the
+    same in every process, for use in ETags of decoded responses.
+    """
+
+    def __init__(self, lookup_dir=LOOKUP_DIR, check_interval=LOOKUP_CHECK_INTERVAL):
+        self.lookup_dir = lookup_dir
+        self.check_interval = check_interval
+        self.version = ""
+        self._data = MappingProxyType({})
+        self._signature = None
+        self._checked = float("-inf")
+        self._lock = threading.Lock()
+
+    def _file_signature(self):
+        sig = []
+        for path in sorted(Path(self.lookup_dir).glob("*.csv")):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            sig.append((path.name, st.st_mtime_ns, st.st_size))
+        return tuple(sig)
+
+    def get(self):
+        """The current {domain: {code: label}} snapshot."""
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return self._data
+        with self._lock:
+            if now - self._checked >= self.check_interval:
+                sig = self._file_signature()
+                if sig != self._signature:
+                    data = read_lookups(self.lookup_dir)
+                    text = repr({d: dict(codes) for d, codes in data.items()})
+                    self.version = hashlib.blake2b(text.encode("utf-8"), digest_size=4).hexdigest()
+                    self._data = data
+                    self._signature = sig
+                self._checked = time.monotonic()
+        return self._data
+
+    def label(self, domain, code):
+        """Label for one code, or None if the domain or code is unknown."""
+        codes = self.get().get(domain)
+        return codes.get(code) if codes is not None else None
+
+    def decode(self, record: dict, codes: dict, data=None) -> dict:
+        """
+        Copy of record with a <field>Label key after each coded field
+        (codes: field -> domain, e.g. EVENT_CODES); unknown codes get None.
+        """
+        data = self.get() if data is None else data
+        out = {}
+        for key, value in record.items():
+            out[key] = value
+            domain = codes.get(key)
+            if domain is not None:
+                out[f"{key}Label"] = data.get(domain, {}).get(value)
+        return out
+
+    def decode_dmp(self, dmp: dict) -> dict:
+        """Copy of a passport with labels added to the patient and every coded child field."""
+        data = self.get()  # one snapshot for the whole passport
+        out = self.decode(dmp, PATIENT_CODES, data)
+        for key, codes in (("Medications", MEDICATION_CODES), ("Appointments", APPOINTMENT_CODES),
+                           ("Events", EVENT_CODES), ("Allergies", EVENT_CODES),
+                           ("Immunisations", EVENT_CODES)):
+            out[key] = [self.decode(r, codes, data) for r in dmp.get(key, [])]
+        return out
+
+# Process-wide instance used by the API
+lookups = Lookups()
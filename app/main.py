@@ -1,115 +1,200 @@
 # app/main.py
+from collections import namedtuple
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi.responses import PlainTextResponse
+import os
 import sqlite3
+import threading
+from types import MappingProxyType
+from . import metrics
+from .aio_db import AsyncSQLite, get_async_db
 
 API_KEY = "secret123"  # dummy token for Phase 4
 
 # ------------ security ------------
-def require_api_key(x_api_key: str = Header(None)):
+async def require_api_key(x_api_key: str = Header(None)):
     if x_api_key != API_KEY:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
 # ------------ db helpers ------------
+DB_PATH = os.getenv("MEDICAL_DB", "medical.db")
+
 def get_db():
-    conn = sqlite3.connect("medical.db")
+    """Plain synchronous connection (scripts/tools); endpoints use AsyncSQLite."""
+    conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     return conn
 
-def patient_fk(conn) -> str:
-    """Return the FK column name used in child tables."""
-    # prefer 'patient_id', else 'PatientGuid', else 'patientGuid'
-    for col in ("patient_id", "PatientGuid", "patientGuid"):
-        try:
-            conn.execute(f"SELECT 1 FROM Patients LIMIT 1")  # table exists
-            # does Patients have this column?
-            cols = [r[1] for r in conn.execute("PRAGMA table_info(Patients)")]
-            if col in cols or col == "patient_id":
-                return col if col in cols else "patient_id"
-        except Exception:
-            pass
+def _columns(conn, table):
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+
+def patient_fk(conn, table) -> str:
+    """Column of a child table that references Patients (its declared foreign key), else patient_id."""
+    for fk in conn.execute(f"PRAGMA foreign_key_list({table})"):
+        if fk[2].lower() == "patients":
+            return fk[3]
     return "patient_id"
 
-def patient_cols(conn):
+def patient_cols(conn, cols=None):
     """Return a tuple: (id_col, name_cols list) for Patients table."""
-    cols = [r[1] for r in conn.execute("PRAGMA table_info(Patients)")]
+    cols = _columns(conn, "Patients") if cols is None else cols
     if {"PatientGuid","FirstName","LastName","DateOfBirth"}.issubset(set(cols)):
         return "PatientGuid", ["FirstName","LastName","DateOfBirth"]
     # default to our schema
     return "patient_id", ["name","dob","gender"]
 
+# One resolved mapping: Patients id column, visible field tuple and {endpoint: SQL}
+SchemaMapping = namedtuple("SchemaMapping", "id_col fields sql")
+
+class SchemaCache:
+    """
+    Column mapping for the Patients/Events tables, plus the SQL for every
+    endpoint built from it.
+
+    Resolved once on first use. Each request only stats the database file;
+    when the file changed, PRAGMA schema_version tells whether the schema
+    itself changed (or the file was replaced) and the mapping is re-detected.
+    get() returns an immutable SchemaMapping; a re-detection publishes a new
+    one with a single assignment, so a request never mixes old and new parts.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._state = None  # (file signature, schema_version, SchemaMapping)
+
+    def _file_signature(self):
+        try:
+            st = os.stat(self.db_path)
+        except OSError:
+            return None
+        return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def get(self, conn) -> SchemaMapping:
+        sig = self._file_signature()
+        state = self._state
+        if state is not None and sig == state[0]:
+            return state[2]
+        with self._lock:
+            state = self._state
+            if state is None or sig != state[0]:
+                version = conn.execute("PRAGMA schema_version").fetchone()[0]
+                old = state[0] if state is not None else None
+                same_file = old is not None and sig is not None and sig[:2] == old[:2]
+                mapping = state[2] if same_file and version == state[1] else self._detect(conn)
+                state = self._state = (sig, version, mapping)
+        return state[2]
+
+    def _detect(self, conn) -> SchemaMapping:
+        pcols = _columns(conn, "Patients")
+        id_col, fields = patient_cols(conn, pcols)
+        fk = {t: patient_fk(conn, t) for t in ("Appointments", "Medications", "Events")}
+        # support either schema: (event_type, description, date) or (type, details, date)
+        ecols = _columns(conn, "Events")
+        ev_type = "event_type" if "event_type" in ecols else "type"
+        desc    = "description" if "description" in ecols else ("details" if "details" in ecols else "description")
+
+        cols = ", ".join([id_col] + fields)
+        sql = {
+            "list": f"SELECT {cols} FROM Patients LIMIT 50",
+            "detail": f"SELECT {cols} FROM Patients WHERE {id_col}=?",
+            "appointments": f"SELECT appointment_id, date, doctor, reason FROM Appointments WHERE {fk['Appointments']}=? ORDER BY date DESC",
+            "medications": f"""SELECT medication_id, drug_name, dose, start_date, end_date
+            FROM Medications WHERE {fk['Medications']}=?
+            ORDER BY COALESCE(start_date, end_date) DESC""",
+            "events": f"SELECT event_id, {ev_type} AS event_type, {desc} AS description, date FROM Events WHERE {fk['Events']}=? ORDER BY date DESC",
+        }
+        return SchemaMapping(id_col, tuple(fields), MappingProxyType(sql))
+
+schema = SchemaCache(DB_PATH)
+
+def _query(conn, name, params=()):
+    """Run one of the schema's prebuilt statements (executes on a DB worker thread)."""
+    sc = schema.get(conn)
+    rows = [dict(r) for r in conn.execute(sc.sql[name], params)]
+    return sc, rows
+
 # ------------ app ------------
-app = FastAPI(title="DMP API")
+@asynccontextmanager
+async def lifespan(app):
+    app.state.db = await AsyncSQLite(DB_PATH).open()
+    yield
+    await app.state.db.close()
+
+class RequestMetricsMiddleware:
+    """
+    Request timing (app/metrics.py) as plain ASGI middleware: adds the
+    Server-Timing header and records the request in the /metrics histograms.
+    AsyncSQLite.run copies the request's context into the DB worker, so its
+    queries are counted against the request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not metrics.ENABLED:
+            return await self.app(scope, receive, send)
+        m = metrics.begin()
+        status = 500
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", ()))
+                headers.append((b"server-timing", m.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            route = scope.get("route")
+            metrics.record(m, "fastapi", scope["method"], getattr(route, "path", "<unmatched>"), status)
+            metrics.clear()
+
+app = FastAPI(title="DMP API", lifespan=lifespan)
+app.add_middleware(RequestMetricsMiddleware)
 
 @app.get("/health")
-def health():
+async def health():
     return {"status": "ok"}
 
+# GET /metrics – Prometheus text format (unauthenticated like /health, no patient data)
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 # GET /patients – list
 @app.get("/patients")
-def list_patients(_=Depends(require_api_key)):
-    conn = get_db()
-    id_col, extra = patient_cols(conn)  # id + visible fields
-    cols = ", ".join([id_col] + extra)
-    rows = conn.execute(f"SELECT {cols} FROM Patients LIMIT 50").fetchall()
-    conn.close()
-    out = []
-    for r in rows:
-        item = {id_col: r[id_col]}
-        for c in extra:
-            item[c] = r[c]
-        out.append(item)
-    return out
+async def list_patients(_=Depends(require_api_key), db: AsyncSQLite = Depends(get_async_db)):
+    sc, rows = await db.run(_query, "list")
+    return [{c: r[c] for c in (sc.id_col, *sc.fields)} for r in rows]
 
 # GET /patients/{guid}
 @app.get("/patients/{guid}")
-def patient_detail(guid: str, _=Depends(require_api_key)):
-    conn = get_db()
-    id_col, extra = patient_cols(conn)
-    cols = ", ".join([id_col] + extra)
-    row = conn.execute(f"SELECT {cols} FROM Patients WHERE {id_col}=?", (guid,)).fetchone()
-    conn.close()
-    if not row:
+async def patient_detail(guid: str, _=Depends(require_api_key), db: AsyncSQLite = Depends(get_async_db)):
+    sc, rows = await db.run(_query, "detail", (guid,))
+    if not rows:
         raise HTTPException(404, "Patient not found")
-    return {c: row[c] for c in [id_col] + extra}
+    return {c: rows[0][c] for c in (sc.id_col, *sc.fields)}
 
 # GET /patients/{guid}/appointments
 @app.get("/patients/{guid}/appointments")
-def patient_appointments(guid: str, _=Depends(require_api_key)):
-    conn = get_db()
-    fk = patient_fk(conn)
-    rows = conn.execute(
-        f"SELECT appointment_id, date, doctor, reason FROM Appointments WHERE {fk}=? ORDER BY date DESC",
-        (guid,),
-    ).fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+async def patient_appointments(guid: str, _=Depends(require_api_key), db: AsyncSQLite = Depends(get_async_db)):
+    _sc, rows = await db.run(_query, "appointments", (guid,))
+    return rows
 
 # GET /patients/{guid}/medications
 @app.get("/patients/{guid}/medications")
-def patient_medications(guid: str, _=Depends(require_api_key)):
-    conn = get_db()
-    fk = patient_fk(conn)
-    rows = conn.execute(
-        f"""SELECT medication_id, drug_name, dose, start_date, end_date
-            FROM Medications WHERE {fk}=?
-            ORDER BY COALESCE(start_date, end_date) DESC""",
-        (guid,),
-    ).fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+async def patient_medications(guid: str, _=Depends(require_api_key), db: AsyncSQLite = Depends(get_async_db)):
+    _sc, rows = await db.run(_query, "medications", (guid,))
+    return rows
 
 # GET /patients/{guid}/events
 @app.get("/patients/{guid}/events")
-def patient_events(guid: str, _=Depends(require_api_key)):
-    conn = get_db()
-    fk = patient_fk(conn)
-    # support either schema: (event_type, description, date) or (type, details, date)
-    cols = [r[1] for r in conn.execute("PRAGMA table_info(Events)")]
-    ev_type = "event_type" if "event_type" in cols else "type"
-    desc    = "description" if "description" in cols else ("details" if "details" in cols else "description")
-    rows = conn.execute(
-        f"SELECT event_id, {ev_type} AS event_type, {desc} AS description, date FROM Events WHERE {fk}=? ORDER BY date DESC",
-        (guid,),
-    ).fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+async def patient_events(guid: str, _=Depends(require_api_key), db: AsyncSQLite = Depends(get_async_db)):
+    _sc, rows = await db.run(_query, "events", (guid,))
+    return rows
@@ -0,0 +1,278 @@
+# app/metrics.py
+"""
+Request-level timing and SQL profiling, shared by the Flask API
+(app/routes.py) and the FastAPI app (app/main.py).
+
+Each request gets a RequestMetrics in a contextvar. Connections made with
+connect_factory() (app/db.py, app/aio_db.py) add to it every query, fetched
+row and second spent in SQLite; phase("build") / phase("serialize") blocks
+add the time spent in Python. A phase counts its own time only: SQL and
+nested phases inside it are booked to themselves, so the phases, sql and the
+remaining "app" time add up to the request total.
+
+At the end of a request the figures go out as a Server-Timing header and
+into in-process histograms, served in Prometheus text format on /metrics
+(per process: scrape each worker, or sum them in the query).
+
+The cost per request is a few perf_counter() calls per query and phase plus
+a handful of histogram updates; DMP_METRICS=0 turns it all off.
+"""
+import bisect
+import contextlib
+import contextvars
+import functools
+import os
+import sqlite3
+import threading
+from time import perf_counter
+
+ENABLED = os.getenv("DMP_METRICS", "1") == "1"
+
+# --- per-request figures ---
+class RequestMetrics:
+    """Figures for one request: phase times (s), SQL time, queries and rows fetched."""
+
+    __slots__ = ("start", "phases", "claimed", "sql", "queries", "rows", "status", "streaming")
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.phases = {}
+        self.claimed = 0.0  # seconds already booked to sql or a phase
+        self.sql = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.status = None
+        self.streaming = False  # body still to be produced: record when the stream ends
+
+    def add_sql(self, seconds, queries=0, rows=0):
+        self.sql += seconds
+        self.claimed += seconds
+        self.queries += queries
+        self.rows += rows
+
+    def elapsed(self):
+        return perf_counter() - self.start
+
+    def server_timing(self):
+        """Server-Timing header value (durations in ms, up to now)."""
+        total = self.elapsed()
+        parts = [f'sql;dur={self.sql * 1e3:.3f};desc="{self.queries} queries, {self.rows} rows"']
+        parts += [f"{name};dur={secs * 1e3:.3f}" for name, secs in self.phases.items()]
+        parts.append(f"app;dur={max(total - self.claimed, 0.0) * 1e3:.3f}")
+        parts.append(f"total;dur={total * 1e3:.3f}")
+        return ", ".join(parts)
+
+_current = contextvars.ContextVar("dmp_request_metrics", default=None)
+
+def begin():
+    """Start collecting for the current request; None when metrics are off."""
+    if not ENABLED:
+        return None
+    m = RequestMetrics()
+    _current.set(m)
+    return m
+
+def current():
+    return _current.get()
+
+def clear():
+    _current.set(None)
+
+@contextlib.contextmanager
+def suspended():
+    """Book nothing to the current request inside the block (e.g. connection setup PRAGMAs)."""
+    token = _current.set(None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+class phase:
+    """
+    Book the time spent in a block (minus SQL and nested phases) to a phase:
+    `with phase("serialize"): ...`, or `@phase("build")` on a function.
+    Does nothing outside a request.
+    """
+
+    __slots__ = ("name", "_m", "_t0", "_claimed0")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        m = self._m = _current.get()
+        if m is not None:
+            self._claimed0 = m.claimed
+            self._t0 = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        m = self._m
+        if m is not None:
+            own = perf_counter() - self._t0 - (m.claimed - self._claimed0)
+            m.phases[self.name] = m.phases.get(self.name, 0.0) + own
+            m.claimed += own
+            self._m = None
+
+    def __call__(self, func):
+        name = self.name
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+        return timed
+
+# --- instrumented connections ---
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that books statements, fetched rows and their time to the current request."""
+
+    def execute(self, sql, parameters=()):
+        m = _current.get()
+        if m is None:
+            return super().execute(sql, parameters)
+        t0 = perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            m.add_sql(perf_counter() - t0, queries=1)
+
+    def executemany(self, sql, seq_of_parameters):
+        m = _current.get()
+        if m is None:
+            return super().executemany(sql, seq_of_parameters)
+        t0 = perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            m.add_sql(perf_counter() - t0, queries=1)
+
+    def fetchone(self):
+        m = _current.get()
+        if m is None:
+            return super().fetchone()
+        t0 = perf_counter()
+        row = super().fetchone()
+        m.add_sql(perf_counter() - t0, rows=row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        m = _current.get()
+        if m is None:
+            return super().fetchmany(self.arraysize if size is None else size)
+        t0 = perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        m.add_sql(perf_counter() - t0, rows=len(rows))
+        return rows
+
+    def fetchall(self):
+        m = _current.get()
+        if m is None:
+            return super().fetchall()
+        t0 = perf_counter()
+        rows = super().fetchall()
+        m.add_sql(perf_counter() - t0, rows=len(rows))
+        return rows
+
+    def __next__(self):
+        m = _current.get()
+        if m is None:
+            return super().__next__()
+        t0 = perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            m.add_sql(perf_counter() - t0)
+            raise
+        m.add_sql(perf_counter() - t0, rows=1)
+        return row
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection whose cursors (including conn.execute shortcuts) are InstrumentedCursors."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return super().cursor(InstrumentedCursor).execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return super().cursor(InstrumentedCursor).executemany(sql, seq_of_parameters)
+
+def connect_factory():
+    """factory= for sqlite3.connect: instrumented unless DMP_METRICS=0."""
+    return InstrumentedConnection if ENABLED else sqlite3.Connection
+
+# --- histograms (Prometheus text exposition) ---
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, 10000, 100000)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _fmt(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, as Prometheus expects."""
+
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            s[i] += 1
+            s[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for labels, s in sorted(series.items()):
+            base = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(self.label_names, labels))
+            sep = "," if base else ""
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), s[:-1]):
+                cumulative += n
+                le = bound if bound == "+Inf" else _fmt(bound)
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{base}}} {_fmt(s[-1])}")
+            lines.append(f"{self.name}_count{{{base}}} {cumulative}")
+        return "\n".join(lines)
+
+REQUEST_SECONDS = Histogram("dmp_request_duration_seconds", "Request duration, including streamed bodies.",
+                            ("app", "method", "route", "status"))
+PHASE_SECONDS = Histogram("dmp_request_phase_seconds",
+                          "Time per request in each phase (sql, build, serialize, decode, app).",
+                          ("app", "route", "phase"))
+REQUEST_QUERIES = Histogram("dmp_request_queries", "SQL statements executed per request.",
+                            ("app", "route"), COUNT_BUCKETS)
+REQUEST_ROWS = Histogram("dmp_request_rows", "Rows fetched from SQLite per request.",
+                         ("app", "route"), COUNT_BUCKETS)
+HISTOGRAMS = (REQUEST_SECONDS, PHASE_SECONDS, REQUEST_QUERIES, REQUEST_ROWS)
+
+def record(m, app, method, route, status):
+    """Add one finished request to the histograms."""
+    total = m.elapsed()
+    REQUEST_SECONDS.observe(total, app, method, route, str(status))
+    PHASE_SECONDS.observe(m.sql, app, route, "sql")
+    for name, secs in m.phases.items():
+        PHASE_SECONDS.observe(secs, app, route, name)
+    PHASE_SECONDS.observe(max(total - m.claimed, 0.0), app, route, "app")
+    REQUEST_QUERIES.observe(m.queries, app, route)
+    REQUEST_ROWS.observe(m.rows, app, route)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def render():
+    """Every histogram in Prometheus text exposition format."""
+    return "\n".join(h.render() for h in HISTOGRAMS) + "\n"
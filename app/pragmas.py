@@ -0,0 +1,25 @@
+# app/pragmas.py
+"""
+SQLite connection tuning shared by the Flask pool (app/db.py) and the async
+layer of the FastAPI apps (app/aio_db.py). No Flask imports.
+"""
+import os
+
+# --- tuning (override per deployment via env) ---
+# Applied to every connection.
+PRAGMAS = {
+    "busy_timeout": os.getenv("DMP_SQLITE_BUSY_TIMEOUT", "5000"),   # ms to wait on a lock
+    "cache_size":   os.getenv("DMP_SQLITE_CACHE_SIZE", "-65536"),   # negative = KiB (64 MiB)
+    "mmap_size":    os.getenv("DMP_SQLITE_MMAP_SIZE", "268435456"), # 256 MiB
+    "temp_store":   os.getenv("DMP_SQLITE_TEMP_STORE", "MEMORY"),
+}
+# Applied to the Flask pool's read-write connections only (journal_mode needs write access).
+WRITE_PRAGMAS = {
+    "journal_mode": os.getenv("DMP_SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous":  os.getenv("DMP_SQLITE_SYNCHRONOUS", "NORMAL"),
+}
+
+def apply_pragmas(conn, pragmas=PRAGMAS):
+    """Run PRAGMA name=value for each setting on a new connection."""
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name}={value}")
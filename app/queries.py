@@ -0,0 +1,198 @@
+# app/queries.py
+"""
+Per-patient read queries shared by the API (routes, passport builders) and
+load_to_sqlite.py, which creates the indexes they need and checks their plans.
+
+Plain SQL only (no Flask imports), so the loader can use it outside the app.
+"""
+
+# --- passport column lists ---
+# Shared by the single-patient and batch builders so both produce exactly the
+# same passport shape.
+PATIENT_COLS = "PatientGuid, Forenames, Surname, Sex, PostCode, DateOfBirth"
+
+# Passport keys -> source column or expression (alias your schema columns to exporter keys)
+MEDICATION_FIELDS = (
+    ("MedicationGuid", "MedicationGuid"),
+    ("Term", "Term"),
+    ("Dosage", "Dosage"),
+    ("StartDate", "COALESCE(EffectiveDateTime, '')"),
+    ("Status", "COALESCE(DrugStatus, 1)"),
+    ("PrescriptionType", "PrescriptionType"),
+)
+APPOINTMENT_FIELDS = (
+    ("AppointmentGuid", "AppointmentGuid"),
+    ("StartDateTime", "StartDateTime"),
+    ("EndDateTime", "EndDateTime"),
+    ("Status", "CurrentStatus"),
+    ("Location", "SessionLocation"),
+)
+EVENT_FIELDS = (
+    ("EventGuid", "EventGuid"),
+    ("EventType", "EventType"),
+    ("Term", "Term"),
+    ("ReadCode", "ReadCode"),
+    ("SnomedCTCode", "SnomedCTCode"),
+    ("EffectiveDateTime", "EffectiveDateTime"),
+)
+
+def _select_list(fields):
+    return ",\n            ".join(expr if expr == key else f"{expr} AS {key}" for key, expr in fields)
+
+MEDICATION_COLS = _select_list(MEDICATION_FIELDS)
+APPOINTMENT_COLS = _select_list(APPOINTMENT_FIELDS)
+EVENT_COLS = _select_list(EVENT_FIELDS)
+
+# Row order inside each passport list, newest first. The GUID breaks ties
+# between rows with the same date, so both engines produce one fixed order;
+# load_to_sqlite.py indexes (PatientGuid, <date> DESC, <guid> DESC) to match.
+MEDICATION_ORDER = "StartDate DESC, MedicationGuid DESC"
+APPOINTMENT_ORDER = "StartDateTime DESC, AppointmentGuid DESC"
+EVENT_ORDER = "EffectiveDateTime DESC, EventGuid DESC"
+
+# --- passport queries (build_dmp: one patient) ---
+DMP_PATIENT = f"""
+        SELECT {PATIENT_COLS}
+        FROM patients
+        WHERE PatientGuid = ?
+"""
+DMP_MEDICATIONS = f"""
+        SELECT {MEDICATION_COLS}
+        FROM medications
+        WHERE PatientGuid = ?
+        ORDER BY {MEDICATION_ORDER}
+"""
+DMP_APPOINTMENTS = f"""
+        SELECT {APPOINTMENT_COLS}
+        FROM appointments
+        WHERE PatientGuid = ?
+        ORDER BY {APPOINTMENT_ORDER}
+"""
+DMP_EVENTS = f"""
+        SELECT {EVENT_COLS}
+        FROM events
+        WHERE PatientGuid = ?
+        ORDER BY {EVENT_ORDER}
+"""
+
+# --- passport queries (build_dmp_many: a JSON array of GUIDs as the one parameter) ---
+IN_GUID_SET = "PatientGuid IN (SELECT value FROM json_each(?))"
+
+DMP_PATIENTS_MANY = f"""
+        SELECT {PATIENT_COLS}
+        FROM patients
+        WHERE {IN_GUID_SET}
+"""
+DMP_MEDICATIONS_MANY = f"""
+        SELECT PatientGuid, {MEDICATION_COLS}
+        FROM medications
+        WHERE {IN_GUID_SET}
+        ORDER BY PatientGuid, {MEDICATION_ORDER}
+"""
+DMP_APPOINTMENTS_MANY = f"""
+        SELECT PatientGuid, {APPOINTMENT_COLS}
+        FROM appointments
+        WHERE {IN_GUID_SET}
+        ORDER BY PatientGuid, {APPOINTMENT_ORDER}
+"""
+DMP_EVENTS_MANY = f"""
+        SELECT PatientGuid, {EVENT_COLS}
+        FROM events
+        WHERE {IN_GUID_SET}
+        ORDER BY PatientGuid, {EVENT_ORDER}
+"""
+
+PATIENT_GUID_PAGE = """
+            SELECT PatientGuid
+            FROM patients
+            WHERE PatientGuid > ?
+            ORDER BY PatientGuid
+            LIMIT ?
+"""
+
+# --- passport as JSON text, assembled by SQLite (DMP_ENGINE=sql) ---
+# One statement per patient (or per page of patients): json_object /
+# json_group_array build the whole document, in the same key order and with
+# the same row order as the Python builder, so the text is byte-identical to
+# serialize.dumps(build_dmp(...)). Subquery results are wrapped in json() so
+# they nest as arrays rather than strings.
+#
+# Each list is json_group_array run as a window over the whole partition:
+# a window feeds the aggregate its rows in the OVER (ORDER BY ...) order,
+# whereas a plain aggregate over an ORDER BY subquery has no guaranteed
+# order (aggregate ORDER BY needs SQLite 3.44). LIMIT 1 takes the one value.
+ALLERGY_EVENT, IMMUNISATION_EVENT = 11, 13
+# every character str.strip() removes, so Name matches the Python builder
+_WHITESPACE = ("char(9, 10, 11, 12, 13, 28, 29, 30, 31, 32, 133, 160, 5760, 8192, 8193, 8194, 8195, 8196, "
+               "8197, 8198, 8199, 8200, 8201, 8202, 8232, 8233, 8239, 8287, 12288)")
+
+def _json_array(fields, table, order_by, where=""):
+    obj = ", ".join(f"'{key}', {key}" for key, _expr in fields)
+    return f"""json(COALESCE((SELECT json_group_array(json_object({obj})) OVER (
+                ORDER BY {order_by} ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) FROM (
+            SELECT {_select_list(fields)}
+            FROM {table}
+            WHERE PatientGuid = p.PatientGuid{where}) LIMIT 1), '[]'))"""
+
+def passport_json_sql(where, source="patients p"):
+    """SELECT PatientGuid, <passport JSON text> FROM <source> WHERE <where>."""
+    return f"""
+        SELECT p.PatientGuid, json_object(
+            'PatientGuid', p.PatientGuid,
+            'Name', trim(trim(COALESCE(p.Forenames, ''), {_WHITESPACE}) || ' '
+                         || trim(COALESCE(p.Surname, ''), {_WHITESPACE}), {_WHITESPACE}),
+            'DOB', p.DateOfBirth,
+            'Sex', p.Sex,
+            'PostCode', p.PostCode,
+            'Medications', {_json_array(MEDICATION_FIELDS, "medications", MEDICATION_ORDER)},
+            'Appointments', {_json_array(APPOINTMENT_FIELDS, "appointments", APPOINTMENT_ORDER)},
+            'Events', {_json_array(EVENT_FIELDS, "events", EVENT_ORDER)},
+            'Allergies', {_json_array(EVENT_FIELDS, "events", EVENT_ORDER, f" AND EventType = {ALLERGY_EVENT}")},
+            'Immunisations', {_json_array(EVENT_FIELDS, "events", EVENT_ORDER,
+                                          f" AND EventType = {IMMUNISATION_EVENT}")}
+        )
+        FROM {source}
+        WHERE {where}
+"""
+
+DMP_JSON = passport_json_sql("p.PatientGuid = ?")
+# CROSS JOIN keeps json_each as the outer loop, so patients is searched by
+# key per GUID; with IN (...) a small patients table gets scanned instead.
+DMP_JSON_MANY = passport_json_sql("p.PatientGuid = j.value", "json_each(?) AS j CROSS JOIN patients p")
+
+# --- API list endpoints (/patients/<guid>/appointments|medications|events) ---
+PATIENT_APPOINTMENTS = """
+        SELECT AppointmentGuid, PatientGuid, StartDateTime, EndDateTime, CurrentStatus, SessionLocation
+        FROM appointments
+        WHERE PatientGuid = ?
+        ORDER BY StartDateTime DESC
+"""
+PATIENT_MEDICATIONS = """
+        SELECT MedicationGuid, PatientGuid, Term, Dosage, PrescriptionType, DrugStatus, EffectiveDateTime
+        FROM medications
+        WHERE PatientGuid = ?
+        ORDER BY EffectiveDateTime DESC
+"""
+PATIENT_EVENTS = """
+        SELECT EventGuid, PatientGuid, EventType, Term, ReadCode, SnomedCTCode, EffectiveDateTime
+        FROM events
+        WHERE PatientGuid = ?
+        ORDER BY EffectiveDateTime DESC
+"""
+
+# Every sorted query above with placeholder parameters, for EXPLAIN QUERY PLAN
+# checks (load_to_sqlite.py --check-plans): none of them may need a temp B-tree.
+PLAN_CHECKS = {
+    "dmp.medications": (DMP_MEDICATIONS, ("",)),
+    "dmp.appointments": (DMP_APPOINTMENTS, ("",)),
+    "dmp.events": (DMP_EVENTS, ("",)),
+    "dmp_many.medications": (DMP_MEDICATIONS_MANY, ("[]",)),
+    "dmp_many.appointments": (DMP_APPOINTMENTS_MANY, ("[]",)),
+    "dmp_many.events": (DMP_EVENTS_MANY, ("[]",)),
+    "dmp.patient_page": (PATIENT_GUID_PAGE, ("", 1)),
+    "dmp_json": (DMP_JSON, ("",)),
+    "dmp_json_many": (DMP_JSON_MANY, ("[]",)),
+    "api.appointments": (PATIENT_APPOINTMENTS, ("",)),
+    "api.medications": (PATIENT_MEDICATIONS, ("",)),
+    "api.events": (PATIENT_EVENTS, ("",)),
+}
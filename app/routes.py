@@ -1,58 +1,172 @@
 # app/routes.py
-from flask import Blueprint, jsonify, request, current_app
+import base64, json, os, sqlite3
+from flask import Blueprint, Response, jsonify, request, current_app, stream_with_context
+from . import metrics
 from .auth import require_api_key
-from .db import get_db
-from .dmp import export_dmp_json, export_dmp_xml, import_dmp_json
+from .db import get_db, get_writer
+from .dmp import (IMPORT_COMMIT_SIZE, ParseError, build_dmp_many, export_dmp_json, export_dmp_xml,
+                  import_dmp_json, import_dmps, iter_dmp_ndjson, iter_dmp_xml, passport_version)
+from .lookups import APPOINTMENT_CODES, EVENT_CODES, MEDICATION_CODES, PATIENT_CODES, lookups
+from .queries import PATIENT_APPOINTMENTS, PATIENT_EVENTS, PATIENT_MEDICATIONS
+from .serialize import dumps
 
 api = Blueprint("api", __name__)
 
+# Upper bound on GUIDs per batch export request
+DMP_BATCH_MAX = int(os.getenv("DMP_BATCH_MAX", "5000"))
+
+# Load the lookup dictionaries when the blueprint is registered, not on the first decoded request
+@api.record_once
+def _load_lookups(state):
+    lookups.get()
+
+# --- request timing (app/metrics.py) ---
+# Registered app-wide, so every request gets a Server-Timing header and lands
+# in the /metrics histograms. Streamed exports are recorded when the stream
+# ends (stream_with_context runs teardown again then); their Server-Timing
+# covers the time to the headers only, as those go out before the body.
+@api.before_app_request
+def _start_metrics():
+    metrics.begin()
+
+@api.after_app_request
+def _server_timing(resp):
+    m = metrics.current()
+    if m is not None:
+        m.status = resp.status_code
+        resp.headers["Server-Timing"] = m.server_timing()
+    return resp
+
+@api.teardown_app_request
+def _record_metrics(exc):
+    m = metrics.current()
+    if m is None:
+        return
+    if m.streaming:  # teardown before the body is sent: record at the end of the stream
+        m.streaming = False
+        return
+    rule = request.url_rule
+    metrics.record(m, "flask", request.method, rule.rule if rule else "<unmatched>", m.status or 500)
+    metrics.clear()
+
+def _flag(name):
+    return request.args.get(name) in ("1", "true", "yes")
+
+def _rows(rows, codes):
+    """Row dicts; with ?decode=1 each coded column is followed by its <Col>Label."""
+    if _flag("decode"):
+        with metrics.phase("decode"):
+            data = lookups.get()
+            return [lookups.decode(dict(r), codes, data) for r in rows]
+    return [dict(r) for r in rows]
+
 # --- Health ---
 @api.get("/health")
 def health():
     return jsonify(status="ok", message="API is working")
 
-# --- Patients list (paging + simple search) ---
+# --- Metrics (Prometheus text format; unauthenticated like /health, no patient data) ---
+@api.get("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+# --- Patients list (keyset paging + name search) ---
+def _encode_cursor(row):
+    key = [row["Surname"], row["Forenames"], row["PatientGuid"]]
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii")
+
+def _decode_cursor(cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        return None
+    if not (isinstance(key, list) and len(key) == 3 and all(isinstance(k, str) for k in key)):
+        return None
+    return key
+
+def _name_filter(q):
+    """
+    WHERE fragment + params for a name search.
+
+    Fragments of 3+ characters go through the patients_fts trigram index
+    (substring match, case-insensitive, like the LIKE it replaces); shorter
+    ones cannot be trigram-matched and fall back to LIKE.
+    """
+    if len(q) >= 3:
+        phrase = '"' + q.replace('"', '""') + '"'
+        return ("rowid IN (SELECT rowid FROM patients_fts WHERE patients_fts MATCH ?)", [phrase])
+    frag = f"%{q}%"
+    return ("(Surname LIKE ? OR Forenames LIKE ?)", [frag, frag])
+
 @api.get("/patients")
 @require_api_key
 def list_patients():
     db = get_db()
 
-    # paging
+    # paging: ?cursor=<next_cursor> (keyset); ?offset= is still honoured without a cursor
     try:
-        limit = int(request.args.get("limit", 20))
+        limit = max(1, min(int(request.args.get("limit", 20)), 1000))
     except ValueError:
         limit = 20
     try:
-        offset = int(request.args.get("offset", 0))
+        offset = max(0, int(request.args.get("offset", 0)))
     except ValueError:
         offset = 0
+    cursor = request.args.get("cursor")
+    after = None
+    if cursor:
+        after = _decode_cursor(cursor)
+        if after is None:
+            return jsonify(error="Invalid cursor"), 400
+        offset = 0
 
     # optional search by name fragment
     q = request.args.get("q", "").strip()
+    # total is opt-in (?count=exact): counting every page is a full scan
+    want_total = request.args.get("count") == "exact"
 
-    params = []
-    where = ""
-    if q:
-        where = "WHERE (Surname LIKE ? OR Forenames LIKE ?)"
-        frag = f"%{q}%"
-        params.extend([frag, frag])
+    def run(name_filter):
+        conds, params = [], []
+        if name_filter:
+            conds.append(name_filter[0])
+            params.extend(name_filter[1])
+        where = f"WHERE {' AND '.join(conds)}" if conds else ""
+        total = None
+        if want_total:
+            total = db.execute(f"SELECT COUNT(*) AS c FROM patients {where}", params).fetchone()["c"]
 
-    total = db.execute(f"SELECT COUNT(*) AS c FROM patients {where}", params).fetchone()["c"]
+        if after:
+            conds.append("(Surname, Forenames, PatientGuid) > (?, ?, ?)")
+            params.extend(after)
+        where = f"WHERE {' AND '.join(conds)}" if conds else ""
+        # fetch one extra row to know whether there is a next page
+        rows = db.execute(
+            f"""
+            SELECT PatientGuid, Forenames, Surname, DateOfBirth, Sex, PostCode
+            FROM patients
+            {where}
+            ORDER BY Surname, Forenames, PatientGuid
+            LIMIT ? OFFSET ?
+            """,
+            params + [limit + 1, offset],
+        ).fetchall()
+        return rows, total
 
-    params.extend([limit, offset])
-    rows = db.execute(
-        f"""
-        SELECT PatientGuid, Forenames, Surname, DateOfBirth, Sex, PostCode
-        FROM patients
-        {where}
-        ORDER BY Surname, Forenames
-        LIMIT ? OFFSET ?
-        """,
-        params,
-    ).fetchall()
+    try:
+        rows, total = run(_name_filter(q) if q else None)
+    except sqlite3.OperationalError:
+        if not q:
+            raise
+        # database built before patients_fts existed: plain LIKE scan
+        frag = f"%{q}%"
+        rows, total = run(("(Surname LIKE ? OR Forenames LIKE ?)", [frag, frag]))
 
-    items = [dict(r) for r in rows]
-    return jsonify(items=items, paging={"limit": limit, "offset": offset, "total": total})
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    items = _rows(rows, PATIENT_CODES)
+    next_cursor = _encode_cursor(rows[-1]) if has_more else None
+    return jsonify(items=items, paging={"limit": limit, "offset": offset, "total": total,
+                                        "next_cursor": next_cursor})
 
 # --- Single patient details ---
 @api.get("/patients/<guid>")
@@ -69,90 +183,216 @@ def get_patient(guid):
     ).fetchone()
     if not row:
         return jsonify(error="Not found"), 404
-    return jsonify(dict(row))
+    return jsonify(_rows([row], PATIENT_CODES)[0])
 
 # --- Patient appointments ---
 @api.get("/patients/<guid>/appointments")
 @require_api_key
 def patient_appointments(guid):
-    db = get_db()
-    rows = db.execute(
-        """
-        SELECT AppointmentGuid, PatientGuid, StartDateTime, EndDateTime, CurrentStatus, SessionLocation
-        FROM appointments
-        WHERE PatientGuid = ?
-        ORDER BY StartDateTime DESC
-        """,
-        (guid,),
-    ).fetchall()
-    return jsonify([dict(r) for r in rows])
+    rows = get_db().execute(PATIENT_APPOINTMENTS, (guid,)).fetchall()
+    return jsonify(_rows(rows, APPOINTMENT_CODES))
 
 # --- Patient medications ---
 @api.get("/patients/<guid>/medications")
 @require_api_key
 def patient_medications(guid):
-    db = get_db()
-    rows = db.execute(
-        """
-        SELECT MedicationGuid, PatientGuid, Term, Dosage, PrescriptionType, DrugStatus, EffectiveDateTime
-        FROM medications
-        WHERE PatientGuid = ?
-        ORDER BY EffectiveDateTime DESC
-        """,
-        (guid,),
-    ).fetchall()
-    return jsonify([dict(r) for r in rows])
+    rows = get_db().execute(PATIENT_MEDICATIONS, (guid,)).fetchall()
+    return jsonify(_rows(rows, MEDICATION_CODES))
 
 # --- Patient events (obs/allergies/immunisations etc.) ---
 @api.get("/patients/<guid>/events")
 @require_api_key
 def patient_events(guid):
-    db = get_db()
-    rows = db.execute(
-        """
-        SELECT EventGuid, PatientGuid, EventType, Term, ReadCode, SnomedCTCode, EffectiveDateTime
-        FROM events
-        WHERE PatientGuid = ?
-        ORDER BY EffectiveDateTime DESC
-        """,
-        (guid,),
-    ).fetchall()
-    return jsonify([dict(r) for r in rows])
+    rows = get_db().execute(PATIENT_EVENTS, (guid,)).fetchall()
+    return jsonify(_rows(rows, EVENT_CODES))
+
+# --- Patient summary (pre-aggregated counts, maintained by triggers; see load_to_sqlite.py) ---
+SUMMARY_COLUMNS = """PatientGuid, AppointmentCount, MedicationCount, AllergyCount, ImmunisationCount,
+                     LastAppointment, LastMedication, LastEvent, LastActivity"""
+SUMMARY_RANKINGS = {
+    "appointments": "AppointmentCount",
+    "medications": "MedicationCount",
+    "allergies": "AllergyCount",
+    "immunisations": "ImmunisationCount",
+}
+SUMMARY_MISSING = "patient_summary table missing: rebuild the database with load_to_sqlite.py"
+
+@api.get("/patients/<guid>/summary")
+@require_api_key
+def patient_summary(guid):
+    try:
+        row = get_db().execute(
+            f"SELECT {SUMMARY_COLUMNS} FROM patient_summary WHERE PatientGuid = ?", (guid,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return jsonify(error=SUMMARY_MISSING), 503
+    if not row:
+        return jsonify(error="Not found"), 404
+    return jsonify(dict(row))
+
+@api.get("/summary/top")
+@require_api_key
+def summary_top():
+    by = request.args.get("by", "appointments")
+    col = SUMMARY_RANKINGS.get(by)
+    if col is None:
+        return jsonify(error=f"by must be one of: {', '.join(SUMMARY_RANKINGS)}"), 400
+    try:
+        limit = max(1, min(int(request.args.get("limit", 10)), 100))
+    except ValueError:
+        return jsonify(error="limit must be an integer"), 400
+    try:
+        rows = get_db().execute(
+            f"""
+            SELECT p.PatientGuid, p.Surname, p.Forenames, s.{col} AS Count, s.LastActivity
+            FROM patient_summary s JOIN patients p ON p.PatientGuid = s.PatientGuid
+            ORDER BY s.{col} DESC
+            LIMIT ?
+            """,
+            (limit,),
+        ).fetchall()
+    except sqlite3.OperationalError:
+        return jsonify(error=SUMMARY_MISSING), 503
+    return jsonify(by=by, items=[dict(r) for r in rows])
 
 # --- DMP export (JSON/XML) ---
 @api.get("/patients/<guid>/dmp")
 @require_api_key
 def export_dmp(guid):
     fmt = (request.args.get("format") or "json").lower()
-    save = request.args.get("save") in ("1", "true", "yes")
+    save = _flag("save")
+    pretty = _flag("pretty")
+    decode = _flag("decode")
 
     try:
+        # Conditional GET: the ETag is the patient's change counter, so a
+        # matching If-None-Match is answered from a single primary-key lookup.
+        # The same version is passed on, so the body comes from (or is cached
+        # under) the version the ETag names, without reading it again.
+        version = passport_version(get_db(), guid)
+        rep = f"{fmt}.pretty" if pretty and fmt != "xml" else fmt
+        if decode:
+            lookups.get()
+            rep += f".labels-{lookups.version}"  # labels change with the lookup files, not the patient
+        etag = f"{guid}.{version}.{rep}" if version else None
+        if etag and not save and request.if_none_match.contains(etag):
+            return Response(status=304, headers={"ETag": f'"{etag}"', "Cache-Control": "private, no-cache"})
+
         if fmt == "xml":
-            xml_str, saved_path = export_dmp_xml(guid, save=save)
-            return (xml_str, 200, {"Content-Type": "application/xml"})
+            xml_str, saved_path = export_dmp_xml(guid, save=save, decode=decode, version=version)
+            if xml_str is None:
+                return jsonify(error="Not found"), 404
+            resp = Response(xml_str, mimetype="application/xml")
         else:
-            payload, saved_path = export_dmp_json(guid, save=save)
-            # If saved, include where it was written
-            if save and saved_path:
-                payload["_saved"] = saved_path
-            return jsonify(payload)
+            body, saved_path = export_dmp_json(guid, save=save, pretty=pretty, decode=decode, version=version)
+            if body is None:
+                return jsonify(error="Not found"), 404
+            # already-encoded bytes: sent as-is, no jsonify round trip
+            resp = Response(body, mimetype="application/json")
+        # If saved, say where it was written (the body stays the passport itself)
+        if save and saved_path:
+            resp.headers["X-DMP-Saved"] = saved_path
+        if etag:
+            resp.set_etag(etag)
+            resp.headers["Cache-Control"] = "private, no-cache"
+        return resp
     except Exception as ex:
         current_app.logger.exception("export failed")
         return jsonify(error=f"export failed: {type(ex).__name__}: {ex}"), 500
 
-# --- DMP import (JSON only for MVP) ---
+# --- DMP batch export (JSON) ---
+@api.post("/patients/dmp:batch")
+@require_api_key
+def export_dmp_batch():
+    data = request.get_json(silent=True)
+    # accept either {"guids": [...]} or a bare JSON array
+    guids = data.get("guids") if isinstance(data, dict) else data
+    if not isinstance(guids, list) or not all(isinstance(g, str) for g in guids):
+        return jsonify(error="Expected a JSON array of PatientGuids (or {\"guids\": [...]})"), 400
+    if len(guids) > DMP_BATCH_MAX:
+        return jsonify(error=f"Too many GUIDs (max {DMP_BATCH_MAX})"), 413
+
+    try:
+        dmps = build_dmp_many(get_db(), guids, decode=_flag("decode"))
+    except Exception as ex:
+        current_app.logger.exception("batch export failed")
+        return jsonify(error=f"export failed: {type(ex).__name__}: {ex}"), 500
+
+    missing = [g for g in dict.fromkeys(guids) if g not in dmps]
+    with metrics.phase("serialize"):
+        body = dumps({"items": list(dmps.values()), "missing": missing})
+    return Response(body, mimetype="application/json")
+
+# --- Full-population DMP export (streamed NDJSON / XML) ---
+def _page_size():
+    try:
+        return max(1, min(int(request.args.get("page_size", 500)), DMP_BATCH_MAX))
+    except ValueError:
+        return 500
+
+def _stream_export(iter_fn, mimetype):
+    page_size = _page_size()
+    decode = _flag("decode")
+
+    # open the connection inside the generator: stream_with_context re-pushes the
+    # request context for the stream, and close_db runs when the stream ends
+    def generate():
+        yield from iter_fn(get_db(), page_size=page_size, decode=decode)
+
+    m = metrics.current()
+    if m is not None:
+        m.streaming = True
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+@api.get("/export/dmp.ndjson")
+@require_api_key
+def export_dmp_ndjson():
+    return _stream_export(iter_dmp_ndjson, "application/x-ndjson")
+
+@api.get("/export/dmp.xml")
+@require_api_key
+def export_dmp_xml_stream():
+    return _stream_export(iter_dmp_xml, "application/xml")
+
+# --- DMP import (single passport, JSON array or NDJSON stream) ---
+def _ndjson_docs(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as ex:
+            yield ParseError(f"<root>: invalid JSON ({ex})")
+
 @api.post("/import")
+@require_api_key
 def import_dmp():
-    # Optional: protect with API key too. Uncomment next line if you want.
-    # require_api_key(lambda: None)()  # or decorate with @require_api_key
-
     try:
-        data = request.get_json(force=True, silent=False)
-    except Exception:
-        return jsonify(error="Invalid JSON"), 400
+        commit_size = max(1, int(request.args.get("commit_size", IMPORT_COMMIT_SIZE)))
+    except ValueError:
+        commit_size = IMPORT_COMMIT_SIZE
+
+    if request.mimetype == "application/x-ndjson" or request.args.get("format") == "ndjson":
+        # read line by line: the request body is never held in memory as a whole
+        docs = _ndjson_docs(request.stream)
+    else:
+        try:
+            data = request.get_json(force=True, silent=False)
+        except Exception:
+            return jsonify(error="Invalid JSON"), 400
 
-    ok, res = import_dmp_json(data)
-    if not ok:
-        return jsonify(error=res.get("error", "import failed"), details=res), 400
+        if isinstance(data, dict):
+            ok, res = import_dmp_json(data)
+            if not ok:
+                return jsonify(error=res.get("error", "import failed"), details=res), 400
+            return jsonify(message="DMP imported successfully", patientGuid=res["patientGuid"])
+        if not isinstance(data, list):
+            return jsonify(error="Expected a passport object, a JSON array or NDJSON"), 400
+        docs = data
 
-    return jsonify(message="DMP imported successfully", patientGuid=res["patientGuid"])
+    with get_writer() as conn:
+        results = import_dmps(conn, docs, commit_size=commit_size)
+    summary = {s: sum(1 for r in results if r["status"] == s) for s in ("imported", "invalid", "error")}
+    status = 200 if summary["imported"] or not results else 400
+    return jsonify(summary=summary, results=results), status
@@ -0,0 +1,39 @@
+# app/serialize.py
+import json
+import os
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+def _json_dumps(obj, pretty: bool = False) -> bytes:
+    if pretty:
+        text = json.dumps(obj, ensure_ascii=False, indent=2, default=str)
+    else:
+        text = json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str)
+    return text.encode("utf-8")
+
+def _orjson_dumps(obj, pretty: bool = False) -> bytes:
+    option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+    return orjson.dumps(obj, default=str, option=option)
+
+# Passport serializers by name; DMP_JSON_SERIALIZER picks one (default: orjson if installed)
+SERIALIZERS = {"json": _json_dumps}
+if orjson is not None:
+    SERIALIZERS["orjson"] = _orjson_dumps
+
+SERIALIZER = os.getenv("DMP_JSON_SERIALIZER", "orjson" if orjson is not None else "json")
+if SERIALIZER not in SERIALIZERS:
+    raise RuntimeError(f"DMP_JSON_SERIALIZER={SERIALIZER!r} is not available (have: {', '.join(SERIALIZERS)})")
+
+_dumps = SERIALIZERS[SERIALIZER]
+
+def dumps(obj, pretty: bool = False) -> bytes:
+    """
+    Encode obj as UTF-8 JSON bytes, ready to send or write as-is.
+
+    Compact by default (no spaces); pretty=True indents by two. Values JSON
+    has no type for (dates, Decimals, ...) are written as str(value).
+    """
+    return _dumps(obj, pretty)
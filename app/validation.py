@@ -1,17 +1,84 @@
 import json
 import os
 import logging
-from jsonschema import validate, ValidationError
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache, partial
+from jsonschema import FormatChecker, ValidationError
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
 
-SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "..", "schemas", "dmp_v1.json")
+SCHEMAS_DIR = os.path.join(os.path.dirname(__file__), "..", "schemas")
+SCHEMA_PATH = os.path.join(SCHEMAS_DIR, "dmp_v1.json")
+DEFAULT_VERSION = "v1"
 
 with open(SCHEMA_PATH, "r") as f:
     DMP_SCHEMA = json.load(f)
 
-def validate_dmp(data: dict):
-    try:
-        validate(instance=data, schema=DMP_SCHEMA)
+# ISO-8601 date-time, UTC offset optional: EMIS extracts carry local times
+# without one. (jsonschema's own date-time check is strict RFC 3339, and
+# only active when the optional rfc3339-validator package is installed.)
+_DATE_TIME = re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2}(\.\d{1,6})?)?(Z|[+-]\d{2}:\d{2})?")
+
+def _is_date_time(value):
+    if not isinstance(value, str):
+        return True  # "type" reports non-strings
+    return bool(_DATE_TIME.fullmatch(value)) and datetime.fromisoformat(value) is not None
+
+def format_checker(cls):
+    """
+    The draft's format checker plus uuid (not a draft-07 format, but the
+    schema relies on it) and date-time as above, so the importer never
+    stores malformed GUIDs or dates.
+    """
+    checker = FormatChecker([*cls.FORMAT_CHECKER.checkers, "uuid"])
+    checker.checks("date-time", raises=ValueError)(_is_date_time)
+    return checker
+
+@lru_cache(maxsize=None)
+def get_validator(version: str = DEFAULT_VERSION):
+    """
+    Compiled validator for schemas/dmp_<version>.json.
+
+    The schema is loaded and checked once per version; the validator is then
+    reused for every document (jsonschema.validate rebuilds it on each call).
+    """
+    path = SCHEMA_PATH if version == DEFAULT_VERSION else os.path.join(SCHEMAS_DIR, f"dmp_{version}.json")
+    with open(path, "r") as f:
+        schema = json.load(f)
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema, format_checker=format_checker(cls))
+
+get_validator()  # compile the default schema at import
+
+def validate_dmp(data: dict, version: str = DEFAULT_VERSION):
+    error = best_match(get_validator(version).iter_errors(data))
+    if error is None:
         return True, None
-    except ValidationError as e:
-        logging.warning("DMP schema validation failed: %s", e)  # <— log
-        return False, str(e)
+    logging.warning("DMP schema validation failed: %s", error)  # <— log
+    return False, str(error)
+
+def _format_error(e: ValidationError) -> str:
+    where = "/".join(str(p) for p in e.absolute_path) or "<root>"
+    return f"{where}: {e.message}"
+
+def dmp_errors(data: dict, version: str = DEFAULT_VERSION):
+    """Every schema violation in one document (empty list if valid)."""
+    errors = get_validator(version).iter_errors(data)
+    return [_format_error(e) for e in sorted(errors, key=lambda e: list(map(str, e.absolute_path)))]
+
+def validate_many(docs, version: str = DEFAULT_VERSION, processes: int = None, chunksize: int = 256):
+    """
+    Validate a batch of passports; returns one list of error strings per
+    document, in input order (an empty list means valid).
+
+    With processes > 1 the batch is spread over a process pool; each worker
+    compiles the schema once on import and validates chunksize docs per task.
+    """
+    check = partial(dmp_errors, version=version)
+    if not processes or processes <= 1:
+        return [check(d) for d in docs]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(check, docs, chunksize=chunksize))
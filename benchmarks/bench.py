@@ -0,0 +1,406 @@
+# benchmarks/bench.py
+"""Micro-benchmarks for the passport data layer and both APIs.
+
+Each case times one operation many times against a generated database
+(benchmarks/fixtures.py) and reports p50/p95/p99 latency and ops/sec:
+
+    python benchmarks/bench.py                                 # 1k patients, every case
+    python benchmarks/bench.py --size 100k --filter build_dmp export_dmp
+    python benchmarks/bench.py --group flask --iterations 500
+
+Results are written as JSON (--out, default benchmarks/results/). To catch
+regressions, store a run as the baseline and compare later runs against it;
+the exit status is 1 when a case got slower than --threshold:
+
+    python benchmarks/bench.py --size 1k --save-baseline benchmarks/baseline-1k.json
+    python benchmarks/bench.py --size 1k --baseline benchmarks/baseline-1k.json
+    python benchmarks/bench.py --compare old.json new.json
+
+Groups: data (build_dmp with each engine, export_dmp_json/xml, validate_dmp),
+flask (every app/routes.py endpoint through the Flask test client) and
+fastapi (every app/main.py endpoint through the FastAPI TestClient). The
+import cases write passports of their own PatientGuids (fixtures.bench_guid)
+into the fixture, the same ones on every run.
+"""
+import argparse, json, math, os, platform, sqlite3, subprocess, sys, time
+from contextlib import ExitStack
+from datetime import datetime
+
+import fixtures
+from fixtures import ROOT
+from app.dmp import export_dmp_json, export_dmp_xml
+
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+ITERATIONS = 200          # timed runs per case (heavy cases declare a lower cap)
+WARMUP = 20               # untimed runs first (caches, pools, lazy imports)
+SAMPLE_SIZE = 1000        # patients the cases cycle through
+THRESHOLD = 0.20          # relative slowdown reported as a regression
+MIN_DELTA_MS = 0.01       # ...unless it is below this (timer noise on the fastest cases)
+FLASK_HEADERS = {"X-API-Key": os.environ.get("API_KEY", "mysecretkey")}
+FASTAPI_HEADERS = {"X-API-Key": "secret123"}
+
+# ---------- statistics ----------
+def percentile(sorted_values, p):
+    """p-th percentile (0-100) of an ascending list, linearly interpolated."""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    lo, hi = math.floor(k), math.ceil(k)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+def summarize(samples):
+    """Latency summary (ms) and throughput of one case's timings (seconds)."""
+    s = sorted(samples)
+    total = sum(s)
+    return {
+        "n": len(s),
+        "p50_ms": round(percentile(s, 50) * 1e3, 4),
+        "p95_ms": round(percentile(s, 95) * 1e3, 4),
+        "p99_ms": round(percentile(s, 99) * 1e3, 4),
+        "mean_ms": round(total / len(s) * 1e3, 4) if s else 0.0,
+        "ops_per_sec": round(len(s) / total, 1) if total else 0.0,
+    }
+
+# ---------- cases ----------
+# Each case is a setup(ctx) returning op(i), one timed operation; i counts up
+# so ops can cycle through ctx["guids"]. engines= registers one case per
+# passport engine (app.dmp.DMP_ENGINE is switched around the case).
+CASES = []
+
+def case(name, group, engines=(None,), iterations=None, max_patients=None):
+    def register(setup):
+        for engine in engines:
+            CASES.append({"name": f"{name}[{engine}]" if engine else name, "group": group, "setup": setup,
+                          "engine": engine, "iterations": iterations, "max_patients": max_patients})
+        return setup
+    return register
+
+ENGINES = ("python", "sql")
+
+def _guid(ctx, i):
+    guids = ctx["guids"]
+    return guids[i % len(guids)]
+
+def _checked(resp, status):
+    if resp.status_code != status:
+        raise RuntimeError(f"got HTTP {resp.status_code}, expected {status}")
+    return resp
+
+def _flask_get(path, status=200, headers=None):
+    """setup for GET <path> on the Flask API; {guid} in path cycles through the sample."""
+    def setup(ctx):
+        client = ctx["flask"]
+        hdrs = {**FLASK_HEADERS, **(headers or {})}
+        return lambda i: _checked(client.get(path.format(guid=_guid(ctx, i)), headers=hdrs), status)
+    return setup
+
+def _fastapi_get(path, status=200):
+    def setup(ctx):
+        client = ctx["fastapi"]
+        ids = ctx["medical_ids"]
+        return lambda i: _checked(client.get(path.format(guid=ids[i % len(ids)]), headers=FASTAPI_HEADERS), status)
+    return setup
+
+# --- data layer ---
+@case("build_dmp", "data", engines=ENGINES)
+def _build_dmp(ctx):
+    from app.dmp import build_dmp
+    conn = ctx["conn"]
+    return lambda i: build_dmp(conn, _guid(ctx, i))
+
+@case("build_dmp_many[100]", "data", engines=ENGINES, iterations=50)
+def _build_dmp_many(ctx):
+    from app.dmp import build_dmp_many
+    conn, guids = ctx["conn"], ctx["guids"]
+    pages = [guids[k:k + 100] for k in range(0, len(guids), 100)]
+    return lambda i: build_dmp_many(conn, pages[i % len(pages)])
+
+def _export(fn, cold, **kwargs):
+    """export_dmp_* with the passport cache emptied before every call (cold) or kept warm for one patient."""
+    def setup(ctx):
+        from app.dmp import dmp_cache
+        def op(i):
+            if cold:
+                dmp_cache.clear()
+            fn(_guid(ctx, i if cold else 0), **kwargs)
+        return op
+    return setup
+
+for _label, _fn, _kwargs in (("export_dmp_json", export_dmp_json, {}),
+                             ("export_dmp_json.pretty", export_dmp_json, {"pretty": True}),
+                             ("export_dmp_xml", export_dmp_xml, {})):
+    case(f"{_label}.cold", "data", engines=ENGINES)(_export(_fn, True, **_kwargs))
+    case(f"{_label}.cached", "data")(_export(_fn, False, **_kwargs))
+
+@case("validate_dmp", "data")
+def _validate_dmp(ctx):
+    from app.validation import validate_dmp
+    docs = ctx["passports"]
+    def op(i):
+        ok, err = validate_dmp(docs[i % len(docs)])
+        if not ok:
+            raise RuntimeError(f"fixture passport is invalid: {err}")
+    return op
+
+@case("lookups.decode_dmp", "data")
+def _decode_dmp(ctx):
+    from app.lookups import lookups
+    dmps = ctx["dmps"]
+    return lambda i: lookups.decode_dmp(dmps[i % len(dmps)])
+
+# --- Flask API (app/routes.py) ---
+case("GET /health", "flask")(_flask_get("/health"))
+case("GET /patients", "flask")(_flask_get("/patients?limit=20"))
+case("GET /patients?count=exact", "flask")(_flask_get("/patients?limit=20&count=exact"))
+
+@case("GET /patients?q=", "flask")
+def _search(ctx):
+    client, names = ctx["flask"], ctx["surnames"]
+    return lambda i: _checked(client.get("/patients", query_string={"q": names[i % len(names)]},
+                                         headers=FLASK_HEADERS), 200)
+
+@case("GET /patients?cursor=", "flask")
+def _cursor_page(ctx):
+    client = ctx["flask"]
+    cursor = client.get("/patients?limit=20", headers=FLASK_HEADERS).get_json()["paging"]["next_cursor"]
+    return lambda i: _checked(client.get("/patients", query_string={"limit": 20, "cursor": cursor},
+                                         headers=FLASK_HEADERS), 200)
+
+case("GET /patients/<guid>", "flask")(_flask_get("/patients/{guid}"))
+case("GET /patients/<guid>/appointments", "flask")(_flask_get("/patients/{guid}/appointments"))
+case("GET /patients/<guid>/medications", "flask")(_flask_get("/patients/{guid}/medications"))
+case("GET /patients/<guid>/events", "flask")(_flask_get("/patients/{guid}/events"))
+case("GET /patients/<guid>/events?decode=1", "flask")(_flask_get("/patients/{guid}/events?decode=1"))
+case("GET /patients/<guid>/summary", "flask")(_flask_get("/patients/{guid}/summary"))
+case("GET /summary/top", "flask")(_flask_get("/summary/top?by=appointments&limit=10"))
+case("GET /patients/<guid>/dmp", "flask", engines=ENGINES)(_flask_get("/patients/{guid}/dmp"))
+case("GET /patients/<guid>/dmp?format=xml", "flask")(_flask_get("/patients/{guid}/dmp?format=xml"))
+case("GET /patients/<guid>/dmp?decode=1", "flask")(_flask_get("/patients/{guid}/dmp?decode=1"))
+
+@case("GET /patients/<guid>/dmp (304)", "flask")
+def _dmp_not_modified(ctx):
+    client = ctx["flask"]
+    etags = {}
+    def op(i):
+        guid = _guid(ctx, i)
+        if guid not in etags:
+            etags[guid] = client.get(f"/patients/{guid}/dmp", headers=FLASK_HEADERS).headers["ETag"]
+            return
+        _checked(client.get(f"/patients/{guid}/dmp", headers={**FLASK_HEADERS, "If-None-Match": etags[guid]}), 304)
+    for i in range(len(ctx["guids"])):
+        op(i)  # collect every ETag before timing
+    return op
+
+@case("POST /patients/dmp:batch[100]", "flask", engines=ENGINES, iterations=50)
+def _batch(ctx):
+    client, guids = ctx["flask"], ctx["guids"]
+    pages = [guids[k:k + 100] for k in range(0, len(guids), 100)]
+    return lambda i: _checked(client.post("/patients/dmp:batch", json=pages[i % len(pages)],
+                                          headers=FLASK_HEADERS), 200)
+
+@case("GET /export/dmp.ndjson", "flask", engines=ENGINES, iterations=3, max_patients=100_000)
+def _ndjson(ctx):
+    client = ctx["flask"]
+    return lambda i: _checked(client.get("/export/dmp.ndjson", headers=FLASK_HEADERS), 200).get_data()
+
+@case("GET /export/dmp.xml", "flask", iterations=3, max_patients=100_000)
+def _xml_stream(ctx):
+    client = ctx["flask"]
+    return lambda i: _checked(client.get("/export/dmp.xml", headers=FLASK_HEADERS), 200).get_data()
+
+@case("POST /import", "flask", iterations=100)
+def _import_one(ctx):
+    client, docs = ctx["flask"], ctx["import_docs"]
+    return lambda i: _checked(client.post("/import", json=docs[i % len(docs)], headers=FLASK_HEADERS), 200)
+
+@case("POST /import[50]", "flask", iterations=20)
+def _import_many(ctx):
+    client, docs = ctx["flask"], ctx["import_docs"]
+    return lambda i: _checked(client.post("/import", json=docs, headers=FLASK_HEADERS), 200)
+
+# --- FastAPI (app/main.py, medical.db schema) ---
+case("GET /health", "fastapi")(_fastapi_get("/health"))
+case("GET /patients", "fastapi")(_fastapi_get("/patients"))
+case("GET /patients/{guid}", "fastapi")(_fastapi_get("/patients/{guid}"))
+case("GET /patients/{guid}/appointments", "fastapi")(_fastapi_get("/patients/{guid}/appointments"))
+case("GET /patients/{guid}/medications", "fastapi")(_fastapi_get("/patients/{guid}/medications"))
+case("GET /patients/{guid}/events", "fastapi")(_fastapi_get("/patients/{guid}/events"))
+
+# ---------- runner ----------
+def make_context(stack, db_path, n_patients, groups, rebuild=False):
+    """Everything the selected cases need; cleanup is registered on stack."""
+    os.environ["DB_PATH"] = str(db_path)
+    from app.db import get_pool
+    from app.dmp import build_dmp
+
+    ctx = {"n_patients": n_patients, "guids": fixtures.sample_guids(db_path, SAMPLE_SIZE)}
+    pool = get_pool(str(db_path))
+    stack.callback(pool.close)
+    ctx["conn"] = conn = pool.acquire(readonly=True)
+    stack.callback(pool.release, conn, True)
+    ctx["dmps"] = [build_dmp(conn, g) for g in ctx["guids"][:200]]
+    ctx["passports"] = [fixtures.import_passport(d) for d in ctx["dmps"]]
+    ctx["import_docs"] = [fixtures.import_passport(d, fixtures.bench_guid(k)) for k, d in enumerate(ctx["dmps"][:50])]
+    ctx["surnames"] = sorted({d["Name"].split()[-1][:4] for d in ctx["dmps"] if len(d["Name"].split()[-1]) >= 4})
+
+    app = fixtures.flask_app()
+    ctx["flask"] = app.test_client()
+    # data-layer exports call get_db(), which needs an application context
+    stack.enter_context(app.app_context())
+
+    if "fastapi" in groups:
+        medical = fixtures.medical_db(rebuild)
+        os.environ["MEDICAL_DB"] = str(medical)  # read when app.main is imported
+        from fastapi.testclient import TestClient
+        from app.main import app as fastapi_app
+        ctx["fastapi"] = stack.enter_context(TestClient(fastapi_app))
+        ctx["medical_ids"] = fixtures.sample_guids(medical, SAMPLE_SIZE, "Patients", "patient_id")
+    return ctx
+
+def run_case(c, ctx, iterations, warmup):
+    import app.dmp as dmp_mod
+
+    engine = dmp_mod.DMP_ENGINE
+    if c["engine"]:
+        dmp_mod.DMP_ENGINE = c["engine"]
+    try:
+        op = c["setup"](ctx)
+        for i in range(warmup):
+            op(i)
+        samples = []
+        for i in range(warmup, warmup + iterations):
+            t0 = time.perf_counter()
+            op(i)
+            samples.append(time.perf_counter() - t0)
+    finally:
+        dmp_mod.DMP_ENGINE = engine
+    return summarize(samples)
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def run(args):
+    from app.serialize import SERIALIZER
+
+    n_patients = fixtures.patients_for(args.size)
+    db_path = fixtures.dmp_db(n_patients, args.rebuild, args.workers)
+    selected = [c for c in CASES
+                if c["group"] in args.group
+                and (not args.filter or any(f in f"{c['group']} {c['name']}" for f in args.filter))]
+    results = {}
+    with ExitStack() as stack:
+        ctx = make_context(stack, db_path, n_patients, {c["group"] for c in selected}, args.rebuild)
+        for c in selected:
+            key = f"{c['group']} {c['name']}"
+            if c["max_patients"] and n_patients > c["max_patients"]:
+                print(f"{key:58s} skipped (more than {c['max_patients']:,} patients)", file=sys.stderr)
+                continue
+            iterations = args.iterations or ITERATIONS
+            if c["iterations"]:
+                iterations = min(iterations, c["iterations"])  # heavy cases: a cap, not a default
+            warmup = min(args.warmup, max(1, iterations // 10))
+            results[key] = r = run_case(c, ctx, iterations, warmup)
+            print(f"{key:58s} p50 {r['p50_ms']:9.3f}  p95 {r['p95_ms']:9.3f}  p99 {r['p99_ms']:9.3f} ms"
+                  f"  {r['ops_per_sec']:>10,.1f} ops/s", file=sys.stderr)
+    return {
+        "meta": {
+            "size": args.size, "patients": n_patients,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(), "cpus": os.cpu_count(),
+            "json_serializer": SERIALIZER,
+        },
+        "results": results,
+    }
+
+# ---------- baseline comparison ----------
+def compare(baseline, current, threshold=THRESHOLD, metric="p50_ms"):
+    """
+    Rows (case, baseline, current, ratio, status) for every case of the current
+    run. A case regressed when metric grew by more than threshold and MIN_DELTA_MS.
+    """
+    base, cur = baseline["results"], current["results"]
+    rows = []
+    for key in cur:
+        b = base.get(key, {}).get(metric)
+        c = cur[key][metric]
+        if b is None:
+            rows.append((key, b, c, None, "new"))
+            continue
+        ratio = c / b if b else math.inf
+        if c > b * (1 + threshold) and c - b > MIN_DELTA_MS:
+            status = "REGRESSION"
+        elif c < b * (1 - threshold) and b - c > MIN_DELTA_MS:
+            status = "faster"
+        else:
+            status = "ok"
+        rows.append((key, b, c, ratio, status))
+    return rows
+
+def print_comparison(rows, baseline, current, metric):
+    bm, cm = baseline.get("meta", {}), current.get("meta", {})
+    print(f"\n{metric}: baseline {bm.get('commit')} ({bm.get('timestamp')}) vs current {cm.get('commit')}")
+    if bm.get("patients") != cm.get("patients"):
+        print(f"WARNING: baseline has {bm.get('patients')} patients, this run {cm.get('patients')}")
+    for key, b, c, ratio, status in rows:
+        fmt = lambda v: "-" if v is None else f"{v:.3f}"
+        change = "" if ratio is None else f"{(ratio - 1) * 100:+7.1f}%"
+        print(f"{key:58s} {fmt(b):>10s} {fmt(c):>10s} {change:>9s}  {status}")
+    regressions = sum(1 for r in rows if r[4] == "REGRESSION")
+    not_run = len(set(baseline["results"]) - set(current["results"]))
+    print(f"{regressions} regression(s) of {len(rows)} cases" + (f" ({not_run} baseline cases not run)" if not_run else ""))
+    return regressions
+
+def _load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def _save(path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark the DMP data layer and APIs.")
+    ap.add_argument("--size", default="1k", help="fixture size: 1k, 100k, 1m or a patient count (default 1k)")
+    ap.add_argument("--group", nargs="+", choices=["data", "flask", "fastapi"], default=["data", "flask", "fastapi"])
+    ap.add_argument("--filter", nargs="+", help="only cases whose name contains one of these")
+    ap.add_argument("--iterations", type=int, help=f"timed runs per case (default {ITERATIONS}; heavy cases run fewer)")
+    ap.add_argument("--warmup", type=int, default=WARMUP, help=f"untimed runs per case (default {WARMUP})")
+    ap.add_argument("--rebuild", action="store_true", help="regenerate the fixture databases")
+    ap.add_argument("--workers", type=int, help="generator processes for a fixture build (default: all CPUs)")
+    ap.add_argument("--out", help="results JSON (default benchmarks/results/<size>-<timestamp>.json)")
+    ap.add_argument("--baseline", help="compare against this results JSON; exit 1 on regression")
+    ap.add_argument("--save-baseline", metavar="FILE", help="also write the results to FILE")
+    ap.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="only compare two saved runs")
+    ap.add_argument("--threshold", type=float, default=THRESHOLD, help=f"regression threshold (default {THRESHOLD})")
+    ap.add_argument("--metric", choices=["p50_ms", "p95_ms", "p99_ms", "mean_ms"], default="p50_ms")
+    args = ap.parse_args(argv)
+
+    if args.compare:
+        baseline, current = _load(args.compare[0]), _load(args.compare[1])
+        regressions = print_comparison(compare(baseline, current, args.threshold, args.metric),
+                                       baseline, current, args.metric)
+        raise SystemExit(1 if regressions else 0)
+
+    os.chdir(ROOT)  # the app resolves data/lookups and data/exports relative to the working directory
+    current = run(args)
+    out = args.out or RESULTS_DIR / f"{args.size}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    _save(out, current)
+    print(f"results written to {out}", file=sys.stderr)
+    if args.save_baseline:
+        _save(args.save_baseline, current)
+    if args.baseline:
+        baseline = _load(args.baseline)
+        regressions = print_comparison(compare(baseline, current, args.threshold, args.metric),
+                                       baseline, current, args.metric)
+        raise SystemExit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
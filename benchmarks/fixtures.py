@@ -0,0 +1,130 @@
+# benchmarks/fixtures.py
+"""
+Databases and sample data for the benchmarks (benchmarks/bench.py).
+
+dmp-<n>.db databases are built the production way, generate_synthetic_emis.py
+to CSVs then load_to_sqlite.py --fast, with a fixed seed and as-of date so
+every machine benchmarks the same data. They are cached under
+benchmarks/.data and reused until --rebuild. The app/main.py API reads the
+separate medical.db schema (docs/schema.sql); its fixture is seeded with
+scripts/load_data.py.
+"""
+import os, random, shutil, sqlite3, sys, time, uuid
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+DATA_DIR = Path(os.getenv("DMP_BENCH_DATA", ROOT / "benchmarks" / ".data"))
+SIZES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+SEED = 42
+AS_OF = "2025-06-30"
+MEDICAL_PATIENTS = 1_000  # app/main.py only ever lists 50; its seeder is slow (Faker per row)
+# PatientGuids of passports the import benchmarks write (re-imported each run, so the fixture stays stable)
+IMPORT_NAMESPACE = uuid.UUID("4b1c3a52-0d6e-4c1e-9a8f-6f0e2d5b7a91")
+DRUG_STATUS_NAMES = {1: "current", 2: "past", 3: "never"}
+
+def patients_for(size: str) -> int:
+    """Patient count for a size label (1k, 100k, 1m) or a plain number."""
+    return SIZES.get(size.lower()) or int(size)
+
+def dmp_db(n_patients: int, rebuild: bool = False, workers: int = None) -> Path:
+    """Path of the dmp.db-schema fixture with n_patients, generating and loading it if needed."""
+    import generate_synthetic_emis, load_to_sqlite
+
+    path = DATA_DIR / f"dmp-{n_patients}.db"
+    if path.exists() and not rebuild:
+        return path
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    csv_dir = DATA_DIR / f"csv-{n_patients}"
+    tmp = path.with_suffix(".tmp")
+    for stale in (tmp, Path(f"{tmp}-wal"), Path(f"{tmp}-shm")):
+        stale.unlink(missing_ok=True)
+
+    t0 = time.perf_counter()
+    generate_synthetic_emis.main([
+        "--patients", str(n_patients), "--seed", str(SEED), "--as-of", AS_OF,
+        "--workers", str(workers or os.cpu_count() or 1),
+        "--lookups", str(ROOT / "data" / "lookups_mvp"), "--out-dir", str(csv_dir),
+    ])
+    load_to_sqlite.main(["--db", str(tmp), "--data", str(csv_dir), "--fast",
+                         "--lookups", str(ROOT / "data" / "lookups")])
+    os.replace(tmp, path)
+    shutil.rmtree(csv_dir, ignore_errors=True)
+    print(f"built {path} in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+    return path
+
+def medical_db(rebuild: bool = False, n_patients: int = MEDICAL_PATIENTS) -> Path:
+    """Path of the medical.db-schema fixture used by app/main.py."""
+    path = DATA_DIR / f"medical-{n_patients}.db"
+    if path.exists() and not rebuild:
+        return path
+    sys.path.insert(0, str(ROOT / "scripts"))
+    import load_data
+
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    path.unlink(missing_ok=True)
+    conn = sqlite3.connect(path)
+    conn.executescript((ROOT / "docs" / "schema.sql").read_text(encoding="utf-8"))
+    conn.close()
+    random.seed(SEED)
+    load_data.fake.seed_instance(SEED)
+    load_data.seed_data(str(path), n_patients)
+    return path
+
+def sample_guids(db_path, k: int = 1000, table: str = "patients", column: str = "PatientGuid"):
+    """Up to k ids spread over the table, the same ones on every run."""
+    conn = sqlite3.connect(db_path)
+    try:
+        max_rowid = conn.execute(f"SELECT MAX(rowid) FROM {table}").fetchone()[0] or 0
+        rowids = random.Random(SEED).sample(range(1, max_rowid + 1), min(k, max_rowid))
+        rows = conn.execute(f"SELECT {column} FROM {table} WHERE rowid IN (SELECT value FROM json_each(?))",
+                            (str(rowids),)).fetchall()
+    finally:
+        conn.close()
+    guids = [r[0] for r in rows]
+    random.Random(SEED).shuffle(guids)
+    return guids
+
+def _compact(d: dict) -> dict:
+    return {k: v for k, v in d.items() if v not in (None, "")}
+
+def import_passport(dmp: dict, patient_guid: str = None) -> dict:
+    """
+    The export passport (build_dmp) reshaped to the import schema
+    (schemas/dmp_v1.json), under patient_guid if given. Child GUIDs are left
+    out so importing under a new PatientGuid never moves existing rows.
+    """
+    return _compact({
+        "PatientGuid": patient_guid or dmp["PatientGuid"],
+        "Name": dmp["Name"],
+        "DOB": dmp["DOB"],
+        "Sex": dmp["Sex"],
+        "PostCode": dmp["PostCode"] if len(dmp.get("PostCode") or "") >= 2 else None,
+        "Medications": [_compact({"term": m["Term"], "dosage": m["Dosage"], "startDate": m["StartDate"][:10],
+                                  "status": DRUG_STATUS_NAMES.get(m["Status"], "current"),
+                                  "prescriptionType": m["PrescriptionType"]})
+                        for m in dmp["Medications"]],
+        "Appointments": [_compact({"startDateTime": a["StartDateTime"], "endDateTime": a["EndDateTime"],
+                                   "status": a["Status"], "location": a["Location"]})
+                         for a in dmp["Appointments"]],
+        "Events": [_compact({"eventType": e["EventType"], "term": e["Term"], "readCode": e["ReadCode"],
+                             "snomedCTCode": e["SnomedCTCode"], "effectiveDateTime": e["EffectiveDateTime"]})
+                   for e in dmp["Events"]],
+    })
+
+def bench_guid(i: int) -> str:
+    """PatientGuid of the i-th passport written by the import benchmarks."""
+    return str(uuid.uuid5(IMPORT_NAMESPACE, str(i)))
+
+def flask_app():
+    """The Flask API (app/routes.py blueprint) as the deployment wires it: pooled connections returned per request."""
+    from flask import Flask
+    from app.db import close_db
+    from app.routes import api
+
+    app = Flask("dmp-bench")
+    app.register_blueprint(api)
+    app.teardown_appcontext(close_db)
+    return app
@@ -0,0 +1,43 @@
+# export_dmps.py
+"""Stream every passport in dmp.db to a file (or stdout) without staging per-patient files.
+
+    python export_dmps.py --out passports.ndjson
+    python export_dmps.py --format xml --out passports.xml
+    python export_dmps.py | gzip > passports.ndjson.gz
+"""
+import argparse, sqlite3, sys
+
+from app.dmp import iter_dmp_ndjson, iter_dmp_xml
+
+DB_PATH = "dmp.db"
+FORMATS = {"ndjson": iter_dmp_ndjson, "xml": iter_dmp_xml}
+# Counts the passports in the bytes written; a chunk may hold several or none.
+# Compact JSON escapes newlines in values and XML text is escaped, so neither
+# marker can appear inside a passport.
+PASSPORT_MARKERS = {"ndjson": b"\n", "xml": b"<DigitalMedicalPassport>"}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Stream all DMP passports as NDJSON or XML.")
+    ap.add_argument("--db", default=DB_PATH, help="SQLite database (default: dmp.db)")
+    ap.add_argument("--format", choices=sorted(FORMATS), default="ndjson")
+    ap.add_argument("--out", default="-", help="output file, '-' for stdout (default)")
+    ap.add_argument("--page-size", type=int, default=500, help="patients fetched per keyset page")
+    args = ap.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    out = sys.stdout.buffer if args.out == "-" else open(args.out, "wb")
+    marker = PASSPORT_MARKERS[args.format]
+    n = 0
+    try:
+        for chunk in FORMATS[args.format](conn, page_size=args.page_size):
+            data = chunk if isinstance(chunk, bytes) else chunk.encode("utf-8")
+            out.write(data)
+            n += data.count(marker)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+        conn.close()
+    print(f"Exported {n} passports", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
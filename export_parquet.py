@@ -0,0 +1,173 @@
+# export_parquet.py
+"""Export the dmp.db tables to Parquet for analytics (needs pyarrow).
+
+Each table is streamed out of SQLite in chunks and written under --out as a
+hive-partitioned dataset, so a query touching one year only reads that year:
+
+    parquet/patients/part-0.parquet
+    parquet/appointments/year=2024/part-0.parquet     (year of StartDateTime)
+    parquet/medications/year=2024/part-0.parquet      (year of EffectiveDateTime)
+    parquet/events/year=2024/part-0.parquet           (year of EffectiveDateTime)
+    parquet/events/year=__HIVE_DEFAULT_PARTITION__/   (missing or unreadable dates)
+
+Date-times become timestamp[us, UTC]. Values with a Z or +hh:mm offset
+(as imported passports may carry) are converted to UTC; values without one,
+like the generated extracts, are taken as UTC. Fractional seconds are kept.
+
+    python export_parquet.py --db dmp.db --out parquet
+    python export_parquet.py --tables events --chunk-size 500000
+
+Query the result with parquet_query.py (DuckDB or pyarrow).
+"""
+import argparse, os, shutil, sqlite3, sys, time
+from datetime import date, datetime, timezone
+
+from load_to_sqlite import TABLES
+
+DB_PATH = "dmp.db"
+OUT_DIR = "parquet"
+CHUNK_SIZE = 200_000
+# table -> column whose year partitions it (None: a single unpartitioned file)
+PARTITION_BY = {
+    "patients": None,
+    "appointments": "StartDateTime",
+    "medications": "EffectiveDateTime",
+    "events": "EffectiveDateTime",
+}
+# Partition for rows whose date is missing or unreadable (read back as a null year)
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+def _pyarrow():
+    try:
+        import pyarrow, pyarrow.parquet
+    except ImportError:
+        sys.exit("export_parquet.py needs pyarrow: pip install pyarrow")
+    return pyarrow, pyarrow.parquet
+
+def arrow_schema(pa, conn, table):
+    """
+    Arrow types from the SQLite declared types; date columns become date32/timestamp.
+    Those stay nullable even when NOT NULL: empty or unreadable text exports as null.
+    """
+    ts = pa.timestamp("us", tz="UTC")
+    special = {"DateOfBirth": pa.date32(), "StartDateTime": ts, "EndDateTime": ts, "EffectiveDateTime": ts}
+    by_decl = {"INTEGER": pa.int64(), "REAL": pa.float64()}
+    fields = []
+    for _cid, name, decl, notnull, _default, _pk in conn.execute(f"PRAGMA table_info({table})"):
+        if name in TABLES[table][1]:
+            type_ = special.get(name, by_decl.get(decl.upper(), pa.string()))
+            fields.append(pa.field(name, type_, nullable=not notnull or name in special))
+    return pa.schema(fields)
+
+def _parse_temporal(value, is_date):
+    """Slow path for one ISO-8601 value: date, or aware UTC datetime; None if unreadable."""
+    try:
+        if is_date:
+            return date.fromisoformat(value[:10])
+        dt = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+
+def _temporal_array(pa, pc, field_type, values):
+    """
+    ISO-8601 text -> date32 / timestamp[us, UTC]; empty or unreadable values become null.
+
+    Chunks are cast whole: plain values (the generated extracts) as naive
+    timestamps taken as UTC; a chunk holding Z/offset values gets a Z added to
+    the others and one tz-aware cast. Only a chunk the casts reject goes
+    through the per-value parser.
+    """
+    text = pa.array(values, pa.string())
+    text = pc.if_else(pc.equal(text, ""), pa.scalar(None, pa.string()), text)
+    is_date = pa.types.is_date(field_type)
+    try:
+        if is_date:
+            return pc.utf8_slice_codeunits(text, 0, 10).cast(field_type)
+        try:
+            return text.cast(pa.timestamp(field_type.unit)).cast(field_type)
+        except pa.ArrowInvalid:
+            text = pc.replace_substring_regex(text, r"^(\d{4}-\d{2}-\d{2})$", r"\1T00:00:00")
+            text = pc.replace_substring_regex(text, r"^(.*[T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)$", r"\1Z")
+            return text.cast(field_type)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return pa.array([_parse_temporal(v, is_date) for v in values], field_type)
+
+def _to_arrow(pa, pc, schema, rows):
+    """One fetched chunk of row tuples -> pyarrow.Table with the table's schema."""
+    columns = list(zip(*rows))
+    arrays = []
+    for field, values in zip(schema, columns):
+        if pa.types.is_temporal(field.type):
+            arrays.append(_temporal_array(pa, pc, field.type, values))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+def export_table(conn, table, out_dir, chunk_size=CHUNK_SIZE, compression="zstd"):
+    """Stream one table into out_dir/<table>/; returns the number of rows written."""
+    pa, pq = _pyarrow()
+    import pyarrow.compute as pc
+
+    schema = arrow_schema(pa, conn, table)
+    cols = ", ".join(schema.names)
+    part_col = PARTITION_BY[table]
+    select = f"SELECT {cols} FROM {table}"
+
+    root = os.path.join(out_dir, table)
+    shutil.rmtree(root, ignore_errors=True)  # a re-export replaces the dataset
+    writers = {}  # partition folder -> ParquetWriter, kept open so each partition is one file
+
+    def writer(folder):
+        w = writers.get(folder)
+        if w is None:
+            os.makedirs(folder, exist_ok=True)
+            w = writers[folder] = pq.ParquetWriter(os.path.join(folder, "part-0.parquet"), schema,
+                                                   compression=compression)
+        return w
+
+    n = 0
+    cur = conn.execute(select)
+    try:
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            n += len(rows)
+            chunk = _to_arrow(pa, pc, schema, rows)
+            if not part_col:
+                writer(root).write_table(chunk)
+                continue
+            # year of the parsed (UTC) value; null for missing or unreadable dates
+            years = pc.year(chunk.column(part_col))
+            for year in pc.unique(years).to_pylist():
+                mask = pc.is_null(years) if year is None else pc.equal(years, year)
+                folder = os.path.join(root, f"year={NULL_PARTITION if year is None else year}")
+                writer(folder).write_table(chunk.filter(mask))
+    finally:
+        for w in writers.values():
+            w.close()
+    return n
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Export dmp.db tables to partitioned Parquet.")
+    ap.add_argument("--db", default=DB_PATH, help="SQLite database (default: dmp.db)")
+    ap.add_argument("--out", default=OUT_DIR, help="output directory (default: parquet)")
+    ap.add_argument("--tables", nargs="+", choices=list(PARTITION_BY), default=list(PARTITION_BY))
+    ap.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows fetched from SQLite per chunk")
+    ap.add_argument("--compression", default="zstd", help="parquet codec (zstd, snappy, gzip, none)")
+    args = ap.parse_args(argv)
+
+    _pyarrow()  # fail fast with the install hint
+    conn = sqlite3.connect(f"file:{os.path.abspath(args.db)}?mode=ro", uri=True)
+    try:
+        for table in args.tables:
+            t0 = time.perf_counter()
+            n = export_table(conn, table, args.out, args.chunk_size, args.compression)
+            dt = time.perf_counter() - t0
+            print(f"{table:13s} {n:>12,} rows  {dt:7.2f}s  ({n / dt if dt else 0:,.0f} rows/s)", file=sys.stderr)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
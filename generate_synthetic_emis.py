@@ -1,32 +1,57 @@
-import csv, os, random, uuid
-from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
-from faker import Faker
-
-# How many to create
-NUM_PATIENTS = 50           # <- make it 100
-APPTS_PER_PATIENT = (1, 5)   # inclusive range
-MEDS_PER_PATIENT  = (0, 3)
-EVENTS_PER_PATIENT = (0, 5)
+"""Synthetic EMIS-style extract generator (patients, appointments, medications, events).
 
-# Lookups folder (keep exactly this relative path)
-LOOKUPS_DIR = "data/lookups"
-
-# NHS number generator (fake only)
-def fake_nhs_number():
-    # 10 digits, clearly synthetic; adjust if you prefer 999xxxxxxx pattern
-    return ''.join(random.choice('0123456789') for _ in range(10))
+    python generate_synthetic_emis.py                          # 50 patients -> data/*.csv
+    python generate_synthetic_emis.py --patients 10000000 --workers 8
+    python generate_synthetic_emis.py --patients 1000000 --sqlite bench.db
 
+The population is cut into shards of --shard-size patients. Each shard gets its
+own seeded RNG (seed + shard number), so output is identical for a given
+--seed/--as-of however many worker processes generate it. Names and postcodes
+are drawn from pools pre-sampled once with Faker instead of calling Faker per
+row, and rows are streamed to the sink shard by shard.
+"""
+import argparse, csv, io, os, random, sqlite3, sys, time, uuid
+from datetime import date, datetime, timedelta, timezone
+from multiprocessing import Pool
+from dateutil.relativedelta import relativedelta
+from faker import Faker
 
-# === settings ===
+# === settings (defaults; override via CLI) ===
 OUT_DIR = "data"
-LOOKUPS_DIR = "data/lookups_mvp"   # <- use the MVP lookups we just made
-N_PATIENTS   = 50                  # default; you can override via CLI
+LOOKUPS_DIR = "data/lookups_mvp"   # <- use the MVP lookups
+N_PATIENTS   = 50
 SEED         = 42                  # for reproducibility
+APPTS_PER_PATIENT  = (1, 5)        # inclusive ranges
+MEDS_PER_PATIENT   = (0, 3)
+EVENTS_PER_PATIENT = (1, 6)
+SHARD_SIZE = 10_000                # patients per shard / unit of work
+NAME_POOL_SIZE = 5_000             # pre-sampled names and postcodes
+
+COLUMNS = {
+    "patients":     ["PatientGuid","Forenames","Surname","DateOfBirth","Sex","PostCode","Ethnicity",
+                     "PatientType","PatientStatus","NHSNumber"],
+    "appointments": ["AppointmentGuid","PatientGuid","StartDateTime","EndDateTime","CurrentStatus","SessionLocation"],
+    "medications":  ["MedicationGuid","PatientGuid","Term","Dosage","PrescriptionType","DrugStatus","EffectiveDateTime"],
+    "events":       ["EventGuid","PatientGuid","EventType","Term","ReadCode","SnomedCTCode","EffectiveDateTime"],
+}
 
-fake = Faker("en_GB")
-random.seed(SEED)
-Faker.seed(SEED)
+ETHNICITIES = ["", "White", "Asian", "Black", "Mixed", "Other"]
+LOCATIONS = ["GP Surgery A", "GP Surgery B", "Walk-In Centre", "Telephone"]
+APPT_MINUTES = [10, 15, 20, 30]
+MED_TERMS = [
+    "Amoxicillin 500mg capsule",
+    "Paracetamol 500mg tablet",
+    "Ibuprofen 200mg tablet",
+    "Atorvastatin 20mg tablet",
+    "Lisinopril 10mg tablet",
+]
+DOSAGES = ["1 tablet twice daily", "500 mg three times daily", "10 mg once daily", "200 mg as needed"]
+# simple term suggestions per event type
+EVENT_TERMS = {
+    1:  ["BP systolic", "BP diastolic", "Pulse rate", "Temperature"],
+    11: ["Penicillin allergy", "Peanut allergy", "Latex allergy"],
+    13: ["COVID-19 vaccine", "Influenza vaccine", "MMR vaccine"],
+}
 
 # ---------- helpers ----------
 def read_lookup(path, has_header=True):
@@ -36,154 +61,268 @@ def read_lookup(path, has_header=True):
         if has_header:
             next(reader, None)
         for row in reader:
-            if not row: 
+            if not row:
                 continue
             out.append(row)
     return out
 
-def choice_from_lookup(rows):
-    # takes [['id','label'], ...] already headerless
-    return random.choice(rows)[0]
+def lookup_ids(lookups_dir):
+    """id column of every lookup the generator draws codes from."""
+    names = ["sex", "patient_status", "patient_type", "event_type",
+             "prescription_type", "drug_status", "appointment_status"]
+    return {n: [r[0].strip() for r in read_lookup(os.path.join(lookups_dir, f"{n}.csv"))] for n in names}
 
 def safe_mkdir(p):
     os.makedirs(p, exist_ok=True)
 
-def rand_dt_between(start_dt, end_dt):
-    delta = end_dt - start_dt
-    seconds = delta.total_seconds()
-    r = random.random() * seconds
-    return start_dt + timedelta(seconds=r)
-
-def fake_nhs_number():
-    # 10-digit fake; no real validation needed for demo
-    base = [random.randint(0, 9) for _ in range(9)]
-    check = random.randint(0, 9)
-    return "".join(str(d) for d in base) + str(check)
-
-# ---------- load lookups ----------
-sex_lkp            = read_lookup(os.path.join(LOOKUPS_DIR, "sex.csv"))
-patient_status_lkp = read_lookup(os.path.join(LOOKUPS_DIR, "patient_status.csv"))
-patient_type_lkp   = read_lookup(os.path.join(LOOKUPS_DIR, "patient_type.csv"))
-event_type_lkp     = read_lookup(os.path.join(LOOKUPS_DIR, "event_type.csv"))
-presc_type_lkp     = read_lookup(os.path.join(LOOKUPS_DIR, "prescription_type.csv"))
-drug_status_lkp    = read_lookup(os.path.join(LOOKUPS_DIR, "drug_status.csv"))
-appt_status_lkp    = read_lookup(os.path.join(LOOKUPS_DIR, "appointment_status.csv"))
-
-# ---------- output paths ----------
-safe_mkdir(OUT_DIR)
-patients_path     = os.path.join(OUT_DIR, "patients.csv")
-appointments_path = os.path.join(OUT_DIR, "appointments.csv")
-medications_path  = os.path.join(OUT_DIR, "medications.csv")
-events_path       = os.path.join(OUT_DIR, "events.csv")
-
-# ---------- generate patients ----------
-patients = []
-for _ in range(N_PATIENTS):
-    pid = str(uuid.uuid4())
-    dob = fake.date_of_birth(minimum_age=0, maximum_age=100)
-    patients.append({
-        "PatientGuid": pid,
-        "Forenames": fake.first_name(),
-        "Surname": fake.last_name(),
-        "DateOfBirth": dob.isoformat(),
-        "Sex": choice_from_lookup(sex_lkp),
-        "PostCode": fake.postcode().replace(" ", ""),
-        "Ethnicity": random.choice(["", "White", "Asian", "Black", "Mixed", "Other"]),
-        "PatientType": choice_from_lookup(patient_type_lkp),
-        "PatientStatus": choice_from_lookup(patient_status_lkp),
-        "NHSNumber": fake_nhs_number()
-    })
-
-# ---------- generate appointments / meds / events ----------
-appointments = []
-medications  = []
-events       = []
-
-now = datetime.now()
-start_window = now - relativedelta(years=5)
-end_window   = now + relativedelta(months=6)
-
-for p in patients:
-    pid = p["PatientGuid"]
-
-    # appointments: 1–5 each
-    for _ in range(random.randint(1, 5)):
-        start = rand_dt_between(start_window, now)
-        end   = start + timedelta(minutes=random.choice([10, 15, 20, 30]))
-        appointments.append({
-            "AppointmentGuid": str(uuid.uuid4()),
-            "PatientGuid": pid,
-            "StartDateTime": start.isoformat(timespec="seconds"),
-            "EndDateTime":   end.isoformat(timespec="seconds"),
-            "CurrentStatus": choice_from_lookup(appt_status_lkp),
-            "SessionLocation": random.choice(["GP Surgery A", "GP Surgery B", "Walk-In Centre", "Telephone"])
-        })
-
-    # medications: 0–3 each
-    for _ in range(random.randint(0, 3)):
-        term = random.choice([
-            "Amoxicillin 500mg capsule",
-            "Paracetamol 500mg tablet",
-            "Ibuprofen 200mg tablet",
-            "Atorvastatin 20mg tablet",
-            "Lisinopril 10mg tablet"
-        ])
-        medications.append({
-            "MedicationGuid": str(uuid.uuid4()),
-            "PatientGuid": pid,
-            "Term": term,
-            "Dosage": random.choice([
-                "1 tablet twice daily",
-                "500 mg three times daily",
-                "10 mg once daily",
-                "200 mg as needed"
-            ]),
-            "PrescriptionType": choice_from_lookup(presc_type_lkp),
-            "DrugStatus": choice_from_lookup(drug_status_lkp),
-            "EffectiveDateTime": rand_dt_between(start_window, now).isoformat(timespec="seconds")
-        })
-
-    # events: 1–6 each (observations / allergy / immunisation)
-    for _ in range(random.randint(1, 6)):
-        et = int(choice_from_lookup(event_type_lkp))
-        # simple term suggestions per type
-        if   et == 1:  term = random.choice(["BP systolic", "BP diastolic", "Pulse rate", "Temperature"])
-        elif et == 11: term = random.choice(["Penicillin allergy", "Peanut allergy", "Latex allergy"])
-        elif et == 13: term = random.choice(["COVID-19 vaccine", "Influenza vaccine", "MMR vaccine"])
-        else:          term = "Clinical note"
-
-        events.append({
-            "EventGuid": str(uuid.uuid4()),
-            "PatientGuid": pid,
-            "EventType": et,
-            "Term": term,
-            "ReadCode": "",          # optional in MVP
-            "SnomedCTCode": "",      # optional in MVP
-            "EffectiveDateTime": rand_dt_between(start_window, now).isoformat(timespec="seconds")
-        })
-
-# ---------- write CSVs ----------
-def write_csv(path, fieldnames, rows):
-    with open(path, "w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=fieldnames)
-        w.writeheader()
-        w.writerows(rows)
-
-write_csv(patients_path,
-          ["PatientGuid","Forenames","Surname","DateOfBirth","Sex","PostCode","Ethnicity","PatientType","PatientStatus","NHSNumber"],
-          patients)
-
-write_csv(appointments_path,
-          ["AppointmentGuid","PatientGuid","StartDateTime","EndDateTime","CurrentStatus","SessionLocation"],
-          appointments)
-
-write_csv(medications_path,
-          ["MedicationGuid","PatientGuid","Term","Dosage","PrescriptionType","DrugStatus","EffectiveDateTime"],
-          medications)
-
-write_csv(events_path,
-          ["EventGuid","PatientGuid","EventType","Term","ReadCode","SnomedCTCode","EffectiveDateTime"],
-          events)
-
-print(f"OK  Generated {len(patients)} patients, {len(appointments)} appointments, {len(medications)} meds, {len(events)} events.")
-print(f"Files saved under: {OUT_DIR}\\")
+def build_pools(seed, size=NAME_POOL_SIZE):
+    """Pre-sample names/postcodes once; rows then pick from these lists."""
+    fake = Faker("en_GB")
+    fake.seed_instance(seed)
+    return {
+        "forenames": [fake.first_name() for _ in range(size)],
+        "surnames":  [fake.last_name() for _ in range(size)],
+        "postcodes": [fake.postcode().replace(" ", "") for _ in range(size)],
+    }
+
+def _guid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+def _iso(ts):
+    """Naive UTC ISO timestamp: the same text whatever the machine's time zone."""
+    return datetime.fromtimestamp(ts, tz=timezone.utc).replace(tzinfo=None).isoformat(timespec="seconds")
+
+def _isotimes(rng, start_ts, span, k):
+    return [_iso(start_ts + rng.random() * span) for _ in range(k)]
+
+# ---------- shard generation (runs in worker processes) ----------
+_CTX = None
+
+def _init_worker(ctx):
+    global _CTX
+    _CTX = ctx
+
+def generate_shard(shard):
+    """Generate one shard: returns {table: [row tuples]} for `count` patients."""
+    shard_no, count = shard
+    ctx = _CTX
+    rng = random.Random(f"{ctx['seed']}:{shard_no}")
+    lk, pools = ctx["lookups"], ctx["pools"]
+    as_of = ctx["as_of"]
+    now_ts = as_of.timestamp()
+    start_ts = (as_of - relativedelta(years=5)).timestamp()
+    span = now_ts - start_ts
+    dob_base = as_of.date()
+
+    # patient columns, sampled k at a time
+    pids = [_guid(rng) for _ in range(count)]
+    forenames = rng.choices(pools["forenames"], k=count)
+    surnames = rng.choices(pools["surnames"], k=count)
+    postcodes = rng.choices(pools["postcodes"], k=count)
+    sexes = rng.choices(lk["sex"], k=count)
+    ethnicities = rng.choices(ETHNICITIES, k=count)
+    ptypes = rng.choices(lk["patient_type"], k=count)
+    pstatuses = rng.choices(lk["patient_status"], k=count)
+    patients = [
+        (pid, forenames[i], surnames[i],
+         (dob_base - timedelta(days=rng.randrange(0, 100 * 365))).isoformat(),
+         sexes[i], postcodes[i], ethnicities[i], ptypes[i], pstatuses[i],
+         f"{rng.randrange(10**10):010d}")
+        for i, pid in enumerate(pids)
+    ]
+
+    lo, hi = ctx["appts"]
+    n_appts = [rng.randint(lo, hi) for _ in range(count)]
+    lo, hi = ctx["meds"]
+    n_meds = [rng.randint(lo, hi) for _ in range(count)]
+    lo, hi = ctx["events"]
+    n_events = [rng.randint(lo, hi) for _ in range(count)]
+
+    # appointments
+    k = sum(n_appts)
+    owners = [pid for pid, n in zip(pids, n_appts) for _ in range(n)]
+    starts = [start_ts + rng.random() * span for _ in range(k)]
+    minutes = rng.choices(APPT_MINUTES, k=k)
+    statuses = rng.choices(lk["appointment_status"], k=k)
+    locations = rng.choices(LOCATIONS, k=k)
+    appointments = [
+        (_guid(rng), owners[i],
+         _iso(starts[i]), _iso(starts[i] + 60 * minutes[i]),
+         statuses[i], locations[i])
+        for i in range(k)
+    ]
+
+    # medications
+    k = sum(n_meds)
+    owners = [pid for pid, n in zip(pids, n_meds) for _ in range(n)]
+    terms = rng.choices(MED_TERMS, k=k)
+    dosages = rng.choices(DOSAGES, k=k)
+    ptypes = rng.choices(lk["prescription_type"], k=k)
+    dstatuses = rng.choices(lk["drug_status"], k=k)
+    whens = _isotimes(rng, start_ts, span, k)
+    medications = [
+        (_guid(rng), owners[i], terms[i], dosages[i], ptypes[i], dstatuses[i], whens[i])
+        for i in range(k)
+    ]
+
+    # events (observations / allergy / immunisation)
+    k = sum(n_events)
+    owners = [pid for pid, n in zip(pids, n_events) for _ in range(n)]
+    etypes = [int(e) for e in rng.choices(lk["event_type"], k=k)]
+    whens = _isotimes(rng, start_ts, span, k)
+    events = [
+        (_guid(rng), owners[i], et,
+         rng.choice(EVENT_TERMS[et]) if et in EVENT_TERMS else "Clinical note",
+         "", "",  # ReadCode / SnomedCTCode optional in MVP
+         whens[i])
+        for i, et in enumerate(etypes)
+    ]
+
+    return {"patients": patients, "appointments": appointments,
+            "medications": medications, "events": events}
+
+def render_shard(shard):
+    """Generate a shard and render it to CSV text in the worker (cheap to ship back)."""
+    out = {}
+    for t, rows in generate_shard(shard).items():
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        out[t] = (len(rows), buf.getvalue())
+    return out
+
+# ---------- sinks ----------
+class CsvSink:
+    """
+    Append shards (pre-rendered by render_shard) to the four CSVs under out_dir.
+
+    Rows go to <table>.csv.tmp files, renamed over the CSVs only once every
+    shard is written; a failed run deletes them and leaves existing CSVs alone.
+    """
+
+    worker_fn = staticmethod(render_shard)
+
+    def __init__(self, out_dir):
+        safe_mkdir(out_dir)
+        self.paths = {t: os.path.join(out_dir, f"{t}.csv") for t in COLUMNS}
+        self.files = {t: open(path + ".tmp", "w", newline="", encoding="utf-8") for t, path in self.paths.items()}
+        for t, f in self.files.items():
+            csv.writer(f).writerow(COLUMNS[t])
+
+    def write(self, shard):
+        for t, (_n, text) in shard.items():
+            self.files[t].write(text)
+
+    def close(self, failed=False):
+        for f in self.files.values():
+            f.close()
+        for t, path in self.paths.items():
+            if failed:
+                os.remove(path + ".tmp")
+            else:
+                os.replace(path + ".tmp", path)
+
+class SqliteSink:
+    """Write shards straight into a fresh dmp.db-schema database (as load_to_sqlite --fast)."""
+
+    worker_fn = staticmethod(generate_shard)
+
+    def __init__(self, db_path):
+        import load_to_sqlite as loader
+        self.loader = loader
+        self.conn = sqlite3.connect(db_path)
+        for stmt in loader.DDL:
+            self.conn.execute(stmt)
+        self.conn.commit()
+        for pragma in ("foreign_keys=OFF", "journal_mode=OFF", "synchronous=OFF", "cache_size=-262144"):
+            self.conn.execute(f"PRAGMA {pragma};")
+        self.conn.execute("BEGIN")
+
+    def write(self, shard):
+        for t, rows in shard.items():
+            self.loader.insert_many(self.conn, t, COLUMNS[t], rows)
+
+    def close(self, failed=False):
+        """
+        Index and commit, or roll back the shards written so far when generation
+        failed. Journaling is off, so as with load_to_sqlite --fast a failed run
+        may still leave the file unusable: rerun rather than reuse it.
+        """
+        if failed:
+            self.conn.rollback()
+        else:
+            self.loader.post_load(self.conn)
+            self.conn.commit()
+        self.conn.close()
+
+# ---------- driver ----------
+def shards(n_patients, shard_size):
+    for shard_no, start in enumerate(range(0, n_patients, shard_size)):
+        yield shard_no, min(shard_size, n_patients - start)
+
+def _range(text):
+    lo, _, hi = text.partition("-")
+    lo, hi = int(lo), int(hi or lo)
+    if lo < 0 or hi < lo:
+        raise argparse.ArgumentTypeError(f"expected MIN-MAX with 0 <= MIN <= MAX, got {text!r}")
+    return lo, hi
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Generate a synthetic EMIS-style extract.")
+    ap.add_argument("--patients", type=int, default=N_PATIENTS)
+    ap.add_argument("--appts", type=_range, default=APPTS_PER_PATIENT, help="per patient, MIN-MAX (default 1-5)")
+    ap.add_argument("--meds", type=_range, default=MEDS_PER_PATIENT, help="per patient, MIN-MAX (default 0-3)")
+    ap.add_argument("--events", type=_range, default=EVENTS_PER_PATIENT, help="per patient, MIN-MAX (default 1-6)")
+    ap.add_argument("--seed", type=int, default=SEED)
+    ap.add_argument("--as-of", type=date.fromisoformat, default=None,
+                    help="reference date for generated dates, UTC midnight (default now; fix it for reproducible output)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    ap.add_argument("--lookups", default=LOOKUPS_DIR)
+    ap.add_argument("--out-dir", default=OUT_DIR, help="CSV output directory (default data)")
+    ap.add_argument("--sqlite", metavar="DB", help="write straight into this SQLite database instead of CSVs")
+    args = ap.parse_args(argv)
+
+    # UTC, so timestamps (and the output) do not depend on the local time zone
+    as_of = (datetime.combine(args.as_of, datetime.min.time(), tzinfo=timezone.utc) if args.as_of
+             else datetime.now(timezone.utc).replace(microsecond=0))
+    ctx = {
+        "seed": args.seed,
+        "as_of": as_of,
+        "appts": args.appts, "meds": args.meds, "events": args.events,
+        "lookups": lookup_ids(args.lookups),
+        "pools": build_pools(args.seed),
+    }
+    sink = SqliteSink(args.sqlite) if args.sqlite else CsvSink(args.out_dir)
+    counts = dict.fromkeys(COLUMNS, 0)
+    t0 = time.perf_counter()
+
+    def consume(results):
+        for shard in results:
+            sink.write(shard)
+            for t, rows in shard.items():
+                counts[t] += rows[0] if isinstance(rows, tuple) else len(rows)
+
+    work = list(shards(args.patients, args.shard_size))
+    failed = True
+    try:
+        if args.workers <= 1 or len(work) <= 1:
+            _init_worker(ctx)
+            consume(map(sink.worker_fn, work))
+        else:
+            with Pool(args.workers, initializer=_init_worker, initargs=(ctx,)) as pool:
+                # bounded windows keep finished-but-unwritten shards from piling up
+                window = 2 * args.workers
+                for i in range(0, len(work), window):
+                    consume(pool.imap(sink.worker_fn, work[i:i + window]))
+        failed = False
+    finally:
+        sink.close(failed)
+
+    elapsed = time.perf_counter() - t0
+    print(f"OK  Generated {counts['patients']} patients, {counts['appointments']} appointments, "
+          f"{counts['medications']} meds, {counts['events']} events in {elapsed:.1f}s "
+          f"({sum(counts.values()) / max(elapsed, 1e-9):,.0f} rows/sec).")
+    print(f"Written to: {args.sqlite or args.out_dir}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 # load_to_sqlite.py
-import csv, sqlite3
+import argparse, csv, hashlib, json, multiprocessing as mp, queue as queue_mod, sqlite3, time
+from datetime import datetime, timezone
 from pathlib import Path
 
+from app.lookups import LOOKUP_DIR, iter_lookup_rows
+from app.queries import ALLERGY_EVENT, IMMUNISATION_EVENT, PLAN_CHECKS
+
 DATA = Path("data")
 DB_PATH = "dmp.db"
 
@@ -11,7 +15,10 @@ DDL = [
     "DROP TABLE IF EXISTS appointments;",
     "DROP TABLE IF EXISTS medications;",
     "DROP TABLE IF EXISTS events;",
+    "DROP TABLE IF EXISTS patients_fts;",
     "DROP TABLE IF EXISTS patients;",
+    "DROP TABLE IF EXISTS row_hashes;",
+    "DROP TABLE IF EXISTS patient_summary;",
     """
     CREATE TABLE patients (
         PatientGuid TEXT PRIMARY KEY,
@@ -61,47 +68,568 @@ DDL = [
         FOREIGN KEY (PatientGuid) REFERENCES patients(PatientGuid) ON DELETE CASCADE
     );
     """,
-    "CREATE INDEX IF NOT EXISTS idx_appt_patient ON appointments(PatientGuid);",
-    "CREATE INDEX IF NOT EXISTS idx_med_patient  ON medications(PatientGuid);",
-    "CREATE INDEX IF NOT EXISTS idx_evt_patient  ON events(PatientGuid);",
+    # Per-patient change counter used by the API passport cache / ETags.
+    # Never dropped: counters must keep increasing across full reloads.
+    """
+    CREATE TABLE IF NOT EXISTS patient_versions (
+        PatientGuid TEXT PRIMARY KEY,
+        Version INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    """,
+]
+
+# --- incremental (delta) loading ---
+# load_manifest: checksum + row count of each CSV as last loaded (unchanged files are skipped).
+# row_hashes: content hash per row, so unchanged rows in a changed file are not rewritten.
+INCREMENTAL_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS load_manifest (
+        FileName TEXT PRIMARY KEY,
+        Sha256   TEXT NOT NULL,
+        RowCount INTEGER NOT NULL,
+        LoadedAt TEXT NOT NULL
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS row_hashes (
+        TableName TEXT NOT NULL,
+        Guid      TEXT NOT NULL,
+        RowHash   BLOB NOT NULL,
+        PRIMARY KEY (TableName, Guid)
+    ) WITHOUT ROWID;
+    """,
+]
+
+# --- indexes ---
+# Built after the bulk insert: one sort per index is much cheaper than
+# maintaining every index row by row during the load. The per-patient ones
+# match the API's WHERE PatientGuid = ? ORDER BY <date> DESC queries (see
+# app/queries.py), so rows come back in index order without a temp B-tree sort.
+INDEX_DDL = [
+    # date, then GUID: the passport order (app.queries *_ORDER); the API lists use the prefix
+    "CREATE INDEX IF NOT EXISTS idx_appt_patient_start_guid "
+    "ON appointments(PatientGuid, StartDateTime DESC, AppointmentGuid DESC);",
+    "CREATE INDEX IF NOT EXISTS idx_med_patient_effective ON medications(PatientGuid, EffectiveDateTime DESC);",
+    # passport medications sort on COALESCE(EffectiveDateTime, '') AS StartDate
+    "CREATE INDEX IF NOT EXISTS idx_med_patient_startdate_guid "
+    "ON medications(PatientGuid, COALESCE(EffectiveDateTime, '') DESC, MedicationGuid DESC);",
+    "CREATE INDEX IF NOT EXISTS idx_evt_patient_effective_guid "
+    "ON events(PatientGuid, EffectiveDateTime DESC, EventGuid DESC);",
+    # keyset paging order for GET /patients
+    "CREATE INDEX IF NOT EXISTS idx_patients_name ON patients(Surname, Forenames, PatientGuid);",
+]
+# Superseded by the composite indexes above (same leading columns)
+OBSOLETE_INDEXES = ("idx_appt_patient", "idx_med_patient", "idx_evt_patient",
+                    "idx_appt_patient_start", "idx_med_patient_startdate", "idx_evt_patient_effective")
+# Rows sampled per index by ANALYZE: enough for the planner, fast on big tables
+ANALYSIS_LIMIT = 1000
+
+def create_indexes(conn):
+    """Create the query indexes and drop the ones they supersede."""
+    for name in OBSOLETE_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name};")
+    for stmt in INDEX_DDL:
+        conn.execute(stmt)
+
+def analyze(conn):
+    """Refresh planner statistics (sqlite_stat1) so the composite indexes get picked."""
+    conn.execute(f"PRAGMA analysis_limit={ANALYSIS_LIMIT};")
+    conn.execute("ANALYZE;")
+
+def report_plans(conn):
+    """Print the check_plans() result; True when every API query is index-served."""
+    bad = check_plans(conn)
+    for name, plan in bad.items():
+        print(f"BAD PLAN: {name}: " + " | ".join(plan))
+    if not bad:
+        print(f"OK: all {len(PLAN_CHECKS)} API queries are served in index order")
+    return not bad
+
+def _bad_plan_line(line):
+    """A temp B-tree sort, or a full scan of a table (json_each, subquery and constant-row scans are fine)."""
+    if "USE TEMP B-TREE" in line:
+        return True
+    return line.startswith("SCAN ") and not (line.startswith(("SCAN (", "SCAN CONSTANT ROW"))
+                                             or "VIRTUAL TABLE" in line)
+
+def check_plans(conn):
+    """
+    EXPLAIN QUERY PLAN every API query (app.queries.PLAN_CHECKS).
+
+    Returns {query name: plan lines} for those that need a temp B-tree (an
+    in-memory sort per request) or fall back to scanning a table instead of
+    searching an index; empty when every query is index-served.
+    """
+    bad = {}
+    for name, (sql, params) in PLAN_CHECKS.items():
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        if any(_bad_plan_line(line) for line in plan):
+            bad[name] = plan
+    return bad
+
+# --- CSV sources (table -> file, columns), in load order ---
+TABLES = {
+    "patients":     ("patients.csv",     ["PatientGuid","Forenames","Surname","DateOfBirth","Sex","PostCode",
+                                          "Ethnicity","PatientType","PatientStatus","NHSNumber"]),
+    "appointments": ("appointments.csv", ["AppointmentGuid","PatientGuid","StartDateTime","EndDateTime",
+                                          "CurrentStatus","SessionLocation"]),
+    "medications":  ("medications.csv",  ["MedicationGuid","PatientGuid","Term","Dosage","PrescriptionType",
+                                          "DrugStatus","EffectiveDateTime"]),
+    "events":       ("events.csv",       ["EventGuid","PatientGuid","EventType","Term","ReadCode",
+                                          "SnomedCTCode","EffectiveDateTime"]),
+}
+CHUNK_SIZE = 50_000
+
+# --- lookups (code -> label, from data/lookups/*.csv; see app/lookups.py) ---
+# Reloaded in full on every load: the files are tiny. The primary key is the
+# (Domain, Code) index a decoding join would use, e.g.
+#   JOIN lookups l ON l.Domain = 'event_type' AND l.Code = e.EventType
+LOOKUP_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS lookups (
+        Domain TEXT NOT NULL,   -- CSV name: sex, drug_status, appointment_status, ...
+        Code   TEXT NOT NULL,
+        Label  TEXT NOT NULL,
+        PRIMARY KEY (Domain, Code)
+    ) WITHOUT ROWID;
+    """,
+]
+
+def load_lookups(conn, lookup_dir=LOOKUP_DIR):
+    """Replace the lookups table with the CSVs in lookup_dir; returns {domain: codes loaded}."""
+    for stmt in LOOKUP_DDL:
+        conn.execute(stmt)
+    rows = [(domain, str(code), label) for domain, code, label in iter_lookup_rows(lookup_dir)]
+    conn.execute("DELETE FROM lookups")
+    conn.executemany("INSERT OR IGNORE INTO lookups (Domain, Code, Label) VALUES (?, ?, ?)", rows)
+    return dict(conn.execute("SELECT Domain, COUNT(*) FROM lookups GROUP BY Domain ORDER BY Domain"))
+
+# --- passport versioning ---
+VERSIONED_TABLES = ("patients", "appointments", "medications", "events")
+
+def _bump_version(ref):
+    return (f"INSERT INTO patient_versions (PatientGuid, Version) VALUES ({ref}.PatientGuid, 1) "
+            "ON CONFLICT(PatientGuid) DO UPDATE SET Version = Version + 1;")
+
+def version_trigger_ddl():
+    """Triggers that bump patient_versions whenever a patient's rows change."""
+    stmts = []
+    for t in VERSIONED_TABLES:
+        stmts.append(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{t}_version_ins AFTER INSERT ON {t}
+        BEGIN {_bump_version("NEW")} END;""")
+        stmts.append(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{t}_version_upd AFTER UPDATE ON {t}
+        BEGIN
+            {_bump_version("NEW")}
+            INSERT INTO patient_versions (PatientGuid, Version)
+            SELECT OLD.PatientGuid, 1 WHERE OLD.PatientGuid IS NOT NEW.PatientGuid
+            ON CONFLICT(PatientGuid) DO UPDATE SET Version = Version + 1;
+        END;""")
+        stmts.append(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{t}_version_del AFTER DELETE ON {t}
+        BEGIN {_bump_version("OLD")} END;""")
+    return stmts
+
+# --- name search index ---
+# Trigram FTS5 index over patient names, backing GET /patients?q=. It is an
+# external-content table keyed on patients.rowid: after a VACUUM (which may
+# renumber rowids) run  INSERT INTO patients_fts(patients_fts) VALUES('rebuild');
+NAME_SEARCH_DDL = [
+    """
+    CREATE VIRTUAL TABLE patients_fts USING fts5(
+        Forenames, Surname,
+        content='patients', content_rowid='rowid', tokenize='trigram'
+    );
+    """,
+    "INSERT INTO patients_fts(patients_fts) VALUES('rebuild');",
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_patients_fts_ins AFTER INSERT ON patients
+    BEGIN
+        INSERT INTO patients_fts(rowid, Forenames, Surname)
+        VALUES (NEW.rowid, NEW.Forenames, NEW.Surname);
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_patients_fts_del AFTER DELETE ON patients
+    BEGIN
+        INSERT INTO patients_fts(patients_fts, rowid, Forenames, Surname)
+        VALUES ('delete', OLD.rowid, OLD.Forenames, OLD.Surname);
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_patients_fts_upd AFTER UPDATE OF Forenames, Surname ON patients
+    BEGIN
+        INSERT INTO patients_fts(patients_fts, rowid, Forenames, Surname)
+        VALUES ('delete', OLD.rowid, OLD.Forenames, OLD.Surname);
+        INSERT INTO patients_fts(rowid, Forenames, Surname)
+        VALUES (NEW.rowid, NEW.Forenames, NEW.Surname);
+    END;
+    """,
+]
+
+# --- patient summary ---
+# One pre-aggregated row per patient for dashboards (GET /summary/top,
+# /patients/<guid>/summary): built in bulk after a load, then kept current by
+# triggers that recompute the affected patient's row from its indexed child rows.
+SUMMARY_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS patient_summary (
+        PatientGuid       TEXT PRIMARY KEY,
+        AppointmentCount  INTEGER NOT NULL DEFAULT 0,
+        MedicationCount   INTEGER NOT NULL DEFAULT 0,
+        AllergyCount      INTEGER NOT NULL DEFAULT 0,
+        ImmunisationCount INTEGER NOT NULL DEFAULT 0,
+        LastAppointment   TEXT,
+        LastMedication    TEXT,
+        LastEvent         TEXT,
+        LastActivity      TEXT
+    ) WITHOUT ROWID;
+    """,
+]
+SUMMARY_INDEX_DDL = [
+    "CREATE INDEX IF NOT EXISTS idx_summary_appts    ON patient_summary(AppointmentCount DESC);",
+    "CREATE INDEX IF NOT EXISTS idx_summary_meds     ON patient_summary(MedicationCount DESC);",
+    "CREATE INDEX IF NOT EXISTS idx_summary_allergy  ON patient_summary(AllergyCount DESC);",
+    "CREATE INDEX IF NOT EXISTS idx_summary_immunise ON patient_summary(ImmunisationCount DESC);",
 ]
+SUMMARY_COLS = ("PatientGuid, AppointmentCount, MedicationCount, AllergyCount, ImmunisationCount, "
+                "LastAppointment, LastMedication, LastEvent, LastActivity")
+# per-patient aggregates of each child table (alias a, m, e below)
+_APPT_AGG = "COUNT(*) AS n, MAX(StartDateTime) AS last FROM appointments"
+_MED_AGG = "COUNT(*) AS n, MAX(EffectiveDateTime) AS last FROM medications"
+_EVT_AGG = (f"SUM(EventType = {ALLERGY_EVENT}) AS allergies, SUM(EventType = {IMMUNISATION_EVENT}) AS immunisations, "
+            "MAX(EffectiveDateTime) AS last FROM events")
+
+def _summary_insert(verb, guid, source):
+    return f"""
+        {verb} INTO patient_summary ({SUMMARY_COLS})
+        SELECT {guid}, COALESCE(a.n, 0), COALESCE(m.n, 0), COALESCE(e.allergies, 0), COALESCE(e.immunisations, 0),
+               a.last, m.last, e.last,
+               NULLIF(max(COALESCE(a.last, ''), COALESCE(m.last, ''), COALESCE(e.last, '')), '')
+        FROM {source}"""
+
+_SUMMARY_UPSERT = "ON CONFLICT(PatientGuid) DO UPDATE SET " + ", ".join(
+    f"{c} = excluded.{c}" for c in SUMMARY_COLS.split(", ")[1:])
+
+def _refresh_summary(ref, when="1"):
+    """Trigger statement: recompute {ref}.PatientGuid's summary row (if the patient still exists)."""
+    g = f"{ref}.PatientGuid"
+    source = (f"(SELECT {_APPT_AGG} WHERE PatientGuid = {g}) a, "
+              f"(SELECT {_MED_AGG} WHERE PatientGuid = {g}) m, "
+              f"(SELECT {_EVT_AGG} WHERE PatientGuid = {g}) e "
+              f"WHERE {when} AND EXISTS (SELECT 1 FROM patients WHERE PatientGuid = {g})")
+    # an UPSERT, not INSERT OR REPLACE: inside a trigger the OR clause is overridden by the
+    # conflict policy of the statement that fired it, so it fails under the importer's upserts
+    return _summary_insert("INSERT", g, source) + f"\n        {_SUMMARY_UPSERT};"
+
+# Full rebuild: one grouped pass per child table instead of three subqueries per patient
+BUILD_SUMMARY = _summary_insert("INSERT", "p.PatientGuid", f"""patients p
+        LEFT JOIN (SELECT PatientGuid, {_APPT_AGG} GROUP BY PatientGuid) a ON a.PatientGuid = p.PatientGuid
+        LEFT JOIN (SELECT PatientGuid, {_MED_AGG} GROUP BY PatientGuid) m ON m.PatientGuid = p.PatientGuid
+        LEFT JOIN (SELECT PatientGuid, {_EVT_AGG} GROUP BY PatientGuid) e ON e.PatientGuid = p.PatientGuid""")
 
-def load_csv_rows(path: Path, columns):
+def summary_trigger_ddl():
+    """Triggers that keep patient_summary in step with the child tables."""
+    stmts = [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_patients_summary_ins AFTER INSERT ON patients
+        BEGIN {_refresh_summary("NEW")} END;""",
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_patients_summary_del AFTER DELETE ON patients
+        BEGIN DELETE FROM patient_summary WHERE PatientGuid = OLD.PatientGuid; END;""",
+    ]
+    for t in ("appointments", "medications", "events"):
+        stmts.append(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{t}_summary_ins AFTER INSERT ON {t}
+        BEGIN {_refresh_summary("NEW")} END;""")
+        stmts.append(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{t}_summary_upd AFTER UPDATE ON {t}
+        BEGIN
+            {_refresh_summary("NEW")}
+            {_refresh_summary("OLD", when="OLD.PatientGuid IS NOT NEW.PatientGuid")}
+        END;""")
+        stmts.append(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{t}_summary_del AFTER DELETE ON {t}
+        BEGIN {_refresh_summary("OLD")} END;""")
+    return stmts
+
+TOP_BY_APPOINTMENTS = """
+    SELECT p.Surname, p.Forenames, s.AppointmentCount AS appts
+    FROM patient_summary s JOIN patients p ON p.PatientGuid = s.PatientGuid
+    ORDER BY s.AppointmentCount DESC
+    LIMIT 5
+"""
+
+def build_summary(conn):
+    """(Re)build patient_summary from scratch, then install its indexes and triggers."""
+    for stmt in SUMMARY_DDL:
+        conn.execute(stmt)
+    conn.execute("DELETE FROM patient_summary")
+    conn.execute(BUILD_SUMMARY)
+    # replace rather than keep triggers from an older definition
+    stale = conn.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND name GLOB 'trg_*_summary_*'")
+    for (name,) in stale.fetchall():
+        conn.execute(f"DROP TRIGGER {name}")
+    for stmt in SUMMARY_INDEX_DDL + summary_trigger_ddl():
+        conn.execute(stmt)
+
+# A reload replaces every patient's rows, so bump every counter once in bulk
+# (instead of per row) before the triggers take over. Every existing counter
+# is bumped, including those of patients the reload dropped, so cached
+# passports and ETags of deleted patients go stale too; new patients start at 1.
+BUMP_ALL_VERSIONS = (
+    "UPDATE patient_versions SET Version = Version + 1",
+    """
+    INSERT INTO patient_versions (PatientGuid, Version)
+    SELECT PatientGuid, 1 FROM patients
+    WHERE PatientGuid NOT IN (SELECT PatientGuid FROM patient_versions)
+    """,
+)
+
+def iter_csv_chunks(path: Path, columns, chunk_size=CHUNK_SIZE):
+    """Yield lists of up to chunk_size row tuples (columns in the given order)."""
     with open(path, newline="", encoding="utf-8") as f:
-        r = csv.DictReader(f)
-        rows = [tuple((r0.get(c, "") or "").strip() for c in columns) for r0 in r]
-    return rows
+        r = csv.reader(f)
+        header = [h.strip() for h in next(r, [])]
+        idx = [header.index(c) if c in header else None for c in columns]
+        chunk = []
+        for row in r:
+            chunk.append(tuple(
+                (row[i].strip() if i is not None and i < len(row) else "") for i in idx
+            ))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
 
 def insert_many(conn, table, columns, rows):
     q = f"INSERT INTO {table} ({','.join(columns)}) VALUES ({','.join('?'*len(columns))})"
     conn.executemany(q, rows)
 
-def main():
-    conn = sqlite3.connect(DB_PATH)
+def _parse_worker(table, path, columns, chunk_size, queue):
+    """Worker process: parse one CSV and hand chunks to the loader via the queue."""
+    for chunk in iter_csv_chunks(path, columns, chunk_size):
+        queue.put((table, chunk))
+    queue.put((table, None))  # done
+
+def load_serial(conn, data_dir: Path, chunk_size=CHUNK_SIZE):
+    """Default load: one file after another, streamed in chunks."""
+    counts = {}
+    for table, (fname, columns) in TABLES.items():
+        counts[table] = 0
+        for chunk in iter_csv_chunks(data_dir/fname, columns, chunk_size):
+            insert_many(conn, table, columns, chunk)
+            counts[table] += len(chunk)
+    return counts
+
+def load_fast(conn, data_dir: Path, chunk_size=CHUNK_SIZE):
+    """
+    High-throughput load for fresh builds.
+
+    Each CSV is parsed by its own worker process; chunks come back through a
+    bounded queue (so memory stays at a few chunks per file) and are inserted
+    in a single transaction with journaling, fsync and FK checks turned off.
+    A crash mid-load leaves the database unusable: rerun the load.
+    """
+    conn.execute("PRAGMA foreign_keys=OFF;")
+    conn.execute("PRAGMA journal_mode=OFF;")
+    conn.execute("PRAGMA synchronous=OFF;")
+    conn.execute("PRAGMA cache_size=-262144;")  # 256 MiB
+    conn.execute("PRAGMA temp_store=MEMORY;")
+
+    queue = mp.Queue(maxsize=4 * len(TABLES))
+    workers = [
+        mp.Process(target=_parse_worker, args=(table, data_dir/fname, columns, chunk_size, queue), daemon=True)
+        for table, (fname, columns) in TABLES.items()
+    ]
+    for w in workers:
+        w.start()
+
+    counts = {t: 0 for t in TABLES}
+    pending = len(workers)
+    conn.execute("BEGIN")
+    while pending:
+        try:
+            table, chunk = queue.get(timeout=1)
+        except queue_mod.Empty:
+            if any(w.exitcode for w in workers):
+                conn.rollback()
+                raise RuntimeError("CSV parser process failed")
+            continue
+        if chunk is None:
+            pending -= 1
+            continue
+        insert_many(conn, table, TABLES[table][1], chunk)
+        counts[table] += len(chunk)
+    for w in workers:
+        w.join()
+        if w.exitcode:
+            conn.rollback()
+            raise RuntimeError(f"CSV parser process failed (exit code {w.exitcode})")
+    return counts
+
+def post_load(conn):
+    """Indexes, search index, version counters, summary table and triggers, after the bulk insert."""
+    create_indexes(conn)
+    for stmt in BUMP_ALL_VERSIONS:
+        conn.execute(stmt)
+    for stmt in version_trigger_ddl() + NAME_SEARCH_DDL:
+        conn.execute(stmt)
+    build_summary(conn)
+    analyze(conn)
+
+def file_sha256(path: Path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _row_hash(row):
+    return hashlib.blake2b("\x1f".join(row).encode("utf-8"), digest_size=16).digest()
+
+def record_manifest(conn, fname, sha, rows):
+    conn.execute("""
+        INSERT INTO load_manifest (FileName, Sha256, RowCount, LoadedAt) VALUES (?, ?, ?, ?)
+        ON CONFLICT(FileName) DO UPDATE SET
+            Sha256 = excluded.Sha256, RowCount = excluded.RowCount, LoadedAt = excluded.LoadedAt
+    """, (fname, sha, rows, datetime.now(timezone.utc).isoformat(timespec="seconds")))
+
+def upsert_sql(table, columns):
+    pk, rest = columns[0], columns[1:]
+    return (f"INSERT INTO {table} ({','.join(columns)}) VALUES ({','.join('?'*len(columns))}) "
+            f"ON CONFLICT({pk}) DO UPDATE SET " + ", ".join(f"{c}=excluded.{c}" for c in rest))
+
+def load_incremental(conn, data_dir: Path, chunk_size=CHUNK_SIZE):
+    """
+    Delta load into an existing database.
+
+    Files whose checksum matches load_manifest are skipped. Otherwise only rows
+    whose content hash changed are upserted by GUID, committing per chunk so
+    WAL readers (the API) keep being served during the load. Rows absent from
+    the feed are left alone. The usual triggers fire on every upsert, so
+    passport versions and the name index stay current.
+    """
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    for stmt in INCREMENTAL_DDL:
+        conn.execute(stmt)
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='patient_summary'").fetchone():
+        build_summary(conn)  # database built before the summary table existed
+    conn.commit()
+    manifest = {r[0]: r[1] for r in conn.execute("SELECT FileName, Sha256 FROM load_manifest")}
+
+    stats = {}
+    for table, (fname, columns) in TABLES.items():
+        path = data_dir/fname
+        sha = file_sha256(path)
+        if manifest.get(fname) == sha:
+            stats[table] = {"status": "unchanged"}
+            continue
+
+        upsert = upsert_sql(table, columns)
+        seen = changed = 0
+        for chunk in iter_csv_chunks(path, columns, chunk_size):
+            hashes = {row[0]: _row_hash(row) for row in chunk}
+            known = dict(conn.execute("""
+                SELECT Guid, RowHash FROM row_hashes
+                WHERE TableName = ? AND Guid IN (SELECT value FROM json_each(?))
+            """, (table, json.dumps(list(hashes)))).fetchall())
+            missing = [g for g in hashes if g not in known]
+            if missing:
+                # no stored hash yet (e.g. first delta after a full load): hash the current row
+                known.update(
+                    (r[0], _row_hash(tuple("" if v is None else str(v) for v in r)))
+                    for r in conn.execute(f"""
+                        SELECT {','.join(columns)} FROM {table}
+                        WHERE {columns[0]} IN (SELECT value FROM json_each(?))
+                    """, (json.dumps(missing),))
+                )
+            todo = [row for row in chunk if known.get(row[0]) != hashes[row[0]]]
+            if todo:
+                conn.executemany(upsert, todo)
+            # remember hashes for upserted rows and for rows first hashed just now
+            fresh = set(missing).union(row[0] for row in todo)
+            if fresh:
+                conn.executemany("""
+                    INSERT INTO row_hashes (TableName, Guid, RowHash) VALUES (?, ?, ?)
+                    ON CONFLICT(TableName, Guid) DO UPDATE SET RowHash = excluded.RowHash
+                """, [(table, g, hashes[g]) for g in fresh])
+            conn.commit()
+            seen += len(chunk)
+            changed += len(todo)
+        record_manifest(conn, fname, sha, seen)
+        conn.commit()
+        stats[table] = {"status": "loaded", "rows": seen, "upserted": changed}
+    return stats
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Load the EMIS-style CSVs into SQLite.")
+    ap.add_argument("--db", default=DB_PATH, help="SQLite database to (re)build (default: dmp.db)")
+    ap.add_argument("--data", default=str(DATA), help="directory holding the CSVs (default: data)")
+    ap.add_argument("--fast", action="store_true",
+                    help="parallel parse + unjournaled single-transaction insert (fresh builds)")
+    ap.add_argument("--incremental", action="store_true",
+                    help="upsert changed rows into the existing database; skip unchanged files")
+    ap.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows per insert batch")
+    ap.add_argument("--lookups", default=LOOKUP_DIR, help="directory holding the lookup CSVs (default: data/lookups)")
+    ap.add_argument("--reindex", action="store_true",
+                    help="only (re)build the query indexes and statistics of an existing database, then check plans")
+    ap.add_argument("--check-plans", action="store_true",
+                    help="only check that no API query needs a temp B-tree sort or a table scan (exit status 1 if one does)")
+    args = ap.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
     conn.execute("PRAGMA foreign_keys=ON;")
 
+    if args.reindex or args.check_plans:
+        if args.reindex:
+            t0 = time.perf_counter()
+            create_indexes(conn)
+            analyze(conn)
+            conn.commit()
+            print(f"Indexes and statistics rebuilt in {time.perf_counter() - t0:.2f}s")
+        ok = report_plans(conn)
+        conn.close()
+        raise SystemExit(0 if ok else 1)
+
+    if args.incremental:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='patients'").fetchone():
+            raise SystemExit(f"{args.db} has no patients table: run a full load first")
+        t0 = time.perf_counter()
+        stats = load_incremental(conn, Path(args.data), args.chunk_size)
+        stats["lookups"] = load_lookups(conn, args.lookups)
+        conn.commit()
+        print(f"Incremental load in {time.perf_counter() - t0:.2f}s")
+        for table, st in stats.items():
+            print(f"  {table}: {st}")
+        conn.close()
+        return
+
     # Create schema
     for stmt in DDL:
         conn.execute(stmt)
+    conn.commit()
 
     # Load data
-    patients_cols = ["PatientGuid","Forenames","Surname","DateOfBirth","Sex","PostCode",
-                     "Ethnicity","PatientType","PatientStatus","NHSNumber"]
-    appts_cols    = ["AppointmentGuid","PatientGuid","StartDateTime","EndDateTime","CurrentStatus","SessionLocation"]
-    meds_cols     = ["MedicationGuid","PatientGuid","Term","Dosage","PrescriptionType","DrugStatus","EffectiveDateTime"]
-    events_cols   = ["EventGuid","PatientGuid","EventType","Term","ReadCode","SnomedCTCode","EffectiveDateTime"]
-
-    patients_rows = load_csv_rows(DATA/"patients.csv", patients_cols)
-    appts_rows    = load_csv_rows(DATA/"appointments.csv", appts_cols)
-    meds_rows     = load_csv_rows(DATA/"medications.csv", meds_cols)
-    events_rows   = load_csv_rows(DATA/"events.csv", events_cols)
-
-    insert_many(conn, "patients", patients_cols, patients_rows)
-    insert_many(conn, "appointments", appts_cols, appts_rows)
-    insert_many(conn, "medications", meds_cols, meds_rows)
-    insert_many(conn, "events", events_cols, events_rows)
-
+    t0 = time.perf_counter()
+    loader = load_fast if args.fast else load_serial
+    counts = loader(conn, Path(args.data), args.chunk_size)
+    t1 = time.perf_counter()
+    post_load(conn)
+    lookup_counts = load_lookups(conn, args.lookups)
+    for stmt in INCREMENTAL_DDL:
+        conn.execute(stmt)
+    for table, (fname, _cols) in TABLES.items():
+        record_manifest(conn, fname, file_sha256(Path(args.data)/fname), counts[table])
     conn.commit()
+    t2 = time.perf_counter()
+
+    total = sum(counts.values())
+    print(f"Inserted {total} rows in {t1 - t0:.2f}s ({total / max(t1 - t0, 1e-9):,.0f} rows/sec), "
+          f"indexes + triggers in {t2 - t1:.2f}s")
 
     # Quick integrity checks
     cur = conn.cursor()
@@ -110,6 +638,7 @@ def main():
         cur.execute(f"SELECT COUNT(*) FROM {t}")
         counts[t] = cur.fetchone()[0]
     print("Counts:", counts)
+    print("Lookups:", lookup_counts or f"none found in {args.lookups}")
 
     # Orphan check
     for t in ("appointments","medications","events"):
@@ -125,21 +654,18 @@ def main():
         else:
             print(f"OK: all {t} rows reference valid patients")
 
-    # Sample join
-    cur.execute("""
-      SELECT p.Surname, p.Forenames, COUNT(a.AppointmentGuid) AS appts
-      FROM patients p
-      LEFT JOIN appointments a ON a.PatientGuid = p.PatientGuid
-      GROUP BY p.PatientGuid
-      ORDER BY appts DESC, p.Surname
-      LIMIT 5
-    """)
+    # Sample report (from the pre-aggregated summary)
+    plans_ok = report_plans(conn)
+    cur.execute(TOP_BY_APPOINTMENTS)
+
     print("\nTop 5 patients by appointment count:")
     for row in cur.fetchall():
         print(row)
 
     conn.close()
-    print("\nLoaded CSVs into dmp.db ")
+    print(f"\nLoaded CSVs into {args.db} ")
+    if not plans_ok:
+        raise SystemExit("API query plans regressed (see BAD PLAN above)")
 
 if __name__ == "__main__":
     main()
@@ -1,23 +1,27 @@
-from fastapi import FastAPI
-import sqlite3
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends
+
+from app.aio_db import AsyncSQLite, get_async_db
+
+@asynccontextmanager
+async def lifespan(app):
+    app.state.db = await AsyncSQLite("medical.db").open()
+    yield
+    await app.state.db.close()
 
 # Create the FastAPI app instance
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Simple health check
 @app.get("/health")
-def health_check():
+async def health_check():
     return {"status": "ok"}
 
 # List all patients
 @app.get("/patients")
-def get_patients():
-    conn = sqlite3.connect("medical.db")
-    cur = conn.cursor()
-    cur.execute("SELECT PatientGuid, FirstName, LastName, DateOfBirth FROM Patients")
-    rows = cur.fetchall()
-    conn.close()
+async def get_patients(db: AsyncSQLite = Depends(get_async_db)):
+    rows = await db.fetchall("SELECT PatientGuid, FirstName, LastName, DateOfBirth FROM Patients")
     return [
-        {"guid": r[0], "first_name": r[1], "last_name": r[2], "dob": r[3]}
+        {"guid": r["PatientGuid"], "first_name": r["FirstName"], "last_name": r["LastName"], "dob": r["DateOfBirth"]}
         for r in rows
     ]
@@ -0,0 +1,198 @@
+# migrate_a_to_b.py
+"""Move every passport from System A into System B.
+
+Patient ids are listed from A page by page; each page's passports are fetched
+concurrently over a pooled HTTP client and imported into B as one batch
+(POST /import/passports?wait=true). After each committed batch the last id is
+written to a checkpoint file, so an interrupted run resumes where it stopped.
+
+    uvicorn system_a:app --port 8001 & uvicorn system_b:app --port 8002 &
+    python migrate_a_to_b.py
+    python migrate_a_to_b.py --in-process          # drive both apps without a server
+    python migrate_a_to_b.py --concurrency 64 --batch-size 1000 --reset
+"""
+import argparse, asyncio, contextlib, json, math, os, sys, time
+
+import httpx
+
+A_URL = "http://127.0.0.1:8001"
+B_URL = "http://127.0.0.1:8002"
+B_TOKEN = "dev-token"
+CHECKPOINT = "migrate_a_to_b.checkpoint.json"
+RETRIES = 3
+FAILED_KEPT = 1000  # failed ids remembered in the checkpoint
+
+# ---------- Checkpoint ----------
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return {"after": "", "migrated": 0, "failed": []}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_checkpoint(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)  # atomic: a crash never leaves a half-written checkpoint
+
+# ---------- Stats ----------
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+def latency_summary(samples):
+    s = sorted(samples)
+    return {f"p{p}_ms": round(percentile(s, p) * 1000, 2) for p in (50, 95, 99)} | {"n": len(s)}
+
+# ---------- HTTP ----------
+async def request(client, method, url, latencies, **kwargs):
+    """One request with retries on transport errors and 5xx; latency of each attempt is recorded."""
+    for attempt in range(RETRIES):
+        t0 = time.perf_counter()
+        try:
+            resp = await client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            if attempt == RETRIES - 1:
+                raise
+        else:
+            latencies.append(time.perf_counter() - t0)
+            if resp.status_code < 500 or attempt == RETRIES - 1:
+                return resp
+        await asyncio.sleep(0.1 * 2 ** attempt)
+
+async def list_ids(client, a_url, after, page_size):
+    """Yield pages of patient ids from A, starting after the given id."""
+    while True:
+        resp = await client.get(f"{a_url}/patients", params={"after": after, "limit": page_size})
+        resp.raise_for_status()
+        page = resp.json()
+        if page["ids"]:
+            yield page["ids"]
+        if not page["next"]:
+            return
+        after = page["next"]
+
+async def fetch_page(client, a_url, ids, sem, latencies):
+    """Passports for one page of ids, fetched concurrently (at most `sem` requests in flight)."""
+    async def one(pid):
+        async with sem:
+            try:
+                resp = await request(client, "GET", f"{a_url}/patients/{pid}/passport", latencies)
+            except httpx.HTTPError as ex:
+                return pid, None, str(ex) or type(ex).__name__
+        if resp.status_code != 200:
+            return pid, None, f"A returned {resp.status_code}"
+        return pid, resp.json(), None
+    return await asyncio.gather(*(one(pid) for pid in ids))
+
+# ---------- Pipeline ----------
+async def migrate(a_client, b_client, args):
+    state = {"after": "", "migrated": 0, "failed": []} if args.reset else load_checkpoint(args.checkpoint)
+    sem = asyncio.Semaphore(args.concurrency)
+    # fetched-but-not-yet-imported batches; a full queue pauses fetching (backpressure)
+    pending = asyncio.Queue(maxsize=args.max_pending)
+    fetch_lat, import_lat = [], []
+    counts = {"fetched": 0, "imported": 0, "failed": 0}
+    t0 = time.perf_counter()
+
+    async def producer():
+        try:
+            async for ids in list_ids(a_client, args.a_url, state["after"], args.batch_size):
+                await pending.put((ids[-1], await fetch_page(a_client, args.a_url, ids, sem, fetch_lat)))
+        finally:
+            await pending.put(None)  # end of stream (or listing failed; `await prod` re-raises)
+
+    async def consumer():
+        while (item := await pending.get()) is not None:
+            last_id, fetched = item
+            docs = [doc for _pid, doc, _err in fetched if doc is not None]
+            failed = [{"id": pid, "error": err} for pid, _doc, err in fetched if err]
+            counts["fetched"] += len(docs)
+            imported = 0
+            if docs:
+                resp = await request(b_client, "POST", f"{args.b_url}/import/passports", import_lat,
+                                     params={"wait": "true"}, json=docs)
+                resp.raise_for_status()
+                for r in resp.json()["results"]:
+                    if r["status"] == "imported":
+                        imported += 1
+                    else:
+                        failed.append({"id": docs[r["index"]].get("patient", {}).get("id"), "error": r.get("error")})
+            counts["imported"] += imported
+            counts["failed"] += len(failed)
+            state["after"] = last_id
+            state["migrated"] += imported
+            state["failed"] = (state["failed"] + failed)[-FAILED_KEPT:]
+            save_checkpoint(args.checkpoint, state)
+            if not args.quiet:
+                rate = counts["imported"] / (time.perf_counter() - t0)
+                print(f"  .. {counts['imported']} imported, {counts['failed']} failed, "
+                      f"{rate:,.0f}/s, after={last_id}", file=sys.stderr)
+
+    prod = asyncio.create_task(producer())
+    try:
+        await consumer()
+        await prod
+    finally:
+        prod.cancel()
+
+    elapsed = time.perf_counter() - t0
+    return {
+        **counts,
+        "seconds": round(elapsed, 3),
+        "passports_per_sec": round(counts["imported"] / elapsed, 1) if elapsed else 0.0,
+        "fetch_latency": latency_summary(fetch_lat),
+        "import_latency": latency_summary(import_lat),
+        "checkpoint": {"path": args.checkpoint, "after": state["after"], "migrated": state["migrated"]},
+    }
+
+# ---------- Clients ----------
+@contextlib.asynccontextmanager
+async def clients(args):
+    """(a_client, b_client): pooled clients over HTTP, or straight into the ASGI apps."""
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    headers_b = {"Authorization": f"Bearer {args.token}"}
+    timeout = httpx.Timeout(args.timeout)
+    async with contextlib.AsyncExitStack() as stack:
+        if args.in_process:
+            import system_a, system_b
+            for app in (system_a.app, system_b.app):
+                await stack.enter_async_context(app.router.lifespan_context(app))
+            a = httpx.AsyncClient(transport=httpx.ASGITransport(app=system_a.app), timeout=timeout)
+            b = httpx.AsyncClient(transport=httpx.ASGITransport(app=system_b.app), headers=headers_b, timeout=timeout)
+            args.a_url = args.b_url = "http://local"
+        else:
+            a = httpx.AsyncClient(limits=limits, timeout=timeout)
+            b = httpx.AsyncClient(limits=limits, headers=headers_b, timeout=timeout)
+        await stack.enter_async_context(a)
+        await stack.enter_async_context(b)
+        yield a, b
+
+async def run(args):
+    async with clients(args) as (a, b):
+        return await migrate(a, b, args)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Migrate passports from System A to System B.")
+    ap.add_argument("--a-url", default=A_URL, help=f"System A base URL (default: {A_URL})")
+    ap.add_argument("--b-url", default=B_URL, help=f"System B base URL (default: {B_URL})")
+    ap.add_argument("--token", default=B_TOKEN, help="bearer token for System B")
+    ap.add_argument("--in-process", action="store_true", help="run both apps in this process (no servers needed)")
+    ap.add_argument("--concurrency", type=int, default=32, help="max passport fetches in flight")
+    ap.add_argument("--batch-size", type=int, default=500, help="passports per list page and per import batch")
+    ap.add_argument("--max-pending", type=int, default=2, help="fetched batches allowed to wait for import")
+    ap.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    ap.add_argument("--checkpoint", default=CHECKPOINT, help=f"progress file (default: {CHECKPOINT})")
+    ap.add_argument("--reset", action="store_true", help="ignore the checkpoint and start from the first id")
+    ap.add_argument("--quiet", action="store_true", help="no per-batch progress lines")
+    args = ap.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2))
+    return 1 if report["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+# parquet_query.py
+"""Query the Parquet export (export_parquet.py) without touching dmp.db.
+
+With DuckDB installed, the four tables are views over the Parquet files and any
+SQL runs against them; the year partition column is available on the dated
+tables, and filtering on it skips the other years' files entirely:
+
+    python parquet_query.py "SELECT EventType, COUNT(*) FROM events WHERE year >= 2023 GROUP BY 1"
+    python parquet_query.py --example top-appointments
+
+Without DuckDB, read_table() loads a (filtered, projected) table through
+pyarrow.dataset:
+
+    python parquet_query.py --table events --years 2024 2025 --columns PatientGuid EventType
+"""
+import argparse, os, sys
+
+from export_parquet import OUT_DIR, PARTITION_BY
+
+EXAMPLES = {
+    "top-appointments": """
+        SELECT p.Surname, p.Forenames, COUNT(a.AppointmentGuid) AS appt_count
+        FROM patients p LEFT JOIN appointments a ON a.PatientGuid = p.PatientGuid
+        GROUP BY p.PatientGuid, p.Surname, p.Forenames
+        ORDER BY appt_count DESC
+        LIMIT 5
+    """,
+    "events-by-year": """
+        SELECT year, EventType, COUNT(*) AS events, COUNT(DISTINCT PatientGuid) AS patients
+        FROM events GROUP BY year, EventType ORDER BY year, EventType
+    """,
+    "current-meds-cohort": """
+        SELECT COUNT(DISTINCT m.PatientGuid) AS patients
+        FROM medications m JOIN patients p ON p.PatientGuid = m.PatientGuid
+        WHERE m.DrugStatus = 1 AND p.DateOfBirth < DATE '1960-01-01'
+    """,
+}
+
+def _glob(root, table):
+    return os.path.join(root, table, "**", "*.parquet") if PARTITION_BY[table] \
+        else os.path.join(root, table, "*.parquet")
+
+def connect(root=OUT_DIR):
+    """DuckDB connection with one view per exported table."""
+    try:
+        import duckdb
+    except ImportError:
+        raise ImportError("SQL queries over the Parquet export need duckdb: pip install duckdb") from None
+    con = duckdb.connect()
+    for table in PARTITION_BY:
+        if os.path.isdir(os.path.join(root, table)):
+            hive = 1 if PARTITION_BY[table] else 0
+            path = _glob(root, table).replace("'", "''")
+            con.execute(f"CREATE VIEW {table} AS SELECT * FROM read_parquet('{path}', hive_partitioning={hive})")
+    return con
+
+def query(sql, root=OUT_DIR):
+    """Run SQL against the export; returns (column names, rows)."""
+    con = connect(root)
+    try:
+        cur = con.execute(sql)
+        return [d[0] for d in cur.description], cur.fetchall()
+    finally:
+        con.close()
+
+def read_table(table, root=OUT_DIR, columns=None, years=None):
+    """One table as a pyarrow.Table; years= prunes partitions before any file is read."""
+    try:
+        import pyarrow.dataset as ds
+    except ImportError:
+        raise ImportError("reading the Parquet export needs pyarrow: pip install pyarrow") from None
+    dataset = ds.dataset(os.path.join(root, table), format="parquet",
+                         partitioning="hive" if PARTITION_BY[table] else None)
+    flt = None
+    if years and PARTITION_BY[table]:
+        flt = ds.field("year").isin([int(y) for y in years])
+    return dataset.to_table(columns=columns, filter=flt)
+
+def _print(names, rows, limit):
+    print("\t".join(names))
+    for row in rows[:limit]:
+        print("\t".join("" if v is None else str(v) for v in row))
+    if len(rows) > limit:
+        print(f"... {len(rows) - limit} more rows", file=sys.stderr)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Query the Parquet export of dmp.db.")
+    ap.add_argument("sql", nargs="?", help="SQL over patients/appointments/medications/events (DuckDB)")
+    ap.add_argument("--root", default=OUT_DIR, help="export directory (default: parquet)")
+    ap.add_argument("--example", choices=sorted(EXAMPLES), help="run a canned query")
+    ap.add_argument("--table", choices=list(PARTITION_BY), help="read one table with pyarrow instead of SQL")
+    ap.add_argument("--years", nargs="+", type=int, help="with --table: only these partitions")
+    ap.add_argument("--columns", nargs="+", help="with --table: only these columns")
+    ap.add_argument("--limit", type=int, default=50, help="rows printed (default: 50)")
+    args = ap.parse_args(argv)
+
+    if args.table:
+        t = read_table(args.table, args.root, args.columns, args.years)
+        print(f"{t.num_rows:,} rows", file=sys.stderr)
+        _print(t.column_names, [tuple(r.values()) for r in t.slice(0, args.limit).to_pylist()], args.limit)
+        return
+    sql = EXAMPLES[args.example] if args.example else args.sql
+    if not sql:
+        ap.error("give SQL, --example or --table")
+    names, rows = query(sql, args.root)
+    _print(names, rows, args.limit)
+
+if __name__ == "__main__":
+    main()
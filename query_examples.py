@@ -8,11 +8,10 @@ print("Total patients:", c.execute("SELECT COUNT(*) FROM patients").fetchone()[0
 
 print("\nTop 5 patients by appointment count:")
 for r in c.execute("""
-    SELECT p.Surname, p.Forenames, COUNT(a.AppointmentGuid) AS appt_count
-    FROM patients p
-    LEFT JOIN appointments a ON a.PatientGuid = p.PatientGuid
-    GROUP BY p.PatientGuid
-    ORDER BY appt_count DESC
+    SELECT p.Surname, p.Forenames, s.AppointmentCount AS appt_count
+    FROM patient_summary s
+    JOIN patients p ON p.PatientGuid = s.PatientGuid
+    ORDER BY s.AppointmentCount DESC
     LIMIT 5
 """):
     print(dict(r))
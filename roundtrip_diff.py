@@ -0,0 +1,142 @@
+# roundtrip_diff.py
+"""Check that passports survived A -> B: compare A's export with B's re-export.
+
+Ids are listed from System A page by page; for each page both systems'
+passports are fetched concurrently, canonicalized (sorted keys, compact JSON)
+and hashed. Only documents whose hashes differ are walked for a structural
+diff. Nothing is kept per record beyond the page in flight, so memory stays
+flat however many passports are compared.
+
+    python roundtrip_diff.py --in-process
+    python roundtrip_diff.py --a-url http://a:8001 --b-url http://b:8002 --out diff_report.json
+"""
+import argparse, asyncio, collections, hashlib, json, re, sys, time
+
+from migrate_a_to_b import A_URL, B_URL, B_TOKEN, clients, latency_summary, list_ids, request
+
+SAMPLES = 20     # mismatching records kept (with their diffs) in the report
+TOP_PATHS = 20   # most frequent differing paths listed in the report
+MISSING = object()
+
+# ---------- Canonical form ----------
+def canonical(doc) -> bytes:
+    return json.dumps(doc, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def digest(doc) -> str:
+    return hashlib.sha256(canonical(doc)).hexdigest()
+
+# ---------- Structural diff ----------
+def diff(a, b, path=""):
+    """Yield (path, kind, a_value, b_value) for every difference between two JSON values."""
+    if isinstance(a, dict) and isinstance(b, dict):
+        for key in sorted(a.keys() | b.keys()):
+            yield from diff(a.get(key, MISSING), b.get(key, MISSING), f"{path}/{key}")
+    elif isinstance(a, list) and isinstance(b, list):
+        for i in range(max(len(a), len(b))):
+            yield from diff(a[i] if i < len(a) else MISSING, b[i] if i < len(b) else MISSING, f"{path}/{i}")
+    elif a is MISSING:
+        yield path or "/", "only_in_b", None, b
+    elif b is MISSING:
+        yield path or "/", "only_in_a", a, None
+    elif a != b or type(a) is not type(b):
+        yield path or "/", "changed", a, b
+
+def path_pattern(path):
+    """Collapse list indices so /name/0/text and /name/1/text count as one path."""
+    return re.sub(r"/\d+(?=/|$)", "/*", path)
+
+# ---------- Compare ----------
+async def fetch_pair(a_client, b_client, args, pid, sem, latencies):
+    async def get(client, base):
+        async with sem:
+            resp = await request(client, "GET", f"{base}/patients/{pid}/passport", latencies)
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        return resp.json()
+    try:
+        a, b = await asyncio.gather(get(a_client, args.a_url), get(b_client, args.b_url))
+    except Exception as ex:
+        return pid, None, None, str(ex) or type(ex).__name__
+    return pid, a, b, None
+
+async def compare(a_client, b_client, args):
+    sem = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    counts = collections.Counter(compared=0, identical=0, different=0, missing_in_a=0, missing_in_b=0, errors=0)
+    paths = collections.Counter()
+    samples, errors = [], []
+    t0 = time.perf_counter()
+
+    async for ids in list_ids(a_client, args.a_url, "", args.batch_size):
+        pairs = await asyncio.gather(*(fetch_pair(a_client, b_client, args, pid, sem, latencies) for pid in ids))
+        for pid, a, b, err in pairs:
+            counts["compared"] += 1
+            if err:
+                counts["errors"] += 1
+                if len(errors) < args.samples:
+                    errors.append({"id": pid, "error": err})
+            elif a is None:
+                counts["missing_in_a"] += 1
+            elif b is None:
+                counts["missing_in_b"] += 1
+            elif digest(a) == digest(b):
+                counts["identical"] += 1
+            else:
+                counts["different"] += 1
+                found = list(diff(a, b))
+                paths.update({path_pattern(p) for p, *_ in found})
+                if len(samples) < args.samples:
+                    samples.append({"id": pid, "diffs": [
+                        {"path": p, "kind": kind, "a": va, "b": vb} for p, kind, va, vb in found[:args.max_diffs]
+                    ]})
+        if not args.quiet:
+            print(f"  .. {counts['compared']} compared, {counts['different']} different, "
+                  f"{counts['missing_in_b']} missing in B", file=sys.stderr)
+
+    elapsed = time.perf_counter() - t0
+    return {
+        "counts": dict(counts),
+        "seconds": round(elapsed, 3),
+        "records_per_sec": round(counts["compared"] / elapsed, 1) if elapsed else 0.0,
+        "fetch_latency": latency_summary(latencies),
+        "top_paths": [{"path": p, "records": n} for p, n in paths.most_common(args.top_paths)],
+        "samples": samples,
+        "errors": errors,
+    }
+
+async def run(args):
+    async with clients(args) as (a, b):
+        return await compare(a, b, args)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Compare System A passports with System B's round-trip export.")
+    ap.add_argument("--a-url", default=A_URL, help=f"System A base URL (default: {A_URL})")
+    ap.add_argument("--b-url", default=B_URL, help=f"System B base URL (default: {B_URL})")
+    ap.add_argument("--token", default=B_TOKEN, help="bearer token for System B")
+    ap.add_argument("--in-process", action="store_true", help="run both apps in this process (no servers needed)")
+    ap.add_argument("--concurrency", type=int, default=32, help="max fetches in flight")
+    ap.add_argument("--batch-size", type=int, default=500, help="ids compared per page")
+    ap.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    ap.add_argument("--samples", type=int, default=SAMPLES, help="mismatching records kept in the report")
+    ap.add_argument("--max-diffs", type=int, default=50, help="differences kept per sampled record")
+    ap.add_argument("--top-paths", type=int, default=TOP_PATHS, help="differing paths listed by frequency")
+    ap.add_argument("--out", default="-", help="report file, '-' for stdout (default)")
+    ap.add_argument("--quiet", action="store_true", help="no per-page progress lines")
+    args = ap.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2, ensure_ascii=False, default=str)
+    if args.out == "-":
+        print(text)
+    else:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        c = report["counts"]
+        print(f"{c['compared']} compared: {c['identical']} identical, {c['different']} different, "
+              f"{c['missing_in_b']} missing in B, {c['errors']} errors -> {args.out}", file=sys.stderr)
+    c = report["counts"]
+    return 0 if c["compared"] == c["identical"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,23 @@
 # system_a.py — Exporter with JSON/XML "bundle"
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse, Response
+from fastapi.responses import Response
+import json
+import os
 import xml.etree.ElementTree as ET
 
-app = FastAPI()
+from app.aio_db import AsyncSQLite
+from app.cache import LRUCache
+
 DUMMY_TOKEN = "dev-token"
 
-# simple in-memory data
+# ---------- Data source ----------
+# Patients come from the dmp.db schema (load_to_sqlite.py). Without that file
+# the exporter falls back to the small demo set below.
+DB_PATH = os.getenv("SYSTEM_A_DB", "dmp.db")
+STORE_SIZE = int(os.getenv("SYSTEM_A_STORE_SIZE", "100000"))  # serialized bundles kept
+PREWARM = os.getenv("SYSTEM_A_PREWARM", "0") == "1"          # fill the store at startup
+
 PATIENTS = {
     "P-001": {"id": "P-001", "name": [{"text": "Patient P-001"}], "birthDate": "1985-03-18"},
     "P-002": {"id": "P-002", "name": [{"text": "Patient P-002"}], "birthDate": "1990-05-12"},
@@ -20,11 +31,18 @@ PATIENTS = {
     "P-010": {"id": "P-010", "name": [{"text": "Patient P-010"}], "birthDate": "1979-12-05"},
 }
 
+PATIENT_COLS = "p.PatientGuid AS id, p.Forenames || ' ' || p.Surname AS name, p.DateOfBirth AS birthDate"
+PATIENT_SQL = f"SELECT {PATIENT_COLS} FROM patients p WHERE p.PatientGuid = ?"
+PREWARM_SQL = f"""
+    SELECT {PATIENT_COLS}, COALESCE(v.Version, 0) AS version
+    FROM patients p LEFT JOIN patient_versions v ON v.PatientGuid = p.PatientGuid
+    LIMIT ?
+"""
 
-def bundle_for(pid: str) -> dict:
-    patient = PATIENTS.get(pid)
-    if not patient:
-        raise HTTPException(status_code=404, detail="Patient not found")
+def patient_from_row(row) -> dict:
+    return {"id": row["id"], "name": [{"text": row["name"]}], "birthDate": row["birthDate"]}
+
+def bundle_for(patient: dict) -> dict:
     return {
         "passportVersion": "0.1",
         "patient": {
@@ -61,12 +79,181 @@ def dict_to_xml(tag: str, d: dict) -> ET.Element:
         ET.SubElement(root, arr_key)  # empty container
     return root
 
+# ---------- Serialized bundle store ----------
+class BundleStore:
+    """
+    Passport bundles kept already encoded, as JSON and XML bytes.
+
+    Each entry remembers the version it was built from: the patient's counter
+    in patient_versions (bumped by triggers whenever its rows change) or, for
+    databases without that table, the file's stat signature. A request costs
+    one version lookup; the bundle is only rebuilt when the version moved.
+    """
+
+    def __init__(self, db_path=DB_PATH, size=STORE_SIZE):
+        self.db_path = db_path
+        self.versioned = False
+        self._entries = LRUCache(size)
+
+    def detect(self, conn):
+        self.versioned = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='patient_versions'"
+        ).fetchone() is not None
+
+    def _file_version(self):
+        sig = []
+        for path in (self.db_path, self.db_path + "-wal"):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            sig += [st.st_mtime_ns, st.st_size]
+        return "f" + "-".join(map(str, sig))
+
+    def version(self, conn, pid):
+        if conn is None:
+            return 0  # demo data never changes
+        if self.versioned:
+            row = conn.execute("SELECT Version FROM patient_versions WHERE PatientGuid = ?", (pid,)).fetchone()
+            return row[0] if row else 0
+        return self._file_version()
+
+    def _build(self, patient, version):
+        bundle = bundle_for(patient)
+        return {
+            "version": version,
+            # same encoding JSONResponse uses
+            "json": json.dumps(bundle, ensure_ascii=False, allow_nan=False, indent=None,
+                               separators=(",", ":")).encode("utf-8"),
+            "xml": ET.tostring(dict_to_xml("passport", bundle), encoding="utf-8"),
+        }
+
+    def lookup(self, conn, pid):
+        """The entry for pid, rebuilt if its source rows changed; None if there is no such patient."""
+        version = self.version(conn, pid)
+        entry = self._entries.get(pid)
+        if entry is not None and entry["version"] == version:
+            return entry
+        if conn is None:
+            patient = PATIENTS.get(pid)
+        else:
+            row = conn.execute(PATIENT_SQL, (pid,)).fetchone()
+            patient = patient_from_row(row) if row else None
+        if patient is None:
+            self._entries.pop(pid)
+            return None
+        entry = self._build(patient, version)
+        self._entries.put(pid, entry)
+        return entry
+
+    def prewarm(self, conn):
+        """Serialize up to the store size of patients in one pass."""
+        if conn is None:
+            for pid, patient in PATIENTS.items():
+                self._entries.put(pid, self._build(patient, 0))
+            return len(PATIENTS)
+        sql = PREWARM_SQL if self.versioned else f"SELECT {PATIENT_COLS} FROM patients p LIMIT ?"
+        file_version = self._file_version()
+        n = 0
+        for row in conn.execute(sql, (self._entries.maxsize,)):
+            version = row["version"] if self.versioned else file_version
+            self._entries.put(row["id"], self._build(patient_from_row(row), version))
+            n += 1
+        return n
+
+    def __len__(self):
+        return len(self._entries)
+
+# ---------- App ----------
+@asynccontextmanager
+async def lifespan(app):
+    app.state.store = BundleStore(DB_PATH)
+    app.state.db = await AsyncSQLite(DB_PATH).open() if os.path.exists(DB_PATH) else None
+    if app.state.db is not None:
+        await app.state.db.run(app.state.store.detect)
+    if PREWARM:
+        await run_db(app, app.state.store.prewarm)
+    yield
+    if app.state.db is not None:
+        await app.state.db.close()
+
+app = FastAPI(lifespan=lifespan)
+
+async def run_db(app, fn, *args):
+    """fn(conn, *args) on the database, or fn(None, *args) for the demo data."""
+    if app.state.db is None:
+        return fn(None, *args)
+    return await app.state.db.run(fn, *args)
+
+def _ids_page(conn, after, limit):
+    if conn is None:
+        return sorted(pid for pid in PATIENTS if pid > after)[:limit]
+    return [r[0] for r in conn.execute(
+        "SELECT PatientGuid FROM patients WHERE PatientGuid > ? ORDER BY PatientGuid LIMIT ?", (after, limit))]
+
+@app.get("/patients")
+async def list_patients(after: str = "", limit: int = 1000):
+    """Patient ids in id order, one keyset page at a time (pass next as ?after=)."""
+    limit = max(1, min(limit, 10000))
+    ids = await run_db(app, _ids_page, after, limit)
+    return {"ids": ids, "next": ids[-1] if len(ids) == limit else None}
+
+# ---------- Content negotiation ----------
+MEDIA_TYPES = {"json": "application/json", "xml": "application/xml"}
+SERVED = [("json", "application/json"), ("xml", "application/xml"), ("xml", "text/xml")]  # preference order on ties
+
+def _media_ranges(accept: str):
+    for part in accept.split(","):
+        mtype, *params = [s.strip() for s in part.split(";")]
+        q = 1.0
+        for p in params:
+            if p.lower().startswith("q="):
+                try:
+                    q = float(p[2:])
+                except ValueError:
+                    q = 0.0
+        if mtype:
+            yield mtype.lower(), q
+
+def _quality(media: str, ranges) -> float:
+    """q of the most specific range matching media (exact > type/* > */*), 0 if none does."""
+    kind = media.split("/")[0]
+    best, best_rank = 0.0, -1
+    for mtype, q in ranges:
+        rank = 2 if mtype == media else 1 if mtype == f"{kind}/*" else 0 if mtype == "*/*" else -1
+        if rank > best_rank:
+            best, best_rank = q, rank
+    return best
+
+def negotiate(accept: str):
+    """Format for an Accept header ("json"/"xml"), honouring q-values; None if nothing we serve is acceptable."""
+    if not accept or not accept.strip():
+        return "json"
+    ranges = list(_media_ranges(accept))
+    best, best_q = None, 0.0
+    for fmt, media in SERVED:
+        q = _quality(media, ranges)
+        if q > best_q:
+            best, best_q = fmt, q
+    return best
+
 @app.get("/patients/{patient_id}/passport")
-def export_passport(patient_id: str, request: Request, format: str = "json"):
-    bundle = bundle_for(patient_id)
-    wants_xml = (format.lower() == "xml") or (request.headers.get("accept", "").lower() == "application/xml")
-    if wants_xml:
-        xml_elem = dict_to_xml("passport", bundle)
-        xml_bytes = ET.tostring(xml_elem, encoding="utf-8")
-        return Response(content=xml_bytes, media_type="application/xml")
-    return JSONResponse(bundle)
+async def export_passport(patient_id: str, request: Request, format: str = None):
+    if format is not None:
+        fmt = format.lower()
+        if fmt not in MEDIA_TYPES:
+            raise HTTPException(status_code=400, detail="format must be json or xml")
+    else:
+        fmt = negotiate(request.headers.get("accept", ""))
+        if fmt is None:
+            raise HTTPException(status_code=406, detail="Supported types: application/json, application/xml")
+
+    entry = await run_db(app, app.state.store.lookup, patient_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Patient not found")
+
+    etag = f'"{patient_id}.{entry["version"]}.{fmt}"'
+    headers = {"Vary": "Accept", "ETag": etag}
+    if etag in (t.strip() for t in request.headers.get("if-none-match", "").split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry[fmt], media_type=MEDIA_TYPES[fmt], headers=headers)
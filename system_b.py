@@ -1,13 +1,25 @@
 # system_b.py — Importer + Round-trip Export (SQLite)
+from contextlib import asynccontextmanager
+from concurrent.futures import Future
 from fastapi import FastAPI, Depends, HTTPException, Header
-from typing import Dict, Any
+from fastapi.responses import JSONResponse
+from typing import Dict, Any, List
+import asyncio
+import collections
+import logging
+import os
+import queue
 import sqlite3
+import threading
+import time
+
+from app.aio_db import AsyncSQLite, get_async_db
 
-app = FastAPI()
 DUMMY_TOKEN = "dev-token"
+log = logging.getLogger("system_b")
 
 # ---------- Auth ----------
-def auth(authorization: str = Header(None)):
+async def auth(authorization: str = Header(None)):
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Unauthorized")
     if authorization.split()[1] != DUMMY_TOKEN:
@@ -33,18 +45,168 @@ def get_patient(conn, pid: str):
     cur = conn.cursor()
     cur.execute("SELECT id, name, birth_date FROM patients WHERE id = ?", (pid,))
     row = cur.fetchone()
-    return row  # (id, name, birth_date) or None
+    return tuple(row) if row else None  # (id, name, birth_date) or None
+
+# ---------- Write queue (group commit) ----------
+WRITE_BATCH_MAX = int(os.getenv("SYSTEM_B_WRITE_BATCH", "1000"))        # rows per commit
+WRITE_BATCH_WAIT = float(os.getenv("SYSTEM_B_WRITE_WAIT_MS", "5")) / 1000  # linger for more rows
+
+class PassportWriter:
+    """
+    Single background writer thread for the patients table.
+
+    Requests enqueue rows and get a Future; the writer drains the queue into
+    group commits of up to WRITE_BATCH_MAX rows (one transaction and one fsync
+    per batch instead of per passport) and resolves the futures once their
+    rows are durable. When a group commit fails it is rolled back and each
+    submission is retried in its own transaction, so only the submissions
+    that fail on their own are rejected. Those fail their futures, are logged,
+    and are counted in status() (failed rows and batches, last error), since
+    202 submitters never await their future.
+    """
+
+    def __init__(self, db_file=DB_FILE, batch_max=WRITE_BATCH_MAX, wait=WRITE_BATCH_WAIT):
+        self.db_file = db_file
+        self.batch_max = batch_max
+        self.wait = wait
+        self.enqueued = 0
+        self.persisted = 0
+        self.commits = 0
+        self.last_commit_at = None
+        self.failed_rows = 0
+        self.failed_batches = 0
+        self.last_error = None  # {"at": epoch seconds, "error": "Type: message"}
+        self.split_commits = 0  # failed group commits retried one submission at a time
+        self._queue = queue.Queue()
+        self._pending = collections.deque()  # enqueue times of unpersisted items, FIFO
+        self._thread = None
+
+    def start(self):
+        conn = _conn(self.db_file)
+        conn.execute("PRAGMA journal_mode=WAL")
+        ensure_tables(conn)
+        self._thread = threading.Thread(target=self._run, args=(conn,), name="passport-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Flush everything queued so far, then stop the writer."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def submit(self, rows) -> Future:
+        fut = Future()
+        self._pending.append(time.monotonic())
+        self.enqueued += len(rows)
+        self._queue.put((rows, fut))
+        return fut
+
+    def status(self):
+        oldest = self._pending[0] if self._pending else None
+        return {
+            "queue_depth": self._queue.qsize(),
+            "pending_rows": self.enqueued - self.persisted - self.failed_rows,
+            "lag_seconds": round(time.monotonic() - oldest, 3) if oldest is not None else 0.0,
+            "enqueued_rows": self.enqueued,
+            "persisted_rows": self.persisted,
+            "commits": self.commits,
+            "last_commit_at": self.last_commit_at,
+            "failed_rows": self.failed_rows,
+            "failed_batches": self.failed_batches,
+            "last_error": self.last_error,
+            "split_commits": self.split_commits,
+        }
+
+    def _run(self, conn):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch, n = [item], len(item[0])
+            deadline = time.monotonic() + self.wait
+            while n < self.batch_max:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                n += len(item[0])
+            self._commit(conn, batch, n)
+        conn.close()
+
+    def _commit(self, conn, batch, n):
+        try:
+            try:
+                self._insert(conn, batch)
+            except Exception as ex:
+                if len(batch) == 1:
+                    self._reject(batch[0], ex)
+                    return
+                log.warning("group commit of %d rows (%d submissions) failed (%s: %s); retrying each submission",
+                            n, len(batch), type(ex).__name__, ex)
+                self.split_commits += 1
+                for item in batch:
+                    try:
+                        self._insert(conn, [item])
+                    except Exception as ex:
+                        self._reject(item, ex)
+                    else:
+                        self._resolve([item])
+            else:
+                self._resolve(batch)
+        finally:
+            for _ in batch:
+                self._pending.popleft()
+
+    def _insert(self, conn, batch):
+        """One transaction for the batch's rows; rolled back if any row fails."""
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO patients(id, name, birth_date) VALUES (?, ?, ?)",
+                [row for rows, _fut in batch for row in rows],
+            )
+
+    def _resolve(self, batch):
+        self.persisted += sum(len(rows) for rows, _fut in batch)
+        self.commits += 1
+        self.last_commit_at = time.time()
+        for rows, fut in batch:
+            fut.set_result(len(rows))
+
+    def _reject(self, item, ex):
+        rows, fut = item
+        log.error("commit of a %d-row submission failed", len(rows), exc_info=ex)
+        self.failed_rows += len(rows)
+        self.failed_batches += 1
+        self.last_error = {"at": time.time(), "error": f"{type(ex).__name__}: {ex}"}
+        fut.set_exception(ex)
+
+# ---------- App (tables are created once, at startup) ----------
+@asynccontextmanager
+async def lifespan(app):
+    app.state.writer = PassportWriter()
+    app.state.writer.start()
+    app.state.db = await AsyncSQLite(DB_FILE).open()
+    yield
+    await asyncio.get_running_loop().run_in_executor(None, app.state.writer.stop)
+    await app.state.db.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # ---------- Health (for quick ping) ----------
 @app.get("/health")
-def health(_=Depends(auth)):
+async def health(_=Depends(auth)):
     return {"ok": True}
 
 # ---------- Import endpoint (JSON from System A) ----------
 @app.post("/import/passport")
-def import_passport(payload: Dict[str, Any], _=Depends(auth)):
+async def import_passport(payload: Dict[str, Any], _=Depends(auth)):
     """
-    Accepts a DMP JSON from System A and writes minimal patient info to SQLite.
+    Accepts a DMP JSON from System A and writes minimal patient info to SQLite
+    (through the write queue; responds once the row is committed).
     Expected shape (minimal):
     {
       "patient": {
@@ -59,54 +221,93 @@ def import_passport(payload: Dict[str, Any], _=Depends(auth)):
       "observations": []
     }
     """
-    patient = payload.get("patient", {})
+    row = patient_row(payload)
+    await asyncio.wrap_future(app.state.writer.submit([row]))
+    return {"status": "imported", "patient": row[0]}
+
+def patient_row(payload: Any):
+    """(id, name, birth_date) from a System A bundle; HTTPException(422) if unusable."""
+    patient = payload.get("patient") if isinstance(payload, dict) else None
     if not patient:
         raise HTTPException(status_code=422, detail="Missing 'patient' in payload")
+    if not isinstance(patient, dict):
+        raise HTTPException(status_code=422, detail="patient must be an object")
 
-    pid = patient.get("id", "").strip()
-    if not pid:
-        raise HTTPException(status_code=422, detail="Missing patient.id")
+    pid = patient.get("id")
+    if not isinstance(pid, str) or not pid.strip():
+        raise HTTPException(status_code=422, detail="patient.id must be a non-empty string")
 
     # derive a display name if FHIR-style name array exists
-    name = ""
-    if isinstance(patient.get("name"), list) and patient["name"]:
-        name = str(patient["name"][0].get("text", "")).strip()
-    else:
-        name = str(patient.get("name", "")).strip()
-
-    birth = str(patient.get("birthDate", "")).strip()
-
-    conn = _conn()
-    ensure_tables(conn)
-    conn.execute(
-        "INSERT OR REPLACE INTO patients(id, name, birth_date) VALUES (?, ?, ?)",
-        (pid, name, birth),
-    )
-    conn.commit()
-    return {"status": "imported", "patient": pid}
+    name = patient.get("name", "")
+    if isinstance(name, list):
+        first = name[0] if name else {}
+        if not isinstance(first, dict) or not isinstance(first.get("text", ""), str):
+            raise HTTPException(status_code=422, detail="patient.name[0] must be an object with a text string")
+        name = first.get("text", "")
+    elif not isinstance(name, str):
+        raise HTTPException(status_code=422, detail="patient.name must be a string or a list of names")
+
+    birth = patient.get("birthDate", "")
+    if not isinstance(birth, str):
+        raise HTTPException(status_code=422, detail="patient.birthDate must be a string")
+    return (pid.strip(), name.strip(), birth.strip())
+
+# ---------- Bulk import (queued, group-committed) ----------
+@app.post("/import/passports")
+async def import_passports(payloads: List[Any], wait: bool = False, _=Depends(auth)):
+    """
+    Accepts a JSON array of System A bundles. Each valid one is queued for the
+    background writer on its own, so a record the database rejects fails
+    alone; malformed records are reported as invalid. With ?wait=true the
+    response is sent once the queued ones are committed (or failed),
+    otherwise immediately (202) with the current queue status.
+    """
+    writer = app.state.writer
+    futures, results = [], []
+    for i, payload in enumerate(payloads):
+        try:
+            row = patient_row(payload)
+        except HTTPException as ex:
+            results.append({"index": i, "status": "invalid", "error": ex.detail})
+            continue
+        result = {"index": i, "status": "queued", "patient": row[0]}
+        results.append(result)
+        futures.append((writer.submit([row]), result))
+
+    if futures and wait:
+        outcomes = await asyncio.gather(*(asyncio.wrap_future(f) for f, _r in futures), return_exceptions=True)
+        for (_f, r), outcome in zip(futures, outcomes):
+            if isinstance(outcome, Exception):
+                r.update(status="failed", error=f"{type(outcome).__name__}: {outcome}")
+            else:
+                r["status"] = "imported"
+    body = {"accepted": len(futures), "rejected": len(payloads) - len(futures),
+            "results": results, "writer": writer.status()}
+    return JSONResponse(body, status_code=200 if wait or not futures else 202)
+
+@app.get("/import/status")
+async def import_status(_=Depends(auth)):
+    """Write-queue depth, how far persistence lags behind intake, and failed commits."""
+    return app.state.writer.status()
 
 # ---------- Stats ----------
 @app.get("/stats")
-def stats(_=Depends(auth)):
+async def stats(_=Depends(auth), db: AsyncSQLite = Depends(get_async_db)):
     try:
-        conn = _conn()
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM patients")
-        n = cur.fetchone()[0]
+        row = await db.fetchone("SELECT COUNT(*) AS n FROM patients")
+        n = row["n"]
     except Exception:
         n = 0
-    return {"patients": n}
+    return {"patients": n, "writer": app.state.writer.status()}
 
 # ---------- NEW: Round-trip export from System B ----------
 @app.get("/patients/{pid}/passport")
-def export_passport(pid: str, _=Depends(auth)):
+async def export_passport(pid: str, _=Depends(auth), db: AsyncSQLite = Depends(get_async_db)):
     """
     Re-export the patient we previously imported (minimal bundle),
     so you can compare A → B → (export) with A’s original JSON.
     """
-    conn = _conn()
-    ensure_tables(conn)
-    row = get_patient(conn, pid)
+    row = await db.run(get_patient, pid)
     if not row:
         raise HTTPException(status_code=404, detail="Patient not found in System B")
 
@@ -0,0 +1,40 @@
+# tests/conftest.py
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+@pytest.fixture
+def dmp_db(tmp_path):
+    """Path to an empty dmp.db as a full load leaves it: tables, indexes, triggers, search and summary."""
+    import load_to_sqlite
+    path = tmp_path / "dmp.db"
+    conn = sqlite3.connect(path)
+    for stmt in load_to_sqlite.DDL:
+        conn.execute(stmt)
+    load_to_sqlite.post_load(conn)
+    for stmt in load_to_sqlite.INCREMENTAL_DDL:
+        conn.execute(stmt)
+    conn.commit()
+    conn.close()
+    return str(path)
+
+@pytest.fixture
+def api_client(dmp_db, monkeypatch):
+    """Flask test client for the app/routes.py API on dmp_db, with an empty passport cache."""
+    pytest.importorskip("flask")
+    from flask import Flask
+    from app.db import close_db
+    from app.dmp import dmp_cache
+    from app.routes import api
+    monkeypatch.setenv("DB_PATH", dmp_db)
+    dmp_cache.clear()
+    app = Flask(__name__)
+    app.register_blueprint(api)
+    app.teardown_appcontext(close_db)
+    return app.test_client()
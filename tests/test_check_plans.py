@@ -0,0 +1,47 @@
+# tests/test_check_plans.py
+"""load_to_sqlite.py --check-plans: temp sorts and table scans fail the check."""
+import sqlite3
+
+import pytest
+
+import load_to_sqlite
+
+@pytest.fixture
+def db(tmp_path):
+    path = tmp_path / "dmp.db"
+    conn = sqlite3.connect(path)
+    for stmt in load_to_sqlite.DDL:
+        conn.execute(stmt)
+    load_to_sqlite.post_load(conn)
+    conn.commit()
+    conn.close()
+    return str(path)
+
+def test_indexed_schema_passes(db):
+    with pytest.raises(SystemExit) as exit_:
+        load_to_sqlite.main(["--db", db, "--check-plans"])
+    assert exit_.value.code == 0
+
+def test_missing_index_fails(db, capsys):
+    conn = sqlite3.connect(db)
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='appointments'"
+                                " AND sql IS NOT NULL").fetchall():
+        conn.execute(f"DROP INDEX {name}")
+    conn.commit()
+    conn.close()
+    with pytest.raises(SystemExit) as exit_:
+        load_to_sqlite.main(["--db", db, "--check-plans"])
+    assert exit_.value.code == 1
+    assert "BAD PLAN: api.appointments: SCAN appointments" in capsys.readouterr().out
+
+@pytest.mark.parametrize("line, bad", [
+    ("SEARCH events USING INDEX idx_evt_patient_effective_guid (PatientGuid=?)", False),
+    ("SCAN json_each VIRTUAL TABLE INDEX 1:", False),
+    ("SCAN (subquery-1)", False),
+    ("SCAN CONSTANT ROW", False),
+    ("SCAN events", True),
+    ("SCAN events USING INDEX idx_evt_patient_effective_guid", True),
+    ("USE TEMP B-TREE FOR ORDER BY", True),
+])
+def test_bad_plan_line(line, bad):
+    assert load_to_sqlite._bad_plan_line(line) is bad
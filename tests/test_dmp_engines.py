@@ -0,0 +1,91 @@
+# tests/test_dmp_engines.py
+"""DMP_ENGINE=sql must produce the same bytes as serialize.dumps() of the Python builder."""
+import sqlite3
+
+import pytest
+
+import load_to_sqlite
+from app import dmp, serialize
+
+# Awkward but schema-valid rows: NULLs where the columns allow them, empty
+# strings where they don't, non-ASCII and escape-worthy text, same-date rows
+# (ordered by the GUID tiebreak) and patients without any child rows.
+PATIENTS = [
+    # PatientGuid, Forenames, Surname, DateOfBirth, Sex, PostCode, Ethnicity, PatientType, PatientStatus, NHSNumber
+    ("p-full", "Zoë", "O'Brien-Łukasz", "1980-02-29", "F", "AB1 2CD", "A", 1, 1, "9434765919"),
+    ("p-empty", "", "", "", "U", None, None, 1, 1, None),
+    ("p-blank", "  Ana\t", " 　", "2001-01-01", "M", "", "", 2, 2, ""),
+    ("p-unicode", "名前", "😀 \"quoted\" \\ back", "1970-01-01", "I", "Zürich", None, 1, 3, None),
+]
+APPOINTMENTS = [
+    # AppointmentGuid, PatientGuid, StartDateTime, EndDateTime, CurrentStatus, SessionLocation
+    ("a-2", "p-full", "2024-03-01T09:00:00", "2024-03-01T09:10:00", 1, "Room 1"),
+    ("a-1", "p-full", "2024-03-01T09:00:00", "2024-03-01T09:10:00", 2, None),
+    ("a-3", "p-full", "2023-12-31T23:59:59", "", 3, ""),
+    ("a-4", "p-unicode", "2022-06-01T10:00:00", "2022-06-01T10:30:00", 1, "Praxis Müller\nline two"),
+]
+MEDICATIONS = [
+    # MedicationGuid, PatientGuid, Term, Dosage, PrescriptionType, DrugStatus, EffectiveDateTime
+    ("m-1", "p-full", "Paracétamol 500 mg", "1 tab\tfour times daily", 1, 1, "2024-01-05T00:00:00"),
+    ("m-3", "p-full", "Ibuprofen", None, 2, 2, "2024-01-05T00:00:00"),
+    ("m-2", "p-full", "", "", 3, 3, ""),
+    ("m-4", "p-unicode", "💊   \x1f", None, 4, 1, "2020-01-01T00:00:00"),
+]
+EVENTS = [
+    # EventGuid, PatientGuid, EventType, Term, ReadCode, SnomedCTCode, EffectiveDateTime
+    ("e-1", "p-full", 11, "Penicillin allergy", "14L..", "91936005", "2019-05-05T00:00:00"),
+    ("e-2", "p-full", 13, "Influenza vaccine", None, None, "2023-10-01T00:00:00"),
+    ("e-4", "p-full", 13, "Booster", "", "", "2023-10-01T00:00:00"),
+    ("e-3", "p-full", 1, "Blood pressure", "246..", "75367002", ""),
+    ("e-5", "p-unicode", 11, "Allergie à l'arachide", None, "91935009", "2018-01-01T00:00:00"),
+]
+GUIDS = [p[0] for p in PATIENTS]
+
+@pytest.fixture(scope="module")
+def conn(tmp_path_factory):
+    path = tmp_path_factory.mktemp("engines") / "dmp.db"
+    conn = sqlite3.connect(path)
+    for stmt in load_to_sqlite.DDL:
+        conn.execute(stmt)
+    for table, rows in (("patients", PATIENTS), ("appointments", APPOINTMENTS),
+                        ("medications", MEDICATIONS), ("events", EVENTS)):
+        conn.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * len(rows[0]))})", rows)
+    load_to_sqlite.post_load(conn)
+    conn.commit()
+    yield conn
+    conn.close()
+
+@pytest.fixture(params=sorted(serialize.SERIALIZERS))
+def python_engine(request, monkeypatch):
+    """The Python builder, serialized with each available JSON serializer in turn."""
+    monkeypatch.setattr(serialize, "_dumps", serialize.SERIALIZERS[request.param])
+    monkeypatch.setattr(dmp, "DMP_ENGINE", "python")
+
+@pytest.mark.parametrize("guid", GUIDS)
+def test_single_passport(conn, python_engine, guid):
+    assert serialize.dumps(dmp.build_dmp(conn, guid)) == dmp.build_dmp_json(conn, guid).encode("utf-8")
+
+def test_unknown_patient(conn, python_engine):
+    assert dmp.build_dmp(conn, "nobody") is None
+    assert dmp.build_dmp_json(conn, "nobody") is None
+
+def test_many_passports(conn, python_engine):
+    asked = ["nobody", *reversed(GUIDS), GUIDS[0]]
+    python = {g: serialize.dumps(d) for g, d in dmp.build_dmp_many(conn, asked).items()}
+    sql = {g: text.encode("utf-8") for g, text in dmp.build_dmp_json_many(conn, asked).items()}
+    assert list(python) == list(sql) == list(reversed(GUIDS))
+    assert python == sql
+
+@pytest.mark.parametrize("page_size", [1, 3, 500])
+def test_ndjson_stream(conn, python_engine, monkeypatch, page_size):
+    python = b"".join(dmp.iter_dmp_ndjson(conn, page_size=page_size))
+    monkeypatch.setattr(dmp, "DMP_ENGINE", "sql")
+    sql = b"".join(dmp.iter_dmp_ndjson(conn, page_size=page_size))
+    assert python == sql
+    assert python.count(b"\n") == len(GUIDS)
+
+def test_same_date_rows_follow_the_guid(conn, python_engine):
+    passport = dmp.build_dmp(conn, "p-full")
+    assert [a["AppointmentGuid"] for a in passport["Appointments"]] == ["a-2", "a-1", "a-3"]
+    assert [m["MedicationGuid"] for m in passport["Medications"]] == ["m-3", "m-1", "m-2"]
+    assert [e["EventGuid"] for e in passport["Immunisations"]] == ["e-4", "e-2"]
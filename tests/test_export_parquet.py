@@ -0,0 +1,76 @@
+# tests/test_export_parquet.py
+"""export_parquet.py: offset/fractional date-times and rows without a usable date."""
+import os
+import sqlite3
+from datetime import datetime, timezone
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pytest.importorskip("pyarrow.parquet")
+
+import load_to_sqlite
+from export_parquet import NULL_PARTITION, export_table
+from parquet_query import read_table
+
+PATIENT = "p-1"
+# EventGuid -> EffectiveDateTime as stored (imported passports keep whatever was posted)
+EVENT_DATES = {
+    "e-naive": "2023-05-01T08:00:00",
+    "e-space": "2023-05-01 08:00:00",
+    "e-zulu": "2024-01-02T10:00:00Z",
+    "e-offset": "2024-01-02T10:00:00+01:00",
+    "e-fraction": "2024-01-02T10:00:00.123",
+    "e-next-year": "2024-12-31T23:30:00-05:00",
+    "e-empty": "",
+    "e-garbage": "not a date",
+}
+UTC = timezone.utc
+EXPECTED = {
+    "e-naive": datetime(2023, 5, 1, 8, 0, tzinfo=UTC),
+    "e-space": datetime(2023, 5, 1, 8, 0, tzinfo=UTC),
+    "e-zulu": datetime(2024, 1, 2, 10, 0, tzinfo=UTC),
+    "e-offset": datetime(2024, 1, 2, 9, 0, tzinfo=UTC),
+    "e-fraction": datetime(2024, 1, 2, 10, 0, 0, 123000, tzinfo=UTC),
+    "e-next-year": datetime(2025, 1, 1, 4, 30, tzinfo=UTC),
+    "e-empty": None,
+    "e-garbage": None,
+}
+
+@pytest.fixture
+def db(tmp_path):
+    path = tmp_path / "dmp.db"
+    conn = sqlite3.connect(path)
+    for stmt in load_to_sqlite.DDL:
+        conn.execute(stmt)
+    conn.execute("INSERT INTO patients (PatientGuid, Forenames, Surname, DateOfBirth, Sex, PatientType, PatientStatus) "
+                 "VALUES (?, 'Ann', 'Example', '1980-02-03', 'F', 4, 1)", (PATIENT,))
+    conn.executemany("INSERT INTO events (EventGuid, PatientGuid, EventType, Term, EffectiveDateTime) "
+                     "VALUES (?, ?, 1, 'Term', ?)", [(g, PATIENT, d) for g, d in EVENT_DATES.items()])
+    conn.commit()
+    yield conn
+    conn.close()
+
+def test_offsets_and_fractions_normalised_to_utc(db, tmp_path):
+    out = tmp_path / "parquet"
+    assert export_table(db, "events", out) == len(EVENT_DATES)
+    rows = read_table("events", out, columns=["EventGuid", "EffectiveDateTime"]).to_pylist()
+    got = {r["EventGuid"]: r["EffectiveDateTime"] for r in rows}
+    assert got == EXPECTED
+
+def test_rows_without_a_date_get_the_null_partition(db, tmp_path):
+    out = tmp_path / "parquet"
+    export_table(db, "events", out, chunk_size=3)
+    root = out / "events"
+    # nothing lands in the dataset root next to the year= folders, and no year=0
+    assert sorted(os.listdir(root)) == ["year=2023", "year=2024", "year=2025", f"year={NULL_PARTITION}"]
+    years = {r["EventGuid"]: r["year"] for r in read_table("events", out, columns=["EventGuid", "year"]).to_pylist()}
+    assert years["e-empty"] is None and years["e-garbage"] is None
+    assert years["e-next-year"] == 2025
+    assert read_table("events", out, years=[2024]).num_rows == 3
+
+def test_patients_stay_unpartitioned(db, tmp_path):
+    out = tmp_path / "parquet"
+    assert export_table(db, "patients", out) == 1
+    assert os.listdir(out / "patients") == ["part-0.parquet"]
+    assert read_table("patients", out, columns=["DateOfBirth"]).column(0).to_pylist()[0].isoformat() == "1980-02-03"
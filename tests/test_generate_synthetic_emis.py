@@ -0,0 +1,51 @@
+# tests/test_generate_synthetic_emis.py
+"""generate_synthetic_emis.py: output depends only on --seed/--as-of, and a failed run writes nothing."""
+import time
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("faker")
+pytest.importorskip("dateutil")
+import generate_synthetic_emis
+
+LOOKUPS = Path(__file__).resolve().parent.parent / "data" / "lookups_mvp"
+
+def generate(out_dir, *extra):
+    generate_synthetic_emis.main(["--patients", "40", "--shard-size", "20", "--workers", "1", "--seed", "7",
+                                  "--as-of", "2024-03-31", "--lookups", str(LOOKUPS), "--out-dir", str(out_dir),
+                                  *extra])
+    return {p.name: p.read_text(encoding="utf-8") for p in sorted(Path(out_dir).iterdir())}
+
+@pytest.fixture
+def local_tz(monkeypatch):
+    """Switch the process's local time zone for the rest of the test."""
+    def switch(name):
+        monkeypatch.setenv("TZ", name)
+        time.tzset()
+    yield switch
+    monkeypatch.undo()
+    time.tzset()
+
+def test_output_does_not_depend_on_the_local_time_zone(tmp_path, local_tz):
+    local_tz("UTC")
+    utc = generate(tmp_path / "utc")
+    local_tz("America/New_York")  # DST changes inside the five-year window
+    assert generate(tmp_path / "ny") == utc
+    local_tz("Asia/Kolkata")
+    assert generate(tmp_path / "in") == utc
+
+    appointments = utc["appointments.csv"].splitlines()[1:]
+    assert appointments and all(r.split(",")[2] <= "2024-03-31T00:00:00" for r in appointments)
+    assert not any("+00:00" in text for text in utc.values())
+
+def test_failed_run_leaves_previous_csvs_untouched(tmp_path, monkeypatch):
+    before = generate(tmp_path)
+    def boom(shard):
+        if shard[0] == 1:
+            raise RuntimeError("worker died")
+        return generate_synthetic_emis.render_shard(shard)
+    monkeypatch.setattr(generate_synthetic_emis.CsvSink, "worker_fn", staticmethod(boom))
+    with pytest.raises(RuntimeError):
+        generate(tmp_path, "--seed", "8")
+    assert {p.name: p.read_text(encoding="utf-8") for p in sorted(tmp_path.iterdir())} == before
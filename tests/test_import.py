@@ -0,0 +1,85 @@
+# tests/test_import.py
+"""Passport import (app.dmp.import_dmps): validation, upserts and partial passports."""
+import sqlite3
+
+import pytest
+
+from app.dmp import import_dmps
+
+GUID = "6f1c6a57-3b3e-4b8f-9d7e-1a2b3c4d5e6f"
+
+def passport(**fields):
+    doc = {"PatientGuid": GUID, "Name": "Ann Marie Lee", "DOB": "1970-01-01", "Sex": "F", "PostCode": "AB1 2CD",
+           "Medications": [{"term": "Aspirin", "status": "current", "startDate": "2024-01-05"}],
+           "Appointments": [{"startDateTime": "2024-03-01T09:00:00", "location": "Room 1"}],
+           "Events": [{"eventType": 13, "term": "Flu vaccine", "effectiveDateTime": "2023-10-01T00:00:00"}],
+           "Allergies": [{"term": "Penicillin", "code": "91936005", "codeSystem": "SNOMED"}]}
+    doc.update(fields)
+    return {k: v for k, v in doc.items() if v is not None}
+
+@pytest.fixture
+def conn(dmp_db):
+    conn = sqlite3.connect(dmp_db)
+    conn.execute("PRAGMA foreign_keys=ON")
+    yield conn
+    conn.close()
+
+def patient(conn):
+    return conn.execute("SELECT Forenames, Surname, DateOfBirth, Sex, PostCode, PatientType FROM patients "
+                        "WHERE PatientGuid = ?", (GUID,)).fetchone()
+
+def counts(conn):
+    return tuple(conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                 for t in ("patients", "medications", "appointments", "events"))
+
+def test_import_inserts_every_table(conn):
+    assert [r["status"] for r in import_dmps(conn, [passport()])] == ["imported"]
+    assert patient(conn) == ("Ann Marie", "Lee", "1970-01-01", "F", "AB1 2CD", 4)
+    assert counts(conn) == (1, 1, 1, 2)  # the allergy becomes an EventType 11 event
+
+def test_reimport_is_idempotent(conn):
+    import_dmps(conn, [passport()])
+    before = counts(conn)
+    assert import_dmps(conn, [passport(), passport()])[1]["status"] == "imported"
+    assert counts(conn) == before
+
+def test_reimport_updates_the_patient_and_keeps_uncarried_codes(conn):
+    import_dmps(conn, [passport()])
+    conn.execute("UPDATE patients SET PatientType = 2 WHERE PatientGuid = ?", (GUID,))
+    conn.commit()
+    import_dmps(conn, [passport(Name="Ann Smith", DOB="1970-01-02", Sex="I", PostCode="ZZ9 9ZZ")])
+    assert patient(conn) == ("Ann", "Smith", "1970-01-02", "I", "ZZ9 9ZZ", 2)
+
+def test_partial_passport_keeps_stored_sex_and_postcode(conn):
+    import_dmps(conn, [passport()])
+    assert import_dmps(conn, [passport(Sex=None, PostCode=None)])[0]["status"] == "imported"
+    assert patient(conn)[3:5] == ("F", "AB1 2CD")
+
+def test_new_patient_without_sex_gets_unknown(conn):
+    import_dmps(conn, [passport(Sex=None, PostCode=None)])
+    assert patient(conn)[3:5] == ("U", None)
+
+@pytest.mark.parametrize("field, value, error", [
+    ("PatientGuid", "x", "PatientGuid: 'x' is not a 'uuid'"),
+    ("DOB", "1970", "DOB: '1970' is not a 'date'"),
+    ("Name", "   ", "Name: '   ' does not match"),
+    ("Appointments", [{"startDateTime": "2024-03-01"}], "Appointments/0/startDateTime: '2024-03-01' is not a 'date-time'"),
+    ("Medications", [{"term": "X", "status": "current", "startDate": "2024-02-30"}],
+     "Medications/0/startDate: '2024-02-30' is not a 'date'"),
+])
+def test_malformed_values_are_rejected(conn, field, value, error):
+    res = import_dmps(conn, [passport(**{field: value})])[0]
+    assert res["status"] == "invalid"
+    assert any(e.startswith(error) for e in res["errors"]), res["errors"]
+    assert counts(conn) == (0, 0, 0, 0)
+
+def test_offset_date_times_are_accepted(conn):
+    doc = passport(Appointments=[{"startDateTime": "2024-03-01T09:00:00Z", "endDateTime": "2024-03-01 09:30:00+01:00"}])
+    assert import_dmps(conn, [doc])[0]["status"] == "imported"
+
+def test_one_bad_record_does_not_sink_the_batch(conn):
+    other = "0b5a1c9e-2f6d-4c3b-8a7e-9d8c7b6a5f4e"
+    res = import_dmps(conn, [passport(), "not an object", passport(PatientGuid=other, DOB="nope"),
+                             passport(PatientGuid=other)])
+    assert [r["status"] for r in res] == ["imported", "invalid", "invalid", "imported"]
+    assert counts(conn)[0] == 2
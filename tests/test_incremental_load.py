@@ -0,0 +1,95 @@
+# tests/test_incremental_load.py
+"""load_to_sqlite.py --incremental: unchanged files are skipped, changed files only upsert changed rows."""
+import csv
+import sqlite3
+
+import pytest
+
+import load_to_sqlite
+from load_to_sqlite import TABLES, load_incremental
+
+PATIENTS = [
+    ["p-1", "Ann", "Gill", "1970-01-01", "F", "AB1 2CD", "", "4", "1", "4000000001"],
+    ["p-2", "Bob", "Lee", "1980-02-02", "M", "EF3 4GH", "", "4", "1", "4000000002"],
+]
+APPOINTMENTS = [["a-1", "p-1", "2024-01-01T09:00:00", "2024-01-01T09:10:00", "1", "Room 1"]]
+MEDICATIONS = [["m-1", "p-2", "Atorvastatin 20mg tablet", "One daily", "1", "1", "2024-02-01T10:00:00"]]
+EVENTS = [["e-1", "p-1", "2", "Blood pressure", "", "", "2024-03-01T11:00:00"]]
+
+def write(data_dir, table, rows):
+    fname, columns = TABLES[table]
+    with open(data_dir / fname, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(columns)
+        w.writerows(rows)
+
+@pytest.fixture
+def data_dir(tmp_path):
+    d = tmp_path / "data"
+    d.mkdir()
+    for table, rows in (("patients", PATIENTS), ("appointments", APPOINTMENTS),
+                        ("medications", MEDICATIONS), ("events", EVENTS)):
+        write(d, table, rows)
+    return d
+
+@pytest.fixture
+def conn(dmp_db):
+    c = sqlite3.connect(dmp_db)
+    yield c
+    c.close()
+
+def versions(conn):
+    return dict(conn.execute("SELECT PatientGuid, Version FROM patient_versions"))
+
+def test_first_delta_loads_everything_then_skips_unchanged_files(conn, data_dir):
+    stats = load_incremental(conn, data_dir)
+    assert stats["patients"] == {"status": "loaded", "rows": 2, "upserted": 2}
+    assert stats["events"] == {"status": "loaded", "rows": 1, "upserted": 1}
+    assert dict(conn.execute("SELECT FileName, RowCount FROM load_manifest")) == {
+        "patients.csv": 2, "appointments.csv": 1, "medications.csv": 1, "events.csv": 1}
+
+    before = versions(conn)
+    assert load_incremental(conn, data_dir) == {t: {"status": "unchanged"} for t in TABLES}
+    assert versions(conn) == before
+
+def test_changed_file_upserts_only_changed_rows(conn, data_dir):
+    load_incremental(conn, data_dir)
+    before = versions(conn)
+    write(data_dir, "patients", [PATIENTS[0], [*PATIENTS[1][:2], "Hillman", *PATIENTS[1][3:]],
+                                 ["p-3", "Cy", "Ng", "1990-03-03", "U", "", "", "4", "1", ""]])
+    stats = load_incremental(conn, data_dir)
+
+    assert stats["patients"] == {"status": "loaded", "rows": 3, "upserted": 2}
+    assert all(stats[t] == {"status": "unchanged"} for t in ("appointments", "medications", "events"))
+    after = versions(conn)
+    assert after["p-1"] == before["p-1"]  # identical row: not rewritten
+    assert after["p-2"] > before["p-2"] and "p-3" in after
+    assert conn.execute("SELECT Surname FROM patients WHERE PatientGuid = 'p-2'").fetchone() == ("Hillman",)
+    # the name index and the summary follow the upserts
+    assert conn.execute("SELECT rowid FROM patients_fts WHERE patients_fts MATCH '\"illma\"'").fetchone() == \
+        conn.execute("SELECT rowid FROM patients WHERE PatientGuid = 'p-2'").fetchone()
+    assert conn.execute("SELECT COUNT(*) FROM patient_summary").fetchone() == (3,)
+    assert conn.execute("SELECT RowCount FROM load_manifest WHERE FileName = 'patients.csv'").fetchone() == (3,)
+
+def test_rows_missing_from_the_feed_are_kept(conn, data_dir):
+    load_incremental(conn, data_dir)
+    write(data_dir, "patients", PATIENTS[:1])
+    assert load_incremental(conn, data_dir)["patients"] == {"status": "loaded", "rows": 1, "upserted": 0}
+    assert conn.execute("SELECT COUNT(*) FROM patients").fetchone() == (2,)
+
+def test_delta_after_a_full_load(conn, data_dir):
+    # what a full load leaves: rows and manifest, but no row hashes
+    counts = load_to_sqlite.load_serial(conn, data_dir)
+    for table, (fname, _cols) in TABLES.items():
+        load_to_sqlite.record_manifest(conn, fname, load_to_sqlite.file_sha256(data_dir/fname), counts[table])
+    conn.commit()
+
+    assert load_incremental(conn, data_dir) == {t: {"status": "unchanged"} for t in TABLES}
+    assert conn.execute("SELECT COUNT(*) FROM row_hashes").fetchone() == (0,)
+
+    # a touched file with the same rows: hashed against the database, nothing upserted
+    write(data_dir, "patients", PATIENTS[::-1])
+    before = versions(conn)
+    assert load_incremental(conn, data_dir)["patients"] == {"status": "loaded", "rows": 2, "upserted": 0}
+    assert versions(conn) == before
+    assert conn.execute("SELECT COUNT(*) FROM row_hashes WHERE TableName = 'patients'").fetchone() == (2,)
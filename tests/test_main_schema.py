@@ -0,0 +1,43 @@
+# tests/test_main_schema.py
+"""app/main.py: child-table queries use the column each table declares as its Patients foreign key."""
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("fastapi")
+from app.main import SchemaCache, patient_fk
+
+SCHEMA_SQL = Path(__file__).resolve().parent.parent / "docs" / "schema.sql"
+
+CHILD_FK_SCHEMA = """
+CREATE TABLE Patients (PatientGuid TEXT PRIMARY KEY, FirstName TEXT, LastName TEXT, DateOfBirth TEXT);
+CREATE TABLE Appointments (appointment_id TEXT, PatientGuid TEXT REFERENCES Patients(PatientGuid),
+                           date TEXT, doctor TEXT, reason TEXT);
+CREATE TABLE Medications (medication_id TEXT, owner TEXT REFERENCES patients(PatientGuid),
+                          drug_name TEXT, dose TEXT, start_date TEXT, end_date TEXT);
+CREATE TABLE Events (event_id TEXT, patient_id TEXT, type TEXT, details TEXT, date TEXT);
+"""
+
+def test_docs_schema_uses_patient_id(tmp_path):
+    conn = sqlite3.connect(tmp_path / "medical.db")
+    conn.executescript(SCHEMA_SQL.read_text())
+    assert [patient_fk(conn, t) for t in ("Appointments", "Medications", "Events")] == ["patient_id"] * 3
+
+def test_declared_foreign_keys_drive_the_queries(tmp_path):
+    path = tmp_path / "medical.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(CHILD_FK_SCHEMA)
+    conn.execute("INSERT INTO Patients VALUES ('g-1', 'Ann', 'Gill', '1970-01-01')")
+    conn.execute("INSERT INTO Appointments VALUES ('a-1', 'g-1', '2024-01-01', 'Dr Lee', 'Review')")
+    conn.execute("INSERT INTO Medications VALUES ('m-1', 'g-1', 'Atorvastatin', '20mg', '2024-01-01', NULL)")
+    conn.execute("INSERT INTO Events VALUES ('e-1', 'g-1', 'Allergy', 'Latex', '2024-01-02')")
+    conn.commit()
+
+    assert patient_fk(conn, "Appointments") == "PatientGuid"
+    assert patient_fk(conn, "Medications") == "owner"
+    assert patient_fk(conn, "Events") == "patient_id"  # no declared key: the default
+    mapping = SchemaCache(str(path)).get(conn)
+    assert [r[0] for r in conn.execute(mapping.sql["appointments"], ("g-1",))] == ["a-1"]
+    assert [r[0] for r in conn.execute(mapping.sql["medications"], ("g-1",))] == ["m-1"]
+    assert [r[0] for r in conn.execute(mapping.sql["events"], ("g-1",))] == ["e-1"]
@@ -0,0 +1,53 @@
+# tests/test_metrics.py
+"""app/metrics.py: only the request's own SQL counts, not the setup of a fresh connection."""
+import sqlite3
+
+import pytest
+
+from app import metrics
+
+pytestmark = pytest.mark.skipif(not metrics.ENABLED, reason="DMP_METRICS=0")
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "dmp.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE t (x)")
+    conn.execute("INSERT INTO t VALUES (1), (2)")
+    conn.commit()
+    conn.close()
+    return str(path)
+
+@pytest.fixture
+def request_metrics():
+    m = metrics.begin()
+    yield m
+    metrics.clear()
+
+@pytest.mark.parametrize("readonly", [True, False])
+def test_pool_connection_setup_is_not_counted(db_path, request_metrics, readonly):
+    from app.db import _connect
+    conn = _connect(db_path, readonly=readonly)
+    try:
+        assert request_metrics.queries == 0
+        assert [tuple(r) for r in conn.execute("SELECT x FROM t").fetchall()] == [(1,), (2,)]
+    finally:
+        conn.close()
+    assert (request_metrics.queries, request_metrics.rows) == (1, 2)
+
+def test_async_connection_setup_is_not_counted(db_path, request_metrics):
+    from app.aio_db import AsyncSQLite
+    db = AsyncSQLite(db_path)
+    try:
+        conn = db._conn()
+        assert request_metrics.queries == 0
+        conn.execute("SELECT x FROM t").fetchall()
+    finally:
+        for conn in db._conns:
+            conn.close()
+    assert (request_metrics.queries, request_metrics.rows) == (1, 2)
+
+def test_suspended_restores_the_request(request_metrics):
+    with metrics.suspended():
+        assert metrics.current() is None
+    assert metrics.current() is request_metrics
@@ -0,0 +1,66 @@
+# tests/test_passport_cache.py
+"""GET /patients/<guid>/dmp: per-patient cache, write-triggered invalidation, ETag and 304."""
+import re
+import sqlite3
+
+import pytest
+
+from app.auth import API_KEY
+
+H = {"X-API-Key": API_KEY}
+GUID = "p-1"
+
+@pytest.fixture
+def db(dmp_db):
+    conn = sqlite3.connect(dmp_db)
+    conn.execute("INSERT INTO patients (PatientGuid, Forenames, Surname, DateOfBirth, Sex, PatientType, PatientStatus) "
+                 "VALUES (?, 'Ann', 'Lee', '1970-01-01', 'F', 4, 1)", (GUID,))
+    add_appointment(conn, "a-1", "2024-01-01T09:00:00")
+    yield conn
+    conn.close()
+
+def add_appointment(conn, guid, start):
+    conn.execute("INSERT INTO appointments VALUES (?, ?, ?, ?, 1, 'Room 1')", (guid, GUID, start, start))
+    conn.commit()
+
+def queries(resp):
+    return int(re.search(r'sql;dur=[\d.]+;desc="(\d+) queries', resp.headers["Server-Timing"]).group(1))
+
+@pytest.mark.parametrize("fmt", ["json", "xml"])
+def test_cache_hit_reads_only_the_version(api_client, db, fmt):
+    first = api_client.get(f"/patients/{GUID}/dmp?format={fmt}", headers=H)
+    second = api_client.get(f"/patients/{GUID}/dmp?format={fmt}", headers=H)
+    assert first.status_code == second.status_code == 200
+    assert second.data == first.data and second.headers["ETag"] == first.headers["ETag"]
+    assert queries(first) > 1
+    assert queries(second) == 1  # patient_versions, once
+
+def test_etag_names_the_version_and_answers_304(api_client, db):
+    resp = api_client.get(f"/patients/{GUID}/dmp", headers=H)
+    version = db.execute("SELECT Version FROM patient_versions WHERE PatientGuid = ?", (GUID,)).fetchone()[0]
+    assert resp.headers["ETag"] == f'"{GUID}.{version}.json"'
+    assert resp.headers["Cache-Control"] == "private, no-cache"
+    again = api_client.get(f"/patients/{GUID}/dmp", headers={**H, "If-None-Match": resp.headers["ETag"]})
+    assert again.status_code == 304 and again.data == b""
+    assert queries(again) == 1
+
+def test_write_invalidates_cache_and_etag(api_client, db):
+    old = api_client.get(f"/patients/{GUID}/dmp", headers=H)
+    assert [a["AppointmentGuid"] for a in old.get_json()["Appointments"]] == ["a-1"]
+
+    add_appointment(db, "a-2", "2024-02-01T09:00:00")  # the trigger bumps the version
+
+    new = api_client.get(f"/patients/{GUID}/dmp", headers={**H, "If-None-Match": old.headers["ETag"]})
+    assert new.status_code == 200
+    assert new.headers["ETag"] != old.headers["ETag"]
+    assert [a["AppointmentGuid"] for a in new.get_json()["Appointments"]] == ["a-2", "a-1"]
+    assert api_client.get(f"/patients/{GUID}/dmp", headers={**H, "If-None-Match": new.headers["ETag"]}).status_code == 304
+
+def test_representations_get_their_own_etags(api_client, db):
+    etags = {api_client.get(f"/patients/{GUID}/dmp?{q}", headers=H).headers["ETag"]
+             for q in ("format=json", "format=json&pretty=1", "format=xml")}
+    assert len(etags) == 3
+
+def test_unknown_patient_is_404(api_client, db):
+    resp = api_client.get("/patients/nobody/dmp", headers=H)
+    assert resp.status_code == 404 and "ETag" not in resp.headers
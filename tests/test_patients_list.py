@@ -0,0 +1,105 @@
+# tests/test_patients_list.py
+"""GET /patients: keyset paging (cursor) and name search (trigram FTS, LIKE fallback)."""
+import base64
+import json
+import sqlite3
+
+import pytest
+
+from app.auth import API_KEY
+
+H = {"X-API-Key": API_KEY}
+# (Forenames, Surname): repeated surnames and full names, so the PatientGuid
+# tiebreak in the page order matters
+NAMES = [("Ann", "Gill"), ("Ann", "Gill"), ("Bob", "Gill"), ("Cy", "Millar"), ("Di", "Millar"), ("Ed", "Lee"),
+         ("Flo", "Lee"), ("Gus", "Abbott"), ("Hal", "Zeller"), ("Ivy", "O'Brien"), ("Jo", 'Quote"d'), ("Kim", "Ng"),
+         ("Liv", "Gillespie"), ("Max", "McGill"), ("Ned", "Ng"), ("Oz", "Ng"), ("Pam", "Lee")]
+
+@pytest.fixture
+def db(dmp_db):
+    conn = sqlite3.connect(dmp_db)
+    conn.executemany("INSERT INTO patients (PatientGuid, Forenames, Surname, DateOfBirth, Sex, PatientType, PatientStatus) "
+                     "VALUES (?, ?, ?, '1970-01-01', 'U', 4, 1)",
+                     [(f"p-{i:02d}", f, s) for i, (f, s) in reversed(list(enumerate(NAMES)))])
+    conn.commit()
+    yield conn
+    conn.close()
+
+def expected(db, where="1", params=()):
+    return [r[0] for r in db.execute(f"SELECT PatientGuid FROM patients WHERE {where} "
+                                     "ORDER BY Surname, Forenames, PatientGuid", params)]
+
+def walk(client, query=""):
+    """Every PatientGuid the listing returns, following next_cursor page by page."""
+    guids, cursor, pages = [], None, 0
+    while True:
+        url = f"/patients?limit=4{query}" + (f"&cursor={cursor}" if cursor else "")
+        resp = client.get(url, headers=H)
+        assert resp.status_code == 200, resp.get_json()
+        body = resp.get_json()
+        assert len(body["items"]) <= 4
+        guids += [p["PatientGuid"] for p in body["items"]]
+        pages += 1
+        cursor = body["paging"]["next_cursor"]
+        if cursor is None:
+            return guids, pages
+
+def test_cursor_pages_cover_everyone_once_in_order(api_client, db):
+    guids, pages = walk(api_client)
+    assert guids == expected(db)
+    assert pages == (len(NAMES) + 3) // 4
+
+def test_rows_added_behind_the_cursor_do_not_shift_later_pages(api_client, db):
+    first = api_client.get("/patients?limit=4", headers=H).get_json()
+    # sorts before everything already served: an offset would now repeat a row
+    db.execute("INSERT INTO patients (PatientGuid, Forenames, Surname, DateOfBirth, Sex, PatientType, PatientStatus) "
+               "VALUES ('p-new', 'Al', 'Aaron', '1970-01-01', 'U', 4, 1)")
+    db.commit()
+    rest = api_client.get(f"/patients?limit=100&cursor={first['paging']['next_cursor']}", headers=H).get_json()
+    served = [p["PatientGuid"] for p in first["items"] + rest["items"]]
+    assert len(served) == len(set(served)) == len(NAMES)
+    assert "p-new" not in served
+
+def test_exact_count_is_opt_in(api_client, db):
+    assert api_client.get("/patients", headers=H).get_json()["paging"]["total"] is None
+    assert api_client.get("/patients?count=exact", headers=H).get_json()["paging"]["total"] == len(NAMES)
+
+@pytest.mark.parametrize("cursor", [
+    "not-base64!",
+    base64.urlsafe_b64encode(b"{not json").decode(),
+    base64.urlsafe_b64encode(json.dumps({"a": 1}).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps(["Gill", "Ann"]).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps(["Gill", "Ann", 3]).encode()).decode(),
+])
+def test_bad_cursor_is_400(api_client, db, cursor):
+    resp = api_client.get(f"/patients?cursor={cursor}", headers=H)
+    assert resp.status_code == 400
+    assert resp.get_json() == {"error": "Invalid cursor"}
+
+@pytest.mark.parametrize("q, like", [
+    ("gill", "%gill%"),    # trigram index: substring, case-insensitive
+    ("ILL", "%ill%"),
+    ("Ng", "%ng%"),        # under 3 characters: LIKE
+    ("o'b", "%o'b%"),
+    ('e"d', '%e"d%'),      # quotes are literal, not FTS syntax
+    ("zzz", "%zzz%"),
+])
+def test_name_search_matches_substrings(api_client, db, q, like):
+    want = expected(db, "Surname LIKE ? OR Forenames LIKE ?", (like, like))
+    assert walk(api_client, f"&q={q}")[0] == want
+
+def test_search_follows_name_changes(api_client, db):
+    db.execute("UPDATE patients SET Surname = 'Hillman' WHERE PatientGuid = 'p-05'")
+    db.commit()
+    found = [p["PatientGuid"] for p in api_client.get("/patients?q=illma", headers=H).get_json()["items"]]
+    assert found == ["p-05"]
+
+def test_like_fallback_without_the_search_index(api_client, db):
+    with_index = walk(api_client, "&q=gill&count=exact")[0]
+    for (name,) in db.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_patients_fts%'"
+                              ).fetchall():
+        db.execute(f"DROP TRIGGER {name}")
+    db.execute("DROP TABLE patients_fts")
+    db.commit()
+    assert walk(api_client, "&q=gill")[0] == with_index
+    assert api_client.get("/patients?q=gill&count=exact", headers=H).get_json()["paging"]["total"] == len(with_index)
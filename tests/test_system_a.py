@@ -0,0 +1,91 @@
+# tests/test_system_a.py
+"""system_a.py: Accept negotiation (q-values, specificity, 406) and the versioned bundle store."""
+import sqlite3
+
+import pytest
+
+pytest.importorskip("httpx")
+from fastapi.testclient import TestClient
+
+import system_a
+from system_a import negotiate
+
+@pytest.mark.parametrize("accept, fmt", [
+    ("", "json"),
+    ("*/*", "json"),
+    ("application/json", "json"),
+    ("application/xml", "xml"),
+    ("text/xml", "xml"),
+    ("text/*", "xml"),
+    ("application/xml;q=0.9, application/json;q=0.8", "xml"),
+    ("application/json;q=0.5, application/xml", "xml"),
+    ("application/json; q=0.5, */*; q=0.6", "xml"),  # json is capped by its own range
+    ("application/json;q=0, */*", "xml"),
+    ("Application/XML", "xml"),
+    ("application/xml;q=0.5, application/json;q=0.5", "json"),  # ties: JSON first
+    ("text/html, application/xhtml+xml, application/xml;q=0.9, */*;q=0.8", "xml"),
+    ("text/html", None),
+    ("application/json;q=0, application/xml;q=0", None),
+    ("*/*;q=0", None),
+    ("application/json;q=oops", None),
+])
+def test_negotiate(accept, fmt):
+    assert negotiate(accept) == fmt
+
+@pytest.fixture
+def demo_client(tmp_path, monkeypatch):
+    monkeypatch.setattr(system_a, "DB_PATH", str(tmp_path / "missing.db"))  # demo patients
+    with TestClient(system_a.app) as c:
+        yield c
+
+@pytest.mark.parametrize("accept, media", [
+    (None, "application/json"),
+    ("application/xml;q=1, application/json;q=0.1", "application/xml"),
+    ("text/xml", "application/xml"),
+])
+def test_passport_follows_accept(demo_client, accept, media):
+    resp = demo_client.get("/patients/P-001/passport", headers={"Accept": accept} if accept else {})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith(media)
+    assert resp.headers["vary"] == "Accept"
+    if media == "application/json":
+        assert resp.json()["patient"]["id"] == "P-001"
+    else:
+        assert resp.text.startswith("<passport>") and "<id>P-001</id>" in resp.text
+
+def test_unacceptable_type_is_406(demo_client):
+    resp = demo_client.get("/patients/P-001/passport", headers={"Accept": "text/html, application/json;q=0"})
+    assert resp.status_code == 406
+
+def test_format_param_overrides_accept(demo_client):
+    resp = demo_client.get("/patients/P-001/passport?format=XML", headers={"Accept": "text/html"})
+    assert resp.status_code == 200 and resp.headers["content-type"].startswith("application/xml")
+    assert demo_client.get("/patients/P-001/passport?format=yaml").status_code == 400
+
+def test_etag_is_per_format_and_answers_304(demo_client):
+    json_tag = demo_client.get("/patients/P-001/passport").headers["etag"]
+    xml_tag = demo_client.get("/patients/P-001/passport", headers={"Accept": "application/xml"}).headers["etag"]
+    assert json_tag != xml_tag
+    resp = demo_client.get("/patients/P-001/passport", headers={"If-None-Match": json_tag})
+    assert resp.status_code == 304 and resp.headers["etag"] == json_tag and not resp.content
+    assert demo_client.get("/patients/P-001/passport",
+                           headers={"If-None-Match": json_tag, "Accept": "application/xml"}).status_code == 200
+
+def test_store_rebuilds_bundles_when_the_patient_changes(dmp_db, monkeypatch):
+    with sqlite3.connect(dmp_db) as conn:
+        conn.execute("INSERT INTO patients (PatientGuid, Forenames, Surname, DateOfBirth, Sex, PatientType, PatientStatus) "
+                     "VALUES ('p-1', 'Ann', 'Gill', '1970-01-01', 'F', 4, 1)")
+    conn.close()
+    monkeypatch.setattr(system_a, "DB_PATH", dmp_db)
+    with TestClient(system_a.app) as client:
+        first = client.get("/patients/p-1/passport")
+        assert first.json()["patient"]["name"] == [{"text": "Ann Gill"}]
+        assert client.get("/patients/p-1/passport", headers={"If-None-Match": first.headers["etag"]}).status_code == 304
+
+        with sqlite3.connect(dmp_db) as conn:
+            conn.execute("UPDATE patients SET Surname = 'Hill' WHERE PatientGuid = 'p-1'")
+        conn.close()
+        second = client.get("/patients/p-1/passport", headers={"If-None-Match": first.headers["etag"]})
+        assert second.status_code == 200 and second.headers["etag"] != first.headers["etag"]
+        assert second.json()["patient"]["name"] == [{"text": "Ann Hill"}]
+        assert client.get("/patients/nobody/passport").status_code == 404
@@ -0,0 +1,77 @@
+# tests/test_system_b.py
+"""system_b.py: malformed bulk records and failing rows are rejected one by one."""
+import sqlite3
+
+import pytest
+
+pytest.importorskip("httpx")
+from fastapi.testclient import TestClient
+
+import system_b
+
+AUTH = {"Authorization": f"Bearer {system_b.DUMMY_TOKEN}"}
+
+def bundle(pid, name="Patient", birth="1985-03-18"):
+    return {"patient": {"resourceType": "Patient", "id": pid, "name": [{"text": name}], "birthDate": birth}}
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # DB_FILE is relative
+    with TestClient(system_b.app) as c:
+        yield c
+
+def stored_ids():
+    with sqlite3.connect(system_b.DB_FILE) as conn:
+        return sorted(r[0] for r in conn.execute("SELECT id FROM patients"))
+
+@pytest.mark.parametrize("payload", [
+    {"patient": "str"},
+    {"patient": {"id": "P-1", "name": ["bob"]}},
+    {"patient": {"id": {"a": 1}}},
+    {"patient": {"id": 7}},
+    {"patient": {"id": "  "}},
+    {"patient": {"id": "P-1", "name": {"text": "bob"}}},
+    {"patient": {"id": "P-1", "birthDate": 1985}},
+    "not an object",
+])
+def test_patient_row_rejects_malformed_records(payload):
+    with pytest.raises(system_b.HTTPException) as exc:
+        system_b.patient_row(payload)
+    assert exc.value.status_code == 422
+
+def test_patient_row_accepts_plain_and_fhir_names():
+    assert system_b.patient_row(bundle(" P-1 ", " Ann ")) == ("P-1", "Ann", "1985-03-18")
+    assert system_b.patient_row({"patient": {"id": "P-2", "name": "Bob"}}) == ("P-2", "Bob", "")
+    assert system_b.patient_row({"patient": {"id": "P-3", "name": []}}) == ("P-3", "", "")
+
+def test_bulk_import_reports_malformed_records_individually(client):
+    payloads = [bundle("P-1"), {"patient": "str"}, {"patient": {"id": "P-2", "name": ["bob"]}},
+                {"patient": {"id": {"a": 1}}}, bundle("P-3")]
+    resp = client.post("/import/passports?wait=true", json=payloads, headers=AUTH)
+    assert resp.status_code == 200
+    body = resp.json()
+    assert [r["status"] for r in body["results"]] == ["imported", "invalid", "invalid", "invalid", "imported"]
+    assert (body["accepted"], body["rejected"]) == (2, 3)
+    assert stored_ids() == ["P-1", "P-3"]
+
+def test_single_import_rejects_malformed_record(client):
+    resp = client.post("/import/passport", json={"patient": {"id": "P-1", "name": ["bob"]}}, headers=AUTH)
+    assert resp.status_code == 422
+
+def test_failed_group_commit_only_rejects_the_bad_submission(tmp_path):
+    writer = system_b.PassportWriter(str(tmp_path / "b.db"), wait=0.05)
+    # queued before the thread starts, so all three land in one group commit
+    good1 = writer.submit([("P-1", "Ann", "")])
+    bad = writer.submit([("P-2", {"not": "bindable"}, "")])
+    good2 = writer.submit([("P-3", "Cy", ""), ("P-4", "Di", "")])
+    writer.start()
+    writer.stop()
+
+    assert good1.result() == 1 and good2.result() == 2
+    assert isinstance(bad.exception(), sqlite3.Error)
+    with sqlite3.connect(tmp_path / "b.db") as conn:
+        assert sorted(r[0] for r in conn.execute("SELECT id FROM patients")) == ["P-1", "P-3", "P-4"]
+    status = writer.status()
+    assert (status["persisted_rows"], status["failed_rows"], status["failed_batches"]) == (3, 1, 1)
+    assert status["split_commits"] == 1 and status["pending_rows"] == 0
+    assert status["last_error"]["error"].startswith("ProgrammingError")
@@ -15,18 +15,18 @@ summary = {
     "appointments": count("appointments"),
     "medications": count("medications"),
     "events": count("events"),
+    "patient_summary": count("patient_summary"),
 }
 
 # Check for foreign key violations
 fk_violations = cur.execute("PRAGMA foreign_key_check;").fetchall()
 
-# Simple join test: top 5 patients by appointment count
+# Top 5 patients by appointment count (pre-aggregated summary; one row per patient)
 top_appt = cur.execute("""
-  SELECT p.Surname, p.Forenames, COUNT(a.AppointmentGuid) AS appt_count
-  FROM patients p LEFT JOIN appointments a
-    ON a.PatientGuid = p.PatientGuid
-  GROUP BY p.PatientGuid
-  ORDER BY appt_count DESC
+  SELECT p.Surname, p.Forenames, s.AppointmentCount AS appt_count
+  FROM patient_summary s JOIN patients p
+    ON p.PatientGuid = s.PatientGuid
+  ORDER BY s.AppointmentCount DESC
   LIMIT 5;
 """).fetchall()
 